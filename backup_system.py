@@ -1,102 +1,228 @@
-# utils/backup_system.py
+# backup_system.py
+"""
+Local backup tier.
+
+Every changed user record is appended as a new version to an append-only
+pack file (db/backups/users.pack). A manifest keeps, per user, the content
+hash and the offset of the latest version, so unchanged users are skipped
+with a dict lookup and no file is opened. When the pack grows past
+COMPACT_RATIO times the size of the live versions it is compacted.
+
+The manifest is only written every MANIFEST_SAVE_EVERY appends, after a
+compaction and on shutdown (save_manifest); records appended after the last
+save are replayed from the pack on the next load.
+
+Uploads to the Telegram channel are done by utils/backup.py; its restore
+reads a user from the pack when the local version matches the channel copy
+(no download) or the download fails.
+"""
 import os
-import shutil
 import json
-import aiofiles
+import struct
 import asyncio
-from config import DATA_FOLDER, BACKUP_CHANNEL_ID, BOT_TOKEN
-from telegram import Bot
-from telegram.constants import ChatAction
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import DATA_FOLDER
+from utils.backup import content_hash
 
 # Local backup folder inside bot directory
 BACKUP_FOLDER = os.path.join(DATA_FOLDER, "backups")
 os.makedirs(BACKUP_FOLDER, exist_ok=True)
 
-# Track last Telegram message per user
-USER_MESSAGE_ID_FILE = os.path.join(BACKUP_FOLDER, "user_messages.json")
+PACK_FILE = os.path.join(BACKUP_FOLDER, "users.pack")
+MANIFEST_FILE = os.path.join(BACKUP_FOLDER, "manifest.json")
 
+# record = header (user_id, payload length) + JSON payload
+RECORD_HEADER = struct.Struct("<qI")
+COMPACT_RATIO = 3
+COMPACT_MIN_BYTES = 8 * 1024 * 1024
+MANIFEST_SAVE_EVERY = 100  # appends between manifest writes
 
-async def load_user_messages() -> dict:
-    """Load the mapping of user_id -> last backup message id"""
-    if not os.path.exists(USER_MESSAGE_ID_FILE):
-        return {}
-    async with aiofiles.open(USER_MESSAGE_ID_FILE, "r", encoding="utf-8") as f:
-        try:
-            text = await f.read()
-            return json.loads(text)
-        except:
-            return {}
+_lock = threading.Lock()
+_manifest: Optional[Dict[str, Any]] = None  # {"pack_size", "live_bytes", "users": {uid: [hash, offset, length, version]}}
+_unsaved_appends = 0
 
 
-async def save_user_messages(data: dict):
-    """Save the mapping of user_id -> last backup message id"""
-    tmp_file = USER_MESSAGE_ID_FILE + ".tmp"
-    async with aiofiles.open(tmp_file, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
-    os.replace(tmp_file, USER_MESSAGE_ID_FILE)
-
-
-async def backup_user_data(user_id: int, user_file_path: str):
+# ------------------ MANIFEST ------------------
+def _scan_pack(manifest: Dict[str, Any], start: int) -> None:
+    """Replay records appended after the manifest was last saved (e.g. after a crash)."""
+    if not os.path.exists(PACK_FILE):
+        return
+    users = manifest["users"]
+    with open(PACK_FILE, "rb") as f:
+        f.seek(start)
+        offset = start
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            user_id, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                break  # torn write at the end of the pack
+            try:
+                digest = content_hash(json.loads(payload))
+            except Exception:
+                digest = None
+            key = str(user_id)
+            prev = users.get(key)
+            if prev:
+                manifest["live_bytes"] -= RECORD_HEADER.size + prev[2]
+            users[key] = [digest, offset, length, (prev[3] + 1) if prev else 1]
+            manifest["live_bytes"] += RECORD_HEADER.size + length
+            offset += RECORD_HEADER.size + length
+        manifest["pack_size"] = offset
+
+
+def _load_manifest() -> Dict[str, Any]:
+    global _manifest
+    if _manifest is None:
+        manifest = {"pack_size": 0, "live_bytes": 0, "users": {}}
+        if os.path.exists(MANIFEST_FILE):
+            try:
+                with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception:
+                manifest = {"pack_size": 0, "live_bytes": 0, "users": {}}
+        pack_size = os.path.getsize(PACK_FILE) if os.path.exists(PACK_FILE) else 0
+        if pack_size < manifest["pack_size"]:
+            # pack was replaced or truncated: rebuild from scratch
+            manifest = {"pack_size": 0, "live_bytes": 0, "users": {}}
+        if pack_size > manifest["pack_size"]:
+            _scan_pack(manifest, manifest["pack_size"])
+        _manifest = manifest
+    return _manifest
+
+
+def _save_manifest(manifest: Dict[str, Any]) -> None:
+    global _unsaved_appends
+    _unsaved_appends = 0
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp_file, MANIFEST_FILE)
+
+
+# ------------------ WRITE ------------------
+def _append_records(records: List[Tuple[int, str, bytes]]) -> int:
+    """Append (user_id, hash, payload) records whose hash changed to the pack. Returns number written."""
+    with _lock:
+        manifest = _load_manifest()
+        users = manifest["users"]
+        records = [r for r in records if not _unchanged(users, r[0], r[1])]
+        if not records:
+            return 0
+        offset = manifest["pack_size"]
+        with open(PACK_FILE, "ab") as f:
+            for user_id, digest, payload in records:
+                f.write(RECORD_HEADER.pack(user_id, len(payload)))
+                f.write(payload)
+                key = str(user_id)
+                prev = users.get(key)
+                if prev:
+                    manifest["live_bytes"] -= RECORD_HEADER.size + prev[2]
+                users[key] = [digest, offset, len(payload), (prev[3] + 1) if prev else 1]
+                manifest["live_bytes"] += RECORD_HEADER.size + len(payload)
+                offset += RECORD_HEADER.size + len(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        manifest["pack_size"] = offset
+
+        global _unsaved_appends
+        _unsaved_appends += 1
+        if offset > COMPACT_MIN_BYTES and offset > COMPACT_RATIO * manifest["live_bytes"]:
+            _compact(manifest)  # saves the manifest
+        elif _unsaved_appends >= MANIFEST_SAVE_EVERY:
+            _save_manifest(manifest)
+    return len(records)
+
+
+def save_manifest() -> None:
+    """Persist the manifest if appends are pending (call on shutdown)."""
+    with _lock:
+        if _manifest is not None and _unsaved_appends:
+            _save_manifest(_manifest)
+
+
+def _compact(manifest: Dict[str, Any]) -> None:
+    """Rewrite the pack keeping only the latest version of every user (lock held)."""
+    tmp_pack = PACK_FILE + ".tmp"
+    users = manifest["users"]
+    offset = 0
+    with open(PACK_FILE, "rb") as src, open(tmp_pack, "wb") as dst:
+        for key, (digest, old_offset, length, version) in users.items():
+            src.seek(old_offset)
+            dst.write(src.read(RECORD_HEADER.size + length))
+            users[key] = [digest, offset, length, version]
+            offset += RECORD_HEADER.size + length
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_pack, PACK_FILE)
+    manifest["pack_size"] = offset
+    manifest["live_bytes"] = offset
+    _save_manifest(manifest)
+    print(f"[Backup] Compacted local pack to {offset} bytes ({len(users)} users)")
+
+
+def backup_user_data(user_id: int, data: Dict[str, Any]) -> bool:
     """
-    Backup a user's data:
-      1️⃣ Local backup in /backups
-      2️⃣ Upload to Telegram backup channel (single file per user)
-         -> Deletes old backup message first
-         -> Only sends if content changed
+    Local backup of one user (blocking).
+    Returns False without touching any file if the content hash is unchanged.
     """
-    # 1️⃣ Local backup copy
-    backup_path = os.path.join(BACKUP_FOLDER, f"{user_id}.json")
-
-    # Check if file changed
-    send_backup = True
-    if os.path.exists(backup_path):
-        async with aiofiles.open(backup_path, "r", encoding="utf-8") as f:
-            old_data = await f.read()
-        async with aiofiles.open(user_file_path, "r", encoding="utf-8") as f:
-            new_data = await f.read()
-        if old_data == new_data:
-            send_backup = False  # No changes, skip sending
-
-    shutil.copy(user_file_path, backup_path)
-    print(f"[Backup] Local backup created for user {user_id} at {backup_path}")
-
-    if not send_backup:
-        print(f"[Backup] No changes detected for user {user_id}, skipping Telegram upload")
-        return
+    return backup_users([(user_id, data)]) > 0
 
-    # 2️⃣ Telegram backup
-    if BACKUP_CHANNEL_ID and BOT_TOKEN:
-        bot = Bot(token=BOT_TOKEN)
-        user_messages = await load_user_messages()
-        prev_msg_id = user_messages.get(str(user_id))
 
-        # Delete old backup message
-        if prev_msg_id:
-            try:
-                await bot.delete_message(chat_id=BACKUP_CHANNEL_ID, message_id=prev_msg_id)
-                print(f"[Backup] Deleted previous backup message {prev_msg_id} for user {user_id}")
-            except Exception as e:
-                print(f"[Backup] Could not delete previous message {prev_msg_id}: {e}")
-
-        # Send new backup
-        try:
-            async with aiofiles.open(backup_path, "rb") as f:
-                data_bytes = await f.read()
-
-            sent = await bot.send_document(
-                chat_id=BACKUP_CHANNEL_ID,
-                document=data_bytes,
-                filename=f"{user_id}.json",
-                caption=f"Backup for user {user_id}"
-            )
-
-            # Save new message id
-            user_messages[str(user_id)] = sent.message_id
-            await save_user_messages(user_messages)
-            print(f"[Backup] User {user_id} backup sent to Telegram channel {BACKUP_CHANNEL_ID}")
-
-        except Exception as e:
-            print(f"[Backup] Failed to send backup to Telegram: {e}")
-def backup_user_data_sync(user_id: int, user_file_path: str):
+def backup_users(users: Iterable[Tuple[int, Dict[str, Any]]]) -> int:
+    """Local backup of many users (blocking). Returns number of new versions written."""
+    records = _changed_records(users, None)
+    return _append_records(records) if records else 0
+
+
+def _unchanged(known: Dict[str, list], user_id: int, digest: str) -> bool:
+    prev = known.get(str(user_id))
+    return bool(prev) and prev[0] == digest
+
+
+def _changed_records(users: Iterable[Tuple[int, Dict[str, Any]]],
+                     known: Optional[Dict[str, list]]) -> List[Tuple[int, str, bytes]]:
+    """Encode users, skipping those whose hash matches `known` (None: let _append_records decide)."""
+    records = []
+    for user_id, data in users:
+        digest = content_hash(data)
+        if known is not None and _unchanged(known, user_id, digest):
+            continue  # No changes, skip
+        records.append((int(user_id), digest, json.dumps(data, ensure_ascii=False).encode("utf-8")))
+    return records
+
+
+async def backup_users_async(users: Iterable[Tuple[int, Dict[str, Any]]]) -> int:
+    """
+    Hash on the caller's thread (dicts may change later), write the pack in a
+    worker thread. The event loop never takes _lock: a writer thread holds it
+    across fsync and compaction. Digests are pre-filtered against the loaded
+    manifest without the lock (entries are replaced, never mutated) and
+    checked again under it.
+    """
+    known = _manifest["users"] if _manifest is not None else None
+    records = _changed_records(users, known)
+    if not records:
+        return 0
+    return await asyncio.to_thread(_append_records, records)
+
+
+# ------------------ READ ------------------
+def read_user_backup(user_id: int) -> Optional[Dict[str, Any]]:
+    """Latest locally backed-up version of a user, or None."""
+    with _lock:
+        entry = _load_manifest()["users"].get(str(user_id))
+        if not entry:
+            return None
+        with open(PACK_FILE, "rb") as f:
+            f.seek(entry[1] + RECORD_HEADER.size)
+            payload = f.read(entry[2])
+    return json.loads(payload)
+
+
+def backup_user_data_sync(user_id: int, data: Dict[str, Any]):
     """Synchronous wrapper"""
-    asyncio.run(backup_user_data(user_id, user_file_path))
+    return backup_user_data(user_id, data)
@@ -0,0 +1,120 @@
+# benchmarks/access_pipeline.py
+"""
+Benchmark the gated request path (utils.checks.ensure_access) end to end:
+force-join check, profile load, pure checks, usage increment and the single
+commit, plus the periodic flush to SQLite.
+
+Runs against a throwaway database in a temp directory; Telegram is replaced
+by a fake bot that sleeps like a get_chat_member round trip.
+
+    python benchmarks/access_pipeline.py --users 2000 --requests 50000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(status="member")
+
+
+class FakeMessage:
+    async def reply_text(self, *args, **kwargs):
+        pass
+
+
+def fake_update(user_id):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_message=FakeMessage(),
+        callback_query=None,
+    )
+
+
+def pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+async def run(args):
+    from utils import db, checks
+
+    db.init_db()
+    for uid in range(1, args.users + 1):
+        async with db.user_txn(uid) as user:
+            user["sponsor_verified"] = True
+            user["plan"] = {"name": "premium"}  # unlimited: every request is counted
+    await db.flush_users()
+
+    saves = 0
+    real_save = checks.save_user
+
+    async def counting_save(user_id, data, backup_sync=True):
+        nonlocal saves
+        saves += 1
+        await real_save(user_id, data, backup_sync)
+    checks.save_user = counting_save
+
+    bot = FakeBot(args.latency / 1000)
+    context = SimpleNamespace(bot=bot)
+    latencies = []
+    denied = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def request(i):
+        nonlocal denied
+        user_id = i % args.users + 1
+        async with sem:
+            started = time.perf_counter()
+            ok = await checks.ensure_access(fake_update(user_id), context, mode="video",
+                                            consume=checks.USAGE_COUNTERS["video"])
+            latencies.append(time.perf_counter() - started)
+            denied += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    flush_started = time.perf_counter()
+    flushed = await db.flush_users()
+    flush_ms = (time.perf_counter() - flush_started) * 1000
+
+    latencies.sort()
+    print(f"requests        {args.requests} over {args.users} users, concurrency {args.concurrency}")
+    print(f"throughput      {args.requests / elapsed:,.0f} req/s ({elapsed:.2f} s)")
+    print(f"latency         p50 {pct(latencies, 0.50):.2f} ms / p99 {pct(latencies, 0.99):.2f} ms")
+    print(f"user writes     {saves} ({saves / args.requests:.2f} per request), denied {denied}")
+    print(f"get_chat_member {bot.calls} calls")
+    print(f"flush           {flushed} users in {flush_ms:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=50.0, help="fake get_chat_member latency, ms")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="access_bench_")
+    os.chdir(workdir)  # bot.db / videos.db are relative paths
+    import config
+    config.DATA_FOLDER = os.path.join(workdir, "db")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
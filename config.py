@@ -38,5 +38,47 @@ DATA_FOLDER = os.path.join(os.path.dirname(__file__), "db")
 # Backup index filename (used for pinned message content)
 INDEX_FILENAME = "backup_index"
 
+# "per_user": upload each changed user; "snapshot": periodic gzip JSONL snapshots
+BACKUP_MODE = os.getenv("BACKUP_MODE", "per_user").strip().lower()
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "15").strip() or 15)  # minutes
+SNAPSHOT_MAX_DELTAS = int(os.getenv("SNAPSHOT_MAX_DELTAS", "12").strip() or 12)  # deltas before a new base
+
+# Concurrent downloads during /restore_db
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", "8").strip() or 8)
+
+# Saves of the same user within this window are coalesced into one backup upload
+BACKUP_DEBOUNCE = int(os.getenv("BACKUP_DEBOUNCE", "30").strip() or 30)  # seconds
+
+# SQLite database for users, categories and redeem codes
+BOT_DB = "bot.db"
+
+# In-process user cache (utils/db.py)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000").strip() or 5000)
+USER_FLUSH_INTERVAL = int(os.getenv("USER_FLUSH_INTERVAL", "10").strip() or 10)  # seconds
+
+# Last-active heartbeats are kept in memory and written in batches
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30").strip() or 30)  # seconds
+
+# Warm start: map db/users.snap at startup and rewrite it periodically
+WARM_START = os.getenv("WARM_START", "0").strip().lower() in ("1", "true", "yes")
+WARM_SNAPSHOT_INTERVAL = int(os.getenv("WARM_SNAPSHOT_INTERVAL", "30").strip() or 30)  # minutes
+
+# Concurrent update processing (utils/update_processor.py); 0 = sequential
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "0").strip() or 0)
+UPDATE_METRICS_INTERVAL = int(os.getenv("UPDATE_METRICS_INTERVAL", "60").strip() or 60)  # seconds
+
+# Force-join membership cache (handlers/force_join.py)
+MEMBER_CACHE_TTL = int(os.getenv("MEMBER_CACHE_TTL", "600").strip() or 600)  # seconds, members
+MEMBER_CACHE_NEG_TTL = int(os.getenv("MEMBER_CACHE_NEG_TTL", "15").strip() or 15)  # seconds, non-members
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "50000").strip() or 50000)
+
+# Plan expiry scheduler (utils/plan_expiry.py)
+PLAN_EXPIRY_INTERVAL = int(os.getenv("PLAN_EXPIRY_INTERVAL", "60").strip() or 60)  # seconds
+PLAN_EXPIRY_NOTIFY = os.getenv("PLAN_EXPIRY_NOTIFY", "1").strip().lower() in ("1", "true", "yes")
+
+# Broadcast engine (utils/broadcast.py)
+BROADCAST_RATE = int(os.getenv("BROADCAST_RATE", "25").strip() or 25)  # messages per second
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8").strip() or 8)
+
 DB_FOLDER = DATA_FOLDER
 BACKUP_CHANNEL_ID = PRIVATE_DB_CHANNEL_ID
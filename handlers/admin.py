@@ -6,16 +6,24 @@ import json
 from telegram import Update
 from telegram.ext import ContextTypes
 from utils.db import (
-    get_user,
-    save_user,
+    user_txn,
+    count_users,
+    list_user_ids,
     add_task,
     get_all_tasks,
     delete_task,
     add_or_update_category,
     delete_category,
-    get_all_categories
+    get_all_categories,
+    warm_start_stats
 )
 from utils.config import load_config, save_config
+from utils import plan_expiry
+from utils.plans import all_plans, is_plan
+from utils import broadcast as broadcaster
+from utils.update_processor import OrderedUpdateProcessor, format_stats
+from handlers.videos import video_index_stats
+from handlers.force_join import member_cache_stats
 from utils.db import add_or_update_category, delete_category, get_all_categories, add_redeem_code, get_redeem_code, mark_code_used
 
 
@@ -27,25 +35,59 @@ def is_admin(user_id: int) -> bool:
 
 # ------------------ ADMIN COMMANDS ------------------
 
+async def _run_broadcast(bot, state, status_msg):
+    """Background task: run the broadcast and keep the admin's status message live."""
+    last_text = None
+
+    async def on_progress(st, elapsed):
+        nonlocal last_text
+        text = broadcaster.format_progress(st, elapsed)
+        if text != last_text:
+            last_text = text
+            try:
+                await status_msg.edit_text(text)
+            except Exception:
+                pass
+
+    try:
+        final = await broadcaster.run_broadcast(bot, state, on_progress)
+        await status_msg.reply_text("✅ " + broadcaster.format_progress(final))
+    except Exception as e:
+        await status_msg.reply_text(f"❌ Broadcast stopped: {e}\nUse /broadcast resume to continue.")
+
+
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /broadcast <message>")
+        await update.message.reply_text(
+            "Usage: /broadcast <message>\n"
+            "/broadcast status | cancel | resume"
+        )
         return
-    message = " ".join(context.args)
 
-    db_folder = "db"
-    count = 0
-    for file in os.listdir(db_folder):
-        if file.endswith(".json"):
-            try:
-                user_id = int(file.replace(".json", ""))
-                await context.bot.send_message(chat_id=user_id, text=message)
-                count += 1
-            except:
-                pass
-    await update.message.reply_text(f"✅ Broadcast sent to {count} users.")
+    command = context.args[0].lower() if len(context.args) == 1 else None
+    if command == "status":
+        state = broadcaster.load_state()
+        text = broadcaster.format_progress(state) if state else "ℹ️ No broadcast yet."
+        return await update.message.reply_text(text)
+    if command == "cancel":
+        ok = broadcaster.cancel()
+        return await update.message.reply_text("🛑 Cancelling broadcast..." if ok else "ℹ️ No broadcast running.")
+
+    if broadcaster.is_running():
+        return await update.message.reply_text("⚠️ A broadcast is already running. Use /broadcast status.")
+
+    if command == "resume":
+        state = broadcaster.load_state()
+        if not state or state.get("status") == "finished":
+            return await update.message.reply_text("ℹ️ Nothing to resume.")
+    else:
+        state = broadcaster.new_state(" ".join(context.args), update.effective_chat.id)
+
+    # runs in the background so this handler returns immediately
+    status_msg = await update.message.reply_text("📣 Broadcast starting...")
+    context.application.create_task(_run_broadcast(context.bot, state, status_msg))
 
 
 async def setwelcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -75,9 +117,8 @@ async def addcredits(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ User ID and amount must be numbers.")
         return
 
-    user_data = await get_user(user_id)
-    user_data["credits"] = user_data.get("credits", 0) + amount
-    await save_user(user_id, user_data)
+    async with user_txn(user_id) as user_data:
+        user_data["credits"] = user_data.get("credits", 0) + amount
     await update.message.reply_text(f"✅ Added {amount} credits to user {user_id}.")
 
 
@@ -90,18 +131,21 @@ async def setplan(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         user_id = int(context.args[0])
-        plan_name = context.args[1].capitalize()
+        plan_name = context.args[1].lower()
         days = int(context.args[2])
     except ValueError:
         await update.message.reply_text("❌ Invalid arguments. User ID and days must be numbers.")
         return
+    if not is_plan(plan_name):
+        await update.message.reply_text(f"❌ Unknown plan '{plan_name}'. Available: {', '.join(all_plans())}")
+        return
 
-    user_data = await get_user(user_id)
     now = int(time.time())
     expiry = now + days * 86400  # days in seconds
-    user_data["plan"] = {"name": plan_name, "expires_at": expiry}
+    async with user_txn(user_id) as user_data:
+        user_data["plan"] = {"name": plan_name, "expires_at": expiry}
+    plan_expiry.schedule(user_id, expiry)
 
-    await save_user(user_id, user_data)
     await update.message.reply_text(
         f"✅ Plan '{plan_name}' set for user {user_id} for {days} days."
     )
@@ -111,17 +155,29 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
 
-    db_folder = "db"
-    total_users = len([f for f in os.listdir(db_folder) if f.endswith(".json")])
-    await update.message.reply_text(f"📊 Total users: {total_users}")
+    total_users = await count_users()
+    text = f"📊 Total users: {total_users}"
+    vstats = video_index_stats()
+    text += f"\n🎬 Videos: {vstats['videos']} (lookups: {vstats['hits']} hits, {vstats['misses']} misses)"
+    mstats = member_cache_stats()
+    text += (f"\n👥 Join checks: {mstats['hit_rate']:.0%} cached "
+             f"({mstats['hits']} hits, {mstats['misses']} misses, {mstats['coalesced']} shared)")
+    wstats = warm_start_stats()
+    if wstats:
+        text += (f"\n🔥 Warm start: {wstats['users']} users, {wstats['stale']} stale "
+                 f"({wstats['hits']} hits, {wstats['misses']} misses), "
+                 f"{wstats['mapped_kb']} KB mapped + {wstats['stale_kb']} KB stale set")
+    processor = context.application.update_processor
+    if isinstance(processor, OrderedUpdateProcessor):
+        text += "\n" + format_stats(processor.stats())
+    await update.message.reply_text(text)
 
 
 async def listusers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
 
-    db_folder = "db"
-    users = [f.replace(".json", "") for f in os.listdir(db_folder) if f.endswith(".json")]
+    users = [str(uid) for uid in await list_user_ids()]
     await update.message.reply_text("👥 Users:\n" + "\n".join(users))
 
 
@@ -155,7 +211,7 @@ async def viewtasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     message = "📋 Current Tasks:\n\n"
     for i, task in enumerate(tasks, start=1):
-        message += f"{i}. {task['title']} (Reward: {task['reward']})\n"
+        message += f"{i}. {task['title']} (Reward: {task['reward']}, id: {task['id']})\n"
     await update.message.reply_text(message)
 
 
@@ -185,7 +241,7 @@ async def videolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if not context.args:
         # Show current categories
-        categories = get_all_categories()
+        categories = await get_all_categories()
         if not categories:
             return await update.message.reply_text("⚠️ No categories found.")
 
@@ -200,12 +256,15 @@ async def videolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "add" and len(context.args) >= 3:
         category_name = context.args[1]
         video_range = " ".join(context.args[2:])
-        add_or_update_category(category_name, video_range)
+        try:
+            await add_or_update_category(category_name, video_range)
+        except ValueError as e:
+            return await update.message.reply_text(f"❌ {e}. Use ranges like 1-50,60-70.")
         return await update.message.reply_text(f"✅ Category '{category_name}' updated with videos {video_range}")
 
     elif action == "delete" and len(context.args) == 2:
         category_name = context.args[1]
-        delete_category(category_name)
+        await delete_category(category_name)
         return await update.message.reply_text(f"🗑 Category '{category_name}' deleted.")
 
     elif action == "json":
@@ -218,7 +277,7 @@ async def videolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return await update.message.reply_text("❌ Invalid format. Must be a JSON object.")
 
             for cat, vids in categories.items():
-                add_or_update_category(cat, vids)
+                await add_or_update_category(cat, vids)
 
             return await update.message.reply_text("✅ Video categories updated successfully.")
         except Exception as e:
@@ -241,7 +300,7 @@ async def videolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("❌ You are not authorized.")
 
     if not context.args:
-        categories = get_all_categories()
+        categories = await get_all_categories()
         if not categories:
             return await update.message.reply_text("⚠️ No categories found.")
         msg = "📂 Current Video Categories:\n\n"
@@ -253,11 +312,14 @@ async def videolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "add" and len(context.args) >= 3:
         category_name = context.args[1]
         video_range = " ".join(context.args[2:])
-        add_or_update_category(category_name, video_range)
+        try:
+            await add_or_update_category(category_name, video_range)
+        except ValueError as e:
+            return await update.message.reply_text(f"❌ {e}. Use ranges like 1-50,60-70.")
         return await update.message.reply_text(f"✅ Category '{category_name}' updated with videos {video_range}")
     elif action == "delete" and len(context.args) == 2:
         category_name = context.args[1]
-        delete_category(category_name)
+        await delete_category(category_name)
         return await update.message.reply_text(f"🗑 Category '{category_name}' deleted.")
     else:
         return await update.message.reply_text("❌ Usage:\n"
@@ -287,5 +349,5 @@ async def addredeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         return await update.message.reply_text("❌ Credits and Hours must be integers.")
 
-    add_redeem_code(code, credits, hours)
+    await add_redeem_code(code, credits, hours)
     await update.message.reply_text(f"✅ Redeem code '{code}' added: {credits} credits, {hours}h premium.")
@@ -2,7 +2,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 import config
-from utils.backup import restore_all_from_index
+from utils.backup import restore_all_from_index, format_restore_progress
 
 async def restore_db_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
@@ -10,7 +10,25 @@ async def restore_db_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ You are not authorized.")
         return
 
-    await update.message.reply_text("🔄 Starting restore from backup channel. This might take a while...")
-    results = await restore_all_from_index()
-    ok_count = sum(1 for v in results.values() if v == "ok")
-    await update.message.reply_text(f"✅ Restore complete. Files restored: {ok_count}. See details in logs.")
+    # /restore_db fresh -> ignore progress of an interrupted restore
+    fresh = bool(context.args) and context.args[0].lower() == "fresh"
+    status_msg = await update.message.reply_text("🔄 Starting restore from backup channel...")
+    last_text = None
+
+    async def on_progress(stats):
+        nonlocal last_text
+        text = format_restore_progress(stats)
+        if text != last_text:
+            last_text = text
+            try:
+                await status_msg.edit_text(text)
+            except Exception:
+                pass
+
+    results = await restore_all_from_index(on_progress=on_progress, fresh=fresh)
+    ok_count = sum(1 for v in results.values() if v.startswith("ok"))
+    failed = sum(1 for v in results.values() if v.startswith("error"))
+    text = f"✅ Restore complete. Users restored: {ok_count}."
+    if failed:
+        text += f"\n⚠️ {failed} failed — run /restore_db again to retry them. See details in logs."
+    await update.message.reply_text(text)
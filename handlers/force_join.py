@@ -1,20 +1,85 @@
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
 from telegram.ext import ContextTypes
 from telegram.constants import ChatMemberStatus
+from collections import OrderedDict
+import asyncio
 import logging
+import time
 import config
 
 JOIN_BTN_TEXT = "📢 Join our channel"
 RECHECK_BTN_DATA = "recheck_join"
 RECHECK_BTN_TEXT = "✅ I've Joined"
 
-async def is_member(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+# ------------------ MEMBERSHIP CACHE ------------------
+# user_id -> (is_member, expires_at). Members are trusted for MEMBER_CACHE_TTL,
+# non-members only for MEMBER_CACHE_NEG_TTL so joining is picked up quickly.
+# chat_member updates (bot must be admin in the channel) overwrite entries.
+_member_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_inflight = {}  # user_id -> Task, shared by concurrent checks
+_member_stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "updates": 0}
+
+def _remember(user_id: int, joined: bool) -> None:
+    ttl = config.MEMBER_CACHE_TTL if joined else config.MEMBER_CACHE_NEG_TTL
+    _member_cache[user_id] = (joined, time.monotonic() + ttl)
+    _member_cache.move_to_end(user_id)
+    while len(_member_cache) > config.MEMBER_CACHE_SIZE:
+        _member_cache.popitem(last=False)
+
+def _is_joined(status) -> bool:
+    return status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+
+async def _fetch_membership(bot, user_id: int) -> bool:
     try:
-        member = await context.bot.get_chat_member(config.FORCE_JOIN_CHANNEL, user_id)
-        return member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED)
+        member = await bot.get_chat_member(config.FORCE_JOIN_CHANNEL, user_id)
     except Exception as e:
+        _member_stats["errors"] += 1
         logging.warning("Force join check failed: %s", e)
-        return True
+        return True  # fail open, but don't cache it
+    joined = _is_joined(member.status)
+    _remember(user_id, joined)
+    return joined
+
+async def is_member(context: ContextTypes.DEFAULT_TYPE, user_id: int, fresh: bool = False) -> bool:
+    """Is the user in FORCE_JOIN_CHANNEL? fresh=True skips the cache (recheck button)."""
+    if not fresh:
+        entry = _member_cache.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            _member_stats["hits"] += 1
+            return entry[0]
+    _member_stats["misses"] += 1
+
+    task = _inflight.get(user_id)
+    if task is not None:
+        _member_stats["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(_fetch_membership(context.bot, user_id))
+        _inflight[user_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(user_id, None))
+    # shield: a cancelled caller must not cancel the lookup others are waiting on
+    return await asyncio.shield(task)
+
+def _is_force_join_chat(chat) -> bool:
+    channel = str(config.FORCE_JOIN_CHANNEL)
+    if channel.startswith("@"):
+        return bool(chat.username) and chat.username.lower() == channel[1:].lower()
+    return str(chat.id) == channel
+
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the cache in sync with joins/leaves in the force-join channel."""
+    change = update.chat_member
+    if not change or not _is_force_join_chat(change.chat):
+        return
+    _member_stats["updates"] += 1
+    _remember(change.new_chat_member.user.id, _is_joined(change.new_chat_member.status))
+
+def member_cache_stats() -> dict:
+    lookups = _member_stats["hits"] + _member_stats["misses"]
+    return {
+        **_member_stats,
+        "size": len(_member_cache),
+        "hit_rate": _member_stats["hits"] / lookups if lookups else 0.0,
+    }
 
 def join_keyboard() -> InlineKeyboardMarkup:
     url = f"https://t.me/{config.FORCE_JOIN_CHANNEL.lstrip('@')}"
@@ -38,7 +103,7 @@ async def prompt_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def handle_recheck_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     user_id = query.from_user.id
-    if await is_member(context, user_id):
+    if await is_member(context, user_id, fresh=True):
         await query.edit_message_text("✅ Great! You're in. Send /start again to continue.")
     else:
         await query.answer("❌ You haven't joined yet.", show_alert=True)
@@ -1,6 +1,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from utils.db import get_user_data, save_user_data
+from utils.db import get_user, user_txn
+from utils.render import giveaway_view, giveaways_changed
 from datetime import datetime
 
 # Example giveaways
@@ -17,18 +18,46 @@ giveaways = [
 def parse_time(s):
     return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
 
-async def show_giveaways(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    user_data = get_user_data(user_id)
+# Derived from `giveaways`: rebuilt by set_giveaways()
+_end_times = {}
+JOINED_MARKUPS = {}
+
+
+def set_giveaways(items=None):
+    """Replace (or re-index) the giveaway list and drop cached renders."""
+    global giveaways
+    if items is not None:
+        giveaways = items
+    _end_times.clear()
+    JOINED_MARKUPS.clear()
+    for g in giveaways:
+        _end_times[g["id"]] = parse_time(g["end_time"])
+        JOINED_MARKUPS[g["id"]] = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Joined", callback_data=f"join_{g['id']}")]])
+    giveaways_changed()
+
 
+set_giveaways()
+
+
+def _masks(joined_ids):
+    """(joined bitmap, ended bitmap) over the giveaway list."""
+    now = datetime.utcnow()
+    joined = ended = 0
+    for bit, g in enumerate(giveaways):
+        if g["id"] in joined_ids:
+            joined |= 1 << bit
+        if now > _end_times[g["id"]]:
+            ended |= 1 << bit
+    return joined, ended
+
+
+def _render(joined_mask, ended_mask):
     text = "🎯 **Active Giveaways**\n\n"
     buttons = []
 
-    for g in giveaways:
-        end_time = parse_time(g["end_time"])
-        joined = g["id"] in user_data.get("giveaways_joined", [])
-        status = "✅ Joined" if joined else "🎉 Join"
-        if datetime.utcnow() > end_time:
+    for bit, g in enumerate(giveaways):
+        status = "✅ Joined" if joined_mask >> bit & 1 else "🎉 Join"
+        if ended_mask >> bit & 1:
             status = "❌ Ended"
 
         text += f"{g['title']} - Ends: {g['end_time']}\nStatus: {status}\n\n"
@@ -36,6 +65,15 @@ async def show_giveaways(update: Update, context: ContextTypes.DEFAULT_TYPE):
             buttons.append([InlineKeyboardButton(status, callback_data=f"join_{g['id']}")])
 
     markup = InlineKeyboardMarkup(buttons) if buttons else None
+    return text, markup
+
+
+async def show_giveaways(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id)
+
+    joined_mask, ended_mask = _masks(set(user_data.get("giveaways_joined", [])))
+    text, markup = giveaway_view(joined_mask, ended_mask, _render)
 
     msg = update.message or update.callback_query.message
     await msg.reply_text(text, reply_markup=markup, parse_mode="Markdown")
@@ -44,7 +82,6 @@ async def handle_giveaway_callback(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     data = query.data
     user_id = query.from_user.id
-    user_data = get_user_data(user_id)
 
     if data.startswith("join_"):
         gid = data.split("_")[1]
@@ -53,26 +90,27 @@ async def handle_giveaway_callback(update: Update, context: ContextTypes.DEFAULT
             await query.answer("❌ Giveaway not found", show_alert=True)
             return
 
-        if gid in user_data.get("giveaways_joined", []):
-            await query.answer("✅ Already joined", show_alert=True)
-            return
-
-        if datetime.utcnow() > parse_time(g["end_time"]):
+        if datetime.utcnow() > _end_times[gid]:
             await query.answer("❌ Giveaway ended", show_alert=True)
             return
 
-        # Add user to giveaway
-        g["participants"].append(user_id)
-        user_data.setdefault("giveaways_joined", []).append(gid)
+        # answer only after the transaction, so the user's lock isn't held over a network call
+        async with user_txn(user_id) as user_data:
+            joined = gid in user_data.get("giveaways_joined", [])
+            if not joined:
+                # Add user to giveaway
+                g["participants"].append(user_id)
+                user_data.setdefault("giveaways_joined", []).append(gid)
+
+                # Give reward
+                for k, v in g["reward"].items():
+                    user_data[k] = user_data.get(k, 0) + v
 
-        # Give reward
-        for k, v in g["reward"].items():
-            user_data[k] = user_data.get(k, 0) + v
+        if joined:
+            await query.answer("✅ Already joined", show_alert=True)
+            return
 
-        save_user_data(user_id, user_data)
         await query.answer("🎉 You joined and got your reward!", show_alert=True)
 
         # Update button
-        await query.edit_message_reply_markup(
-            InlineKeyboardMarkup([[InlineKeyboardButton("✅ Joined", callback_data=f"join_{gid}")]])
-        )
+        await query.edit_message_reply_markup(JOINED_MARKUPS[gid])
@@ -8,16 +8,18 @@ async def some_command(update, context):
         return  # stop execution until user completes requirements
     
     # normal command code here
+# Static: built once at import (PTB keyboards are immutable, safe to share)
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎥 Watch Videos", callback_data="menu_videos")],
+    [InlineKeyboardButton("🏆 My Profile", callback_data="menu_profile")],
+    [InlineKeyboardButton("🎯 Tasks", callback_data="menu_tasks")],
+    [InlineKeyboardButton("🎁 Redeem Code", callback_data="menu_redeem")],
+    [InlineKeyboardButton("💎 Upgrade Plan", callback_data="menu_upgrade")],
+    [InlineKeyboardButton("❓ Help", callback_data="menu_help")],
+])
+
 async def send_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, edit=False) -> None:
-    keyboard = [
-        [InlineKeyboardButton("🎥 Watch Videos", callback_data="menu_videos")],
-        [InlineKeyboardButton("🏆 My Profile", callback_data="menu_profile")],
-        [InlineKeyboardButton("🎯 Tasks", callback_data="menu_tasks")],
-        [InlineKeyboardButton("🎁 Redeem Code", callback_data="menu_redeem")],
-        [InlineKeyboardButton("💎 Upgrade Plan", callback_data="menu_upgrade")],
-        [InlineKeyboardButton("❓ Help", callback_data="menu_help")],
-    ]
-    markup = InlineKeyboardMarkup(keyboard)
+    markup = MAIN_MENU_MARKUP
 
     if edit and update.callback_query:
         await update.callback_query.edit_message_text(
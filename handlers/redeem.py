@@ -3,7 +3,8 @@ import re
 import time
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.db import get_user, save_user, get_redeem_code, mark_code_used
+from utils.db import user_txn, get_redeem_code, mark_code_used
+from utils import plan_expiry
 
 # -----------------------------
 # Constants
@@ -49,7 +50,7 @@ async def handle_redeem_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
     # Fetch code info from DB
-    info = get_redeem_code(code)
+    info = await get_redeem_code(code)
     if not info:
         return await update.message.reply_text("❌ Code not found or invalid.")
 
@@ -58,45 +59,21 @@ async def handle_redeem_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if str(user_id) in used_by:
         return await update.message.reply_text("⚠️ You have already used this code.")
 
-    # Fetch user profile
-    profile_row = get_user(user_id)
-    if profile_row:
-        profile = {
-            "user_id": profile_row[0],
-            "username": profile_row[1],
-            "credits": profile_row[2],
-            "plan": profile_row[3],
-            "plan_expiry": profile_row[4] or int(time.time())
-        }
-    else:
-        profile = {
-            "user_id": user_id,
-            "username": update.effective_user.username,
-            "credits": 0,
-            "plan": "Free",
-            "plan_expiry": int(time.time())
-        }
-
-    # Apply credits
-    profile["credits"] += info[1]
-
-    # Apply premium duration
-    if info[2] > 0:
-        now = int(time.time())
-        expiry = max(profile.get("plan_expiry", now), now)
-        expiry += info[2] * 3600  # hours -> seconds
-        profile["plan"] = "Premium"
-        profile["plan_expiry"] = expiry
+    # Claim the code first (atomic in the DB) so it can't be redeemed twice
+    if not await mark_code_used(code, user_id):
+        return await update.message.reply_text("⚠️ You have already used this code.")
 
-    # Save user and mark code as used
-    save_user(
-        user_id=profile["user_id"],
-        username=profile["username"],
-        credits=profile["credits"],
-        plan_name=profile["plan"],
-        plan_expires_at=profile["plan_expiry"]
-    )
-    mark_code_used(code, user_id)
+    # Fetch user profile, apply credits and premium duration, save
+    async with user_txn(user_id, update.effective_user.username) as profile:
+        profile["credits"] = int(profile.get("credits", 0)) + info[1]
+
+        if info[2] > 0:
+            now = int(time.time())
+            plan = profile.get("plan") if isinstance(profile.get("plan"), dict) else {}
+            expiry = max(plan.get("expires_at") or now, now)
+            expiry += info[2] * 3600  # hours -> seconds
+            profile["plan"] = {"name": "premium", "expires_at": expiry}
+            plan_expiry.schedule(user_id, expiry)
 
     # Clear await flag
     context.user_data[AWAIT_FLAG] = False
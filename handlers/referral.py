@@ -1,7 +1,7 @@
 # handlers/referral.py
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.db import save_user, get_user_data   # ✅ import db helpers
+from utils.db import user_txn   # ✅ import db helpers
 from utils.checks import ensure_access
 
 async def some_command(update, context):
@@ -19,9 +19,8 @@ async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     link = f"https://t.me/{bot_username}?start={user_id}"
 
     # ✅ Save referral link to DB
-    user_data = await get_user_data(user_id) or {}
-    user_data["ref_link"] = link
-    await save_user(user_id, user_data)
+    async with user_txn(user_id) as user_data:
+        user_data["ref_link"] = link
 
     msg = (
         f"📢 *Your Referral Link:*\n{link}\n\n"
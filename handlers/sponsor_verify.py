@@ -4,7 +4,7 @@ import random
 import string
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.db import get_user, save_user
+from utils.db import user_txn, set_stored_field, load_stored_user
 
 def generate_code(length=6):
     """Generate random sponsor verification code."""
@@ -15,19 +15,11 @@ async def getcode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    profile = await get_user(user_id)
-    if profile is None:
-        profile = {
-            "id": user_id,
-            "username": user.username,
-            "sponsor_verified": False,
-            "sponsor_code": None
-        }
-
     # generate a fresh code
     code = generate_code()
-    profile["sponsor_code"] = code
-    await save_user(user_id, profile)
+    # only this field, straight to the store: the main bot process owns the
+    # rest of the record and reads the code from the store
+    await set_stored_field(user_id, "sponsor_code", code, user.username)
 
     await update.message.reply_text(
         f"✅ Here is your sponsor verification code:\n\n"
@@ -40,7 +32,6 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler for /verify in Main Bot (checks code saved by Sponsor Bot)."""
     user = update.effective_user
     user_id = user.id
-    profile = await get_user(user_id)
 
     if not context.args:
         await update.message.reply_text("⚠️ Usage: `/verify CODE`", parse_mode="Markdown")
@@ -49,10 +40,12 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # normalize user input
     code_entered = context.args[0].strip().upper()
 
-    if profile and profile.get("sponsor_code") == code_entered:
-        profile["sponsor_verified"] = True
-        profile["sponsor_code"] = None   # 🔑 clear the code after use
-        await save_user(user_id, profile)
+    # the code was written by the sponsor bot process, so read it from the store
+    stored = await load_stored_user(user_id) or {}
+    if code_entered and stored.get("sponsor_code") == code_entered:
+        async with user_txn(user_id) as profile:
+            profile["sponsor_verified"] = True
+        await set_stored_field(user_id, "sponsor_code", None)   # 🔑 clear the code after use
         await update.message.reply_text("🎉 Verification successful! You are now sponsor verified.")
     else:
         await update.message.reply_text("❌ Invalid code. Please try again.")
@@ -8,7 +8,8 @@ from telegram.ext import ContextTypes
 from handlers.force_join import is_member, prompt_join
 # from handlers.sponsor_verify import auto_verify_sponsor
 from handlers.menu import send_main_menu
-from utils.db import json_get_user as get_user, json_save_user as save_user, set_invited_by, add_pending_referral
+from utils.db import get_user, set_invited_by, add_pending_referral
+from utils.checks import ask_sponsor_verification
 
 # Constants
 REFERRAL_CREDIT = 2
@@ -65,21 +66,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     ref_code = None
 
     # Load or create user profile
-    profile = await get_user(user_id)
-    if profile is None:
-        profile = {
-            "id": user_id,
-            "username": username,
-            "sponsor_verified": False,
-            "credits": 0,
-            "badges": [],
-            "referrals": {
-                "invited_by": None,
-                "pending": [],
-                "completed": []
-            }
-        }
-        await save_user(user_id, profile)
+    profile = await get_user(user_id, username)
 
     # --------------------------------------------------------
     # Handle referral from /start <ref_id>
@@ -1,17 +1,22 @@
 # handlers/tasks.py
 import logging
-import asyncio
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from utils.db import (
     get_all_tasks,
+    resolve_task,
+    completed_tasks,
+    task_catalog_version,
     get_user,
     mark_task_opened,
     mark_task_completed
 )
 
 logger = logging.getLogger(__name__)
+
+DONE_DELAY = 5  # seconds between opening a task and the Done button
 from utils.checks import ensure_access
+from utils.render import task_keyboard
 
 async def some_command(update, context):
     if not await ensure_access(update, context):
@@ -36,28 +41,18 @@ async def show_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.callback_query.edit_message_text("✅ No active tasks available right now.")
         return
 
-    buttons = []
-    for idx, task in enumerate(tasks, start=1):
-        # Already completed
-        if str(task["id"]) in user.get("tasks_completed", []):
-            buttons.append([
-                InlineKeyboardButton(f"✅ {task['title']} (Completed)", callback_data="done")
-            ])
-        else:
-            buttons.append([
-                InlineKeyboardButton(f"🔗 {task['title']}", callback_data=f"open_{idx}"),
-                InlineKeyboardButton(f"✅ Done (+{task['reward']} credits)", callback_data=f"task_done_{idx}")
-            ])
+    # cached per (task list version, completed bitmap)
+    markup = task_keyboard(task_catalog_version(), tasks, completed_tasks(user))
 
     if update.message:
         await update.message.reply_text(
             "📋 Here are your available tasks:",
-            reply_markup=InlineKeyboardMarkup(buttons)
+            reply_markup=markup
         )
     elif update.callback_query:
         await update.callback_query.edit_message_text(
             "📋 Here are your available tasks:",
-            reply_markup=InlineKeyboardMarkup(buttons)
+            reply_markup=markup
         )
 
 # ========================
@@ -68,19 +63,12 @@ async def handle_open_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    try:
-        idx = int(query.data.split("_")[1])
-    except Exception:
-        await query.edit_message_text("⚠️ Invalid task.")
-        return
-
-    tasks = await get_all_tasks()
-
-    if idx <= 0 or idx > len(tasks):
+    # open_<task id> (or open_<position> on old buttons)
+    task = await resolve_task(query.data[len("open_"):])
+    if not task:
         await query.edit_message_text("⚠️ Invalid task.")
         return
 
-    task = tasks[idx - 1]
     user_id = query.from_user.id
 
     # Mark as opened
@@ -89,16 +77,33 @@ async def handle_open_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Send task link
     await query.message.reply_text(
         f"🔗 Task: {task['title']}\n\n👉 {task['link']}\n\n"
-        "⏳ Please wait 5 seconds before you can click Done..."
+        f"⏳ Please wait {DONE_DELAY} seconds before you can click Done..."
     )
 
-    # Wait 5 seconds before enabling Done
-    await asyncio.sleep(5)
-    await query.message.reply_text(
-        f"✅ Now you can mark *{task['title']}* as Done.",
+    # Enable Done after the delay without holding this handler
+    job_name = f"task_done_btn:{user_id}:{task['id']}"
+    for job in context.job_queue.get_jobs_by_name(job_name):
+        job.schedule_removal()  # reopened: restart the wait, send one button
+    context.job_queue.run_once(
+        send_done_button,
+        when=DONE_DELAY,
+        name=job_name,
+        chat_id=query.message.chat_id,
+        user_id=user_id,
+        data={"title": task["title"], "reward": task["reward"], "id": task["id"]},
+    )
+
+
+async def send_done_button(context: ContextTypes.DEFAULT_TYPE):
+    """Job: send the Done button for an opened task."""
+    job = context.job
+    task = job.data
+    await context.bot.send_message(
+        chat_id=job.chat_id,
+        text=f"✅ Now you can mark *{task['title']}* as Done.",
         parse_mode="Markdown",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton(f"✅ Done (+{task['reward']} credits)", callback_data=f"task_done_{idx}")]
+            [InlineKeyboardButton(f"✅ Done (+{task['reward']} credits)", callback_data=f"task_done_{task['id']}")]
         ])
     )
 
@@ -108,20 +113,12 @@ async def handle_task_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = query.from_user.id
-    try:
-        idx = int(query.data.split("_")[2])
-    except Exception:
-        await query.edit_message_text("⚠️ Invalid task.")
-        return
-
-    tasks = await get_all_tasks()
-
-    if idx <= 0 or idx > len(tasks):
+    # task_done_<task id> (or task_done_<position> on old buttons)
+    task = await resolve_task(query.data[len("task_done_"):])
+    if not task:
         await query.edit_message_text("⚠️ Invalid task.")
         return
 
-    task = tasks[idx - 1]
-
     # Try marking completed (this function handles opened-check, timing and crediting)
     success, msg = await mark_task_completed(user_id, str(task["id"]), task["reward"])
 
@@ -1,14 +1,16 @@
 # handlers/videos.py
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, MessageHandler, filters
-from utils.db import get_user_data, save_user_data
-import sqlite3
+from utils.db import load_stored_user, save_user
+from utils.sqlite_pool import get_db
 import time
+import json
+import hashlib
+import asyncio
 from config import ADMIN_IDS
 import re
-from utils.db import add_fetched_video
-from utils.checks import ensure_access, check_plan  # ✅ import plan check
-from utils.db import add_or_update_category, get_all_categories
+from utils.checks import ensure_access, check_access, USAGE_COUNTERS
+from utils.db import add_or_update_category, get_all_categories, get_category_ranges
 
 # -----------------------------
 # Config
@@ -19,62 +21,138 @@ DB_PATH = "videos.db"
 # -----------------------------
 # DB Setup
 # -----------------------------
+_video_db = get_db(DB_PATH)
+
 def init_video_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
+    _video_db.executescript("""
         CREATE TABLE IF NOT EXISTS videos (
-            vid_num TEXT PRIMARY KEY,
+            vid_num INTEGER PRIMARY KEY,
             file_id TEXT NOT NULL,
             msg_id INTEGER NOT NULL
-        )
-    """)
-    cur.execute("""
+        );
         CREATE TABLE IF NOT EXISTS meta (
             key TEXT PRIMARY KEY,
             value TEXT
-        )
+        );
+        -- Global set of fetched channel videos (was the pseudo user 0)
+        CREATE TABLE IF NOT EXISTS fetched_videos (
+            vid_num INTEGER PRIMARY KEY,
+            tags TEXT,
+            fetched_at INTEGER
+        );
     """)
-    conn.commit()
-    conn.close()
-
-def save_video(vid_num, file_id, msg_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO videos (vid_num, file_id, msg_id) VALUES (?, ?, ?)", (vid_num, file_id, msg_id))
-    conn.commit()
-    conn.close()
-
-def get_video(vid_num):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT file_id FROM videos WHERE vid_num = ?", (vid_num,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def get_all_videos(limit=20):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT vid_num FROM videos ORDER BY CAST(vid_num AS INTEGER) ASC LIMIT ?", (limit,))
-    rows = cur.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
-
-def get_last_msg_id():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM meta WHERE key='last_msg_id'")
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0]) if row else 0
-
-def set_last_msg_id(msg_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_msg_id', ?)", (str(msg_id),))
-    conn.commit()
-    conn.close()
+    _video_db.call(_migrate_integer_vid_num)
+
+def _migrate_integer_vid_num(conn):
+    """Old tables keyed videos by TEXT vid_num; rebuild them as INTEGER PRIMARY KEY (rowid) tables."""
+    types = {row[1]: row[2].upper() for row in conn.execute("PRAGMA table_info(videos)")}
+    if types.get("vid_num") == "INTEGER":
+        return
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DROP TABLE IF EXISTS videos_new")
+        conn.execute("""
+            CREATE TABLE videos_new (
+                vid_num INTEGER PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                msg_id INTEGER NOT NULL
+            )
+        """)
+        # first row wins for "7" / "007", like INSERT OR IGNORE did
+        conn.execute("""
+            INSERT OR IGNORE INTO videos_new (vid_num, file_id, msg_id)
+            SELECT CAST(vid_num AS INTEGER), file_id, msg_id FROM videos
+            WHERE vid_num != '' AND vid_num NOT GLOB '*[^0-9]*'
+            ORDER BY rowid
+        """)
+        conn.execute("DROP TABLE videos")
+        conn.execute("ALTER TABLE videos_new RENAME TO videos")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print("[Videos] Migrated videos.vid_num to INTEGER PRIMARY KEY")
+
+# -----------------------------
+# In-memory video index (vid_num -> file_id)
+# -----------------------------
+# Loaded once at startup, kept current by the ingest flush; get_video never touches disk.
+_video_index = None
+_video_stats = {"hits": 0, "misses": 0}
+
+def _video_key(vid_num):
+    vid_num = str(vid_num).strip().lstrip("#")
+    return int(vid_num) if vid_num.isdigit() else None
+
+def load_video_index():
+    """Load every vid_num -> file_id into memory (call once at startup). Returns count."""
+    global _video_index
+    index = {}
+    for vid_num, file_id in _video_db.fetchall("SELECT vid_num, file_id FROM videos"):
+        index[vid_num] = file_id
+    _video_index = index
+    return len(index)
+
+def video_index_stats():
+    return {"videos": len(_video_index or {}), **_video_stats}
+
+async def get_video(vid_num):
+    key = _video_key(vid_num)
+    if _video_index is None:
+        row = await _video_db.afetchone("SELECT file_id FROM videos WHERE vid_num = ?", (key,))
+        return row[0] if row else None
+    file_id = _video_index.get(key)
+    _video_stats["hits" if file_id else "misses"] += 1
+    return file_id
+
+async def list_category_videos(category, limit=20, after=0):
+    """
+    Existing video numbers of a category above `after`, ascending.
+    One primary-key range scan per category range; returns (videos, next cursor or None).
+    Reads one video past the page so the cursor is only returned if more exist.
+    """
+    videos = []
+    for first, last in await get_category_ranges(category):
+        if last <= after:
+            continue
+        rows = await _video_db.afetchall(
+            "SELECT vid_num FROM videos WHERE vid_num BETWEEN ? AND ? ORDER BY vid_num LIMIT ?",
+            (max(first, after + 1), last, limit + 1 - len(videos))
+        )
+        videos.extend(r[0] for r in rows)
+        if len(videos) > limit:
+            return videos[:limit], videos[limit - 1]
+    return videos, None
+
+async def migrate_fetched_videos():
+    """
+    One-shot: move user 0's videos.fetched / videos.tags into fetched_videos
+    and empty them on the user record. Call after init_db().
+    """
+    if await _video_db.afetchone("SELECT 1 FROM meta WHERE key='fetched_migrated'"):
+        return 0
+    user = await load_stored_user(0)
+    videos = (user or {}).get("videos") or {}
+    tags = videos.get("tags") or {}
+    now = int(time.time())
+    rows = []
+    for vid in videos.get("fetched") or []:
+        key = _video_key(vid)
+        if key is not None:
+            rows.append((key, json.dumps(tags.get(str(vid)) or []), now))
+
+    def _migrate(conn):
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO fetched_videos (vid_num, tags, fetched_at) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fetched_migrated', ?)", (str(now),))
+    await _video_db.run(_migrate)
+
+    if user is not None and (videos.get("fetched") or tags):
+        user["videos"] = {"fetched": [], "watched": videos.get("watched", []), "tags": {}}
+        await save_user(0, user, backup_sync=False)
+    if rows:
+        print(f"[Videos] Moved {len(rows)} fetched videos from user 0 to fetched_videos")
+    return len(rows)
 
 # -----------------------------
 # Admin: Fetch Videos (/fetchvid)
@@ -91,6 +169,69 @@ async def fetch_videos(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "⚠️ Old videos cannot be fetched due to Telegram Bot API limitations."
     )
 
+# -----------------------------
+# Channel post ingestion (batched)
+# -----------------------------
+# Posts are buffered and written in one transaction per batch: videos,
+# fetched_videos and last_msg_id together. The in-memory index is updated
+# right away so a new video can be watched before its batch is committed.
+INGEST_BATCH = 100     # posts per transaction
+INGEST_DELAY = 2.0     # seconds to wait for more posts before committing
+
+_ingest_buffer = []    # (vid_num, file_id, msg_id, tags)
+_ingest_flush_task = None
+
+def _commit_ingest_batch(conn, batch, now):
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO videos (vid_num, file_id, msg_id) VALUES (?, ?, ?)",
+            [(vid, file_id, msg_id) for vid, file_id, msg_id, _ in batch]
+        )
+        conn.executemany(
+            "INSERT INTO fetched_videos (vid_num, tags, fetched_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(vid_num) DO UPDATE SET tags=excluded.tags",
+            [(vid, json.dumps(tags), now) for vid, _, _, tags in batch]
+        )
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('last_msg_id', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (str(max(msg_id for _, _, msg_id, _ in batch)),)
+        )
+
+async def flush_video_ingest():
+    """Commit buffered channel posts. Returns number committed."""
+    if not _ingest_buffer:
+        return 0
+    batch = _ingest_buffer[:]
+    _ingest_buffer.clear()
+    try:
+        await _video_db.run(_commit_ingest_batch, batch, int(time.time()))
+    except Exception as e:
+        print(f"❌ Failed to save {len(batch)} videos to DB: {e}")
+        _ingest_buffer[:0] = batch  # retried with the next flush
+        return 0
+    print(f"✅ Saved {len(batch)} videos to DB (up to msg_id {max(b[2] for b in batch)})")
+    return len(batch)
+
+async def _delayed_ingest_flush():
+    global _ingest_flush_task
+    try:
+        await asyncio.sleep(INGEST_DELAY)
+        await flush_video_ingest()
+    finally:
+        _ingest_flush_task = None
+
+def _queue_video(vid, file_id, msg_id, tags, context):
+    global _ingest_flush_task
+    _ingest_buffer.append((vid, file_id, msg_id, tags))
+    if _video_index is not None:
+        _video_index.setdefault(vid, file_id)
+    if len(_ingest_buffer) >= INGEST_BATCH:
+        return flush_video_ingest()
+    if _ingest_flush_task is None:
+        _ingest_flush_task = context.application.create_task(_delayed_ingest_flush())
+    return None
+
 # -----------------------------
 # Auto-fetch new channel videos
 # -----------------------------
@@ -105,7 +246,7 @@ async def new_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"⚠️ No video number found in caption: {msg.caption}")
         return
 
-    vid_num = match.group(0)
+    vid_num = int(match.group(0))
 
     file_id = None
     if msg.video:
@@ -117,50 +258,30 @@ async def new_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"⚠️ No video/document file found in message {msg.message_id}")
         return
 
-    try:
-        save_video(vid_num, file_id, msg.message_id)
-        set_last_msg_id(msg.message_id)
-        print(f"✅ Saved video {vid_num} (msg_id {msg.message_id}) to DB")
-    except Exception as e:
-        print(f"❌ Failed to save video {vid_num} to DB: {e}")
-        return
-
-    try:
-        await add_fetched_video(user_id=0, video_id=vid_num, tags=["channel"])
-        print(f"✅ Added video {vid_num} to user JSON (user_id=0)")
-    except Exception as e:
-        print(f"❌ Failed to add video {vid_num} to JSON: {e}")
+    flush = _queue_video(vid_num, file_id, msg.message_id, ["channel"], context)
+    if flush is not None:
+        await flush
 
 # -----------------------------
 # User: Get specific video (/video #num)
 # -----------------------------
 async def get_video_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await ensure_access(update, context):
-        return
+    # index lookup first (in memory) so the checks and the usage count are one write
+    vid_num = context.args[0].lstrip("#") if context.args else None
+    video_file_id = await get_video(vid_num) if vid_num else None
 
-    user_id = update.effective_user.id
-    user = await get_user_data(user_id)
-
-    # ✅ Plan check
-    ok, msg = await check_plan(user, mode="video")
-    if not ok:
-        await update.message.reply_text(msg)
+    consume = USAGE_COUNTERS["video"] if video_file_id else None
+    if not await ensure_access(update, context, mode="video", consume=consume):
         return
 
     if not context.args:
         await update.message.reply_text("⚙️ Usage: /video <number>")
         return
 
-    vid_num = context.args[0].lstrip("#")
-    video_file_id = get_video(vid_num)
     if not video_file_id:
         await update.message.reply_text("❌ Video not found in DB. Ask admin to run /fetchvid.")
         return
 
-    # Increment usage
-    user["usage"]["videos_watched_today"] += 1
-    await save_user_data(user_id, user)
-
     await update.message.reply_video(video_file_id, caption=f"🎥 Video {vid_num}")
 
 # -----------------------------
@@ -179,7 +300,11 @@ async def addcategory_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     category_name = context.args[0]
     video_range = context.args[1]
 
-    add_or_update_category(category_name, video_range)
+    try:
+        await add_or_update_category(category_name, video_range)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}. Use ranges like 1-50,60-70.")
+        return
     await update.message.reply_text(f"✅ Category '{category_name}' set for videos {video_range}.")
 
 async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -188,7 +313,7 @@ async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("⛔ Only admins can view categories.")
         return
 
-    cats = get_all_categories()
+    cats = await get_all_categories()
     if not cats:
         await update.message.reply_text("📂 No categories found. Use /addcategory to create.")
         return
@@ -197,7 +322,7 @@ async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text(f"📂 Categories:\n{msg}")
 
 async def videodetails_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    categories = get_all_categories()
+    categories = await get_all_categories()
     if not categories:
         return await update.message.reply_text("⚠️ No video categories available.")
     msg = "🎬 Available Video Categories:\n\n"
@@ -205,6 +330,53 @@ async def videodetails_command(update: Update, context: ContextTypes.DEFAULT_TYP
         msg += f"🔹 {cat}: {vids}\n"
     await update.message.reply_text(msg)
 
+# -----------------------------
+# User: Browse a category (/category <name>)
+# -----------------------------
+CATEGORY_PAGE_SIZE = 20
+
+def _category_key(category):
+    """Short ASCII id of a category name, so the callback stays under 64 bytes."""
+    return hashlib.sha1(category.encode("utf-8")).hexdigest()[:12]
+
+async def _category_by_key(key):
+    for category, _ in await get_all_categories():
+        if _category_key(category) == key:
+            return category
+    return None
+
+async def _category_page(category, after):
+    vids, next_after = await list_category_videos(category, CATEGORY_PAGE_SIZE, after)
+    if not vids:
+        return f"📂 No videos in '{category}'" + (" after this page." if after else "."), None
+    text = f"📂 {category}:\n" + ", ".join(f"#{v}" for v in vids) + "\n\nSend /video <number> to watch."
+    markup = None
+    if next_after is not None:
+        markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("Next ▶️", callback_data=f"catv|{next_after}|{_category_key(category)}")]
+        ])
+    return text, markup
+
+async def category_videos_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        return await update.message.reply_text("⚙️ Usage: /category <name>")
+    text, markup = await _category_page(" ".join(context.args), 0)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def handle_category_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    try:
+        _, after, key = query.data.split("|", 2)
+        after = int(after)
+    except ValueError:
+        return
+    category = await _category_by_key(key)
+    if category is None:
+        return await query.edit_message_text("⚠️ This category no longer exists.")
+    text, markup = await _category_page(category, after)
+    await query.edit_message_text(text, reply_markup=markup)
+
 # -----------------------------
 # Existing logic (unchanged)
 # -----------------------------
@@ -220,23 +392,19 @@ async def handle_video_number(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     vid_num = update.message.text.strip()
     user_id = update.effective_user.id
-    user = await get_user_data(user_id)
+    video_file_id = await get_video(vid_num)
 
-    # inside get_video_command
-    ok, msg = await check_plan(user, mode="video")
+    # plan check + usage count in one write
+    consume = USAGE_COUNTERS["video"] if video_file_id else None
+    ok, msg = await check_access(user_id, mode="video", consume=consume, sponsor=False)
     if not ok:
         await update.message.reply_text(msg)
         return
 
-    video_file_id = get_video(vid_num)
     if not video_file_id:
         await update.message.reply_text("❌ Video not found in DB. Ask admin to run /fetchvid.")
         return
 
-    # Increment usage
-    user["usage"]["videos_watched_today"] += 1
-    await save_user_data(user_id, user)
-
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("⬇️ Download", callback_data=f"download_{vid_num}")]
     ])
@@ -247,23 +415,19 @@ async def handle_download_video(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     vid_num = query.data.replace("download_", "")
     user_id = query.from_user.id
-    user = await get_user_data(user_id)
+    video_file_id = await get_video(vid_num)
 
-    # inside get_video_command
-    ok, msg = await check_plan(user, mode="video")
+    # plan check + download count in one write
+    consume = USAGE_COUNTERS["download"] if video_file_id else None
+    ok, msg = await check_access(user_id, mode="video", consume=consume, sponsor=False)
     if not ok:
         await query.answer(msg, show_alert=True)
         return
 
-    video_file_id = get_video(vid_num)
     if not video_file_id:
         await query.answer("❌ Video not found in DB.", show_alert=True)
         return
 
-    # Increment usage
-    user["usage"]["downloads_per_day"] += 1
-    await save_user_data(user_id, user)
-
     await query.message.reply_video(video_file_id, caption=f"⬇️ Download Video {vid_num}")
     await query.answer("🎉 Video sent for download!")
 
@@ -1,39 +1,47 @@
 # main.py
-import os
+import time
 import logging
-from dotenv import load_dotenv
+import config
 from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     MessageHandler,
     filters,
     ContextTypes
 )
 
 # ========================
-# LOAD ENV
+# SETTINGS (config.py)
 # ========================
-load_dotenv()
-
-BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
-FORCE_JOIN_CHANNEL = os.getenv("FORCE_JOIN_CHANNEL", "@playhubby").strip()
-ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x]
-LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID", "0").strip())
-WELCOME_FILE = os.path.join("data", "welcome.txt")
-SPONSOR_BOT_USERNAME = os.getenv("SPONSOR_BOT_USERNAME", "").strip()
-SPONSOR_BOT_ID = int(os.getenv("SPONSOR_BOT_ID", "0").strip())
-REDEEM_CODE_LENGTH = 16
-PRIVATE_DB_CHANNEL_ID = int(os.getenv("PRIVATE_DB_CHANNEL_ID", "0").strip() or 0)
-DATA_FOLDER = os.path.join(os.path.dirname(__file__), "db")
-INDEX_FILENAME = "backup_index"
+BOT_TOKEN = config.BOT_TOKEN
+FORCE_JOIN_CHANNEL = config.FORCE_JOIN_CHANNEL
+ADMIN_IDS = config.ADMIN_IDS
+LOG_CHANNEL_ID = config.LOG_CHANNEL_ID
+WELCOME_FILE = config.WELCOME_FILE
+SPONSOR_BOT_USERNAME = config.SPONSOR_BOT_USERNAME
+SPONSOR_BOT_ID = config.SPONSOR_BOT_ID
+REDEEM_CODE_LENGTH = config.REDEEM_CODE_LENGTH
+PRIVATE_DB_CHANNEL_ID = config.PRIVATE_DB_CHANNEL_ID
+DATA_FOLDER = config.DATA_FOLDER
+INDEX_FILENAME = config.INDEX_FILENAME
+USER_FLUSH_INTERVAL = config.USER_FLUSH_INTERVAL  # seconds
+ACTIVITY_FLUSH_INTERVAL = config.ACTIVITY_FLUSH_INTERVAL  # seconds
+SNAPSHOT_INTERVAL = config.SNAPSHOT_INTERVAL  # minutes
+WARM_START = config.WARM_START
+WARM_SNAPSHOT_INTERVAL = config.WARM_SNAPSHOT_INTERVAL  # minutes
+UPDATE_CONCURRENCY = config.UPDATE_CONCURRENCY  # 0 = sequential
+UPDATE_METRICS_INTERVAL = config.UPDATE_METRICS_INTERVAL  # seconds
+PLAN_EXPIRY_INTERVAL = config.PLAN_EXPIRY_INTERVAL  # seconds
+PLAN_EXPIRY_NOTIFY = config.PLAN_EXPIRY_NOTIFY
 
 # ========================
 # IMPORT HANDLERS
 # ========================
 from handlers.start import start
-from handlers.force_join import handle_recheck_join, RECHECK_BTN_DATA
+from handlers.force_join import handle_recheck_join, handle_chat_member, RECHECK_BTN_DATA
 
 from handlers.menu import send_main_menu, handle_menu_callback
 from handlers.videos import (
@@ -49,14 +57,20 @@ from handlers.profile import show_profile
 from handlers.redeem import start_redeem_command, start_redeem_from_menu, handle_redeem_text
 from handlers import admin, session, tasks
 from handlers.admin_restore import restore_db_command
-from plan_system import check_and_update_expiry, refill_free_plan_credits
+from plan_system import expire_due_plans
 from admin_commands import admin_set_plan
 from user_system import ensure_user_registered
 from utils.db import update_last_active
 from handlers.giveaways import show_giveaways, handle_giveaway_callback
 from handlers.referral import referral_command
 from handlers import videos
-from utils.db import update_last_active, init_db
+from utils.db import update_last_active, init_db, flush_users, load_warm_start, write_warm_snapshot
+from utils.sqlite_pool import close_all as close_all_databases
+from utils.activity import flush_heartbeats, load_session_index
+from utils import backup, plan_expiry
+import backup_system
+from utils import broadcast as broadcaster
+from utils.update_processor import OrderedUpdateProcessor, format_stats
 from handlers.admin import videolist_command   # ✅ admin side
 from handlers.admin import addredeem_command
 
@@ -76,6 +90,7 @@ logger = logging.getLogger(__name__)
 # MIDDLEWARES
 # ========================
 async def activity_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # in-memory heartbeat only; written to the DB by flush_activity
     if update.effective_user:
         await update_last_active(update.effective_user.id)
 
@@ -85,8 +100,60 @@ async def global_user_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
         result = ensure_user_registered(user_id, update.effective_user)
         if result:
             await result
-        check_and_update_expiry(user_id)
-        refill_free_plan_credits(user_id)
+        # plan expiry: plan_expiry_job; free-plan refill: utils/checks.py
+
+# ========================
+# USER CACHE FLUSH
+# ========================
+async def flush_user_cache(context: ContextTypes.DEFAULT_TYPE):
+    await flush_users()
+
+async def flush_activity(context: ContextTypes.DEFAULT_TYPE):
+    await flush_heartbeats()
+
+async def warm_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    await write_warm_snapshot()
+
+async def plan_expiry_job(context: ContextTypes.DEFAULT_TYPE):
+    now = int(time.time())
+    for user_id, plan_name, expired_at in await expire_due_plans(now):
+        logger.info("Plan %s of user %s expired", plan_name, user_id)
+        # plans that lapsed long ago (bot was down / first run) are downgraded quietly
+        if PLAN_EXPIRY_NOTIFY and now - expired_at < 86400:
+            try:
+                await context.bot.send_message(
+                    user_id,
+                    f"⌛ Your {plan_name} plan has expired and you are back on the Free plan.\n"
+                    "Tap 💎 Upgrade Plan in /menu to renew."
+                )
+            except Exception as e:
+                logger.warning("Could not notify %s about plan expiry: %s", user_id, e)
+
+async def log_update_metrics(context: ContextTypes.DEFAULT_TYPE):
+    processor = context.application.update_processor
+    if isinstance(processor, OrderedUpdateProcessor):
+        logger.info(format_stats(processor.stats()))
+
+async def on_init(app: Application):
+    await videos.migrate_fetched_videos()
+    await broadcaster.notify_interrupted(app.bot)
+
+async def on_stop(app: Application):
+    # post_stop: runs before Application.shutdown() closes app.bot's HTTP client,
+    # so the final backup uploads can still go out
+    await videos.flush_video_ingest()
+    flushed = await flush_users()
+    logger.info("Flushed %s cached users on shutdown", flushed)
+    backup_system.save_manifest()
+    await flush_heartbeats()
+    if WARM_START:
+        await write_warm_snapshot()
+    await backup.flush_backups()
+    if backup.BACKUP_MODE == "snapshot":
+        await backup.take_snapshot()
+
+async def on_shutdown(app: Application):
+    close_all_databases()
 
 # ========================
 # BASIC COMMANDS
@@ -102,7 +169,19 @@ def main():
     if not BOT_TOKEN:
         raise SystemExit("BOT_TOKEN missing in .env")
     init_db()
-    app = Application.builder().token(BOT_TOKEN).build()
+    logger.info("Plan expiry schedule loaded: %s expiring plans", plan_expiry.load())
+    logger.info("Video index loaded: %s videos", videos.load_video_index())
+    if WARM_START:
+        load_warm_start()
+    logger.info("Session index loaded: %s active sessions", load_session_index())
+    builder = Application.builder().token(BOT_TOKEN).post_init(on_init).post_stop(on_stop).post_shutdown(on_shutdown)
+    if UPDATE_CONCURRENCY > 0:
+        # bounded concurrency, updates of one user still run in order
+        builder = builder.concurrent_updates(OrderedUpdateProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
+
+    # Backups reuse the application's Bot and HTTP session
+    backup.set_bot(app.bot)
 
     # Save admin IDs in bot_data for use in videolist
     app.bot_data["ADMIN_IDS"] = ADMIN_IDS
@@ -143,6 +222,7 @@ def main():
     app.add_handler(CommandHandler("videolist", videolist_command))
     app.add_handler(CommandHandler("videodetails", videodetails_command))
     app.add_handler(CommandHandler("video", get_video_command))
+    app.add_handler(CommandHandler("category", videos.category_videos_command))
 
     # ========================
     # CALLBACKS
@@ -153,6 +233,7 @@ def main():
     app.add_handler(CallbackQueryHandler(video_menu, pattern="^menu_videos$"))
     app.add_handler(CallbackQueryHandler(handle_watch_video, pattern="^watch_"))
     app.add_handler(CallbackQueryHandler(handle_download_video, pattern="^download_"))
+    app.add_handler(CallbackQueryHandler(videos.handle_category_page, pattern=r"^catv\|"))
     app.add_handler(CallbackQueryHandler(tasks.show_tasks, pattern="^tasks$"))
     app.add_handler(CallbackQueryHandler(tasks.handle_open_link, pattern="^open_"))
     app.add_handler(CallbackQueryHandler(tasks.handle_task_done, pattern="^task_done_"))
@@ -160,6 +241,9 @@ def main():
     app.add_handler(CallbackQueryHandler(referral_command, pattern="^ref_link$"))
     app.add_handler(CallbackQueryHandler(handle_giveaway_callback, pattern="^join_"))
 
+    # Force-join cache: joins/leaves in the channel (bot must be admin there)
+    app.add_handler(ChatMemberHandler(handle_chat_member, ChatMemberHandler.CHAT_MEMBER))
+
     # ========================
     # MESSAGE HANDLERS
     # ========================
@@ -176,11 +260,20 @@ def main():
     # BACKGROUND JOBS
     # ========================
     job_queue = app.job_queue
-    job_queue.run_repeating(session.check_sessions, interval=60, first=60)
+    job_queue.run_repeating(session.check_sessions, interval=session.CHECK_INTERVAL, first=session.CHECK_INTERVAL)
+    job_queue.run_repeating(flush_user_cache, interval=USER_FLUSH_INTERVAL, first=USER_FLUSH_INTERVAL)
+    job_queue.run_repeating(flush_activity, interval=ACTIVITY_FLUSH_INTERVAL, first=ACTIVITY_FLUSH_INTERVAL)
+    job_queue.run_repeating(plan_expiry_job, interval=PLAN_EXPIRY_INTERVAL, first=5)
+    if UPDATE_CONCURRENCY > 0:
+        job_queue.run_repeating(log_update_metrics, interval=UPDATE_METRICS_INTERVAL, first=UPDATE_METRICS_INTERVAL)
+    if WARM_START:
+        job_queue.run_repeating(warm_snapshot_job, interval=WARM_SNAPSHOT_INTERVAL * 60, first=WARM_SNAPSHOT_INTERVAL * 60)
+    if backup.BACKUP_MODE == "snapshot":
+        job_queue.run_repeating(backup.snapshot_job, interval=SNAPSHOT_INTERVAL * 60, first=SNAPSHOT_INTERVAL * 60)
 
     logger.info("Bot started...")
     app.run_polling(
-        allowed_updates=["message", "callback_query", "channel_post", "edited_channel_post"]
+        allowed_updates=["message", "callback_query", "channel_post", "edited_channel_post", "chat_member"]
     )
 # ========================
 # ENTRY POINT
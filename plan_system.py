@@ -1,131 +1,48 @@
-import json
-import os
-from datetime import datetime, timedelta
-from config import DB_FOLDER, BACKUP_CHANNEL_ID
-from backup_system import backup_user_data  # From Step 12
- 
+import time
+from utils import db, plan_expiry, user_store
+# Plans are defined in data/plans.json and compiled (hot-reloaded) by utils/plans.py;
+# the old PLANS dict is gone, use utils.plans.get_plan() / all_plans()
+from utils.plans import get_plan, is_plan
 
-# Define all plans here
-PLANS = {
-    "free": {
-        "credits": 3,
-        "videos_per_day": 10,
-        "downloads_per_day": 0,
-        "expiry_days": None
-    },
-    "daily": {
-        "credits": 35,
-        "videos_per_day": -1,  # Unlimited
-        "downloads_per_day": -1,
-        "expiry_days": 1
-    },
-    "monthly": {
-        "credits": 860,
-        "videos_per_day": -1,
-        "downloads_per_day": -1,
-        "expiry_days": 28
-    },
-    "premium": {
-        "credits": -1,  # Unlimited
-        "videos_per_day": -1,
-        "downloads_per_day": -1,
-        "expiry_days": 40
-    },
-    "elite": {
-        "credits": -1,
-        "videos_per_day": -1,
-        "downloads_per_day": 10,
-        "expiry_days": 45
-    },
-    "superior": {
-        "credits": -1,
-        "videos_per_day": -1,
-        "downloads_per_day": 25,
-        "expiry_days": 60
-    }
-}
 
-
-def load_user_sync(user_id):
-    """Load user's JSON file synchronously (for internal use)"""
-    path = os.path.join(DB_FOLDER, f"{user_id}.json")
-    if os.path.exists(path):
-        with open(path, "r") as f:
-            return json.load(f)
-    return None
-
-
-def save_user_sync(user_id, data):
-    """Save user data synchronously (internal use)"""
-    path = os.path.join(DB_FOLDER, f"{user_id}.json")
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
-    backup_user_data(user_id, path)
-
-
-def set_plan(user_id, plan_name):
+async def set_plan(user_id, plan_name):
     """Assign a plan to a user"""
-    user = load_user_sync(user_id)
-    if not user:
+    if not await db.user_exists(user_id):
         return False, "User not found."
 
-    plan_name = plan_name.lower()
-    if plan_name not in PLANS:
+    if not is_plan(plan_name):
         return False, "Invalid plan name."
 
-    plan = PLANS[plan_name]
-    user["plan"] = plan_name
-    user["credits"] = plan["credits"]
-    user["videos_per_day"] = plan["videos_per_day"]
-    user["downloads_per_day"] = plan["downloads_per_day"]
-
-    if plan["expiry_days"]:
-        user["plan_expiry"] = (datetime.now() + timedelta(days=plan["expiry_days"])).strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        user["plan_expiry"] = None
-
-    save_user_sync(user_id, user)
-    return True, f"Plan '{plan_name}' set successfully."
-
-
-# ------------------ Async functions ------------------
-
-async def check_and_update_expiry(user_id):
-    """Check if user's plan expired, revert to free if needed"""
-    user = await get_user_data(user_id)
-    if not user or not user.get("plan_expiry"):
-        return
-
-    expiry_timestamp = user.get("plan_expiry")
-    if expiry_timestamp:
-        if isinstance(expiry_timestamp, int):
-            expiry_date = datetime.fromtimestamp(expiry_timestamp)
-        else:
-            expiry_date = datetime.strptime(expiry_timestamp, "%Y-%m-%d %H:%M:%S")
-    else:
-        expiry_date = None
-
-    if expiry_date and datetime.now() > expiry_date:
-        # Revert to free plan
-        plan = PLANS["free"]
-        user["plan"] = "free"
-        user["credits"] = plan["credits"]
-        user["videos_per_day"] = plan["videos_per_day"]
-        user["downloads_per_day"] = plan["downloads_per_day"]
-        user["plan_expiry"] = None
-        await save_user_data(user_id, user)
-
-
-async def refill_free_plan_credits(user_id):
-    """Refill credits for free plan users hourly"""
-    user = await get_user_data(user_id)
-    if not user or user.get("plan") != "free":
-        return
-
-    last_refill_str = user.get("last_refill", "1970-01-01 00:00:00")
-    last_refill = datetime.strptime(last_refill_str, "%Y-%m-%d %H:%M:%S")
-
-    if datetime.now() - last_refill >= timedelta(hours=1):
-        user["credits"] = min(user.get("credits", 0) + 3, PLANS["free"]["credits"])
-        user["last_refill"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        await save_user_data(user_id, user)
+    plan = get_plan(plan_name)
+    expires_at = int(time.time()) + plan.expiry_seconds if plan.expiry_seconds else None
+    async with db.user_txn(user_id) as user:
+        user["plan"] = {"name": plan.key, "expires_at": expires_at}
+        if plan.credits is not None:
+            user["credits"] = plan.credits
+    plan_expiry.schedule_user(user_id, user)
+    return True, f"Plan '{plan.key}' set successfully."
+
+
+# ------------------ Expiry ------------------
+
+async def expire_due_plans(now=None):
+    """
+    Downgrade users whose plan expiry (see utils/plan_expiry.py) has passed.
+    Returns [(user_id, expired plan name, expires_at)]; each user is downgraded once.
+    """
+    now = int(now if now is not None else time.time())
+    expired = []
+    for user_id, _ in plan_expiry.pop_due(now):
+        async with db.user_txn(user_id) as user:
+            expires_at = user_store.plan_expiry_of(user)
+            if expires_at is None:
+                continue  # already downgraded or changed to a non-expiring plan
+            if expires_at > now:
+                plan_expiry.schedule(user_id, expires_at)  # extended meanwhile
+                continue
+            plan = user.get("plan")
+            expired.append((user_id, plan.get("name") if isinstance(plan, dict) else plan, expires_at))
+            # Revert to free plan
+            user["plan"] = {"name": "free", "expires_at": None}
+            user["credits"] = get_plan("free").credits or 0
+    return expired
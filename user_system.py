@@ -1,24 +1,26 @@
-import os
-import json
-from config import DB_FOLDER
-from plan_system import PLANS
-from datetime import datetime
-from backup_system import backup_user_data
+import time
+from utils.plans import get_plan
+from utils.db import user_exists, get_user, save_user
+from utils.locks import user_lock
+
+
+async def _register(user_id, user_obj):
+    if await user_exists(user_id):
+        return
+    async with user_lock(user_id):
+        if await user_exists(user_id):
+            return  # registered by a concurrent update while we waited
+        await _create(user_id, user_obj)
+
+
+async def _create(user_id, user_obj):
+    data = await get_user(user_id, user_obj.username)
+    data["name"] = user_obj.full_name
+    data["credits"] = get_plan("free").credits or 0
+    data["last_refill_at"] = int(time.time())
+    await save_user(user_id, data)
+
 
 def ensure_user_registered(user_id, user_obj):
-    path = os.path.join(DB_FOLDER, f"{user_id}.json")
-    if not os.path.exists(path):
-        data = {
-            "user_id": user_id,
-            "name": user_obj.full_name,
-            "username": user_obj.username,
-            "plan": "free",
-            "credits": PLANS["free"]["credits"],
-            "videos_per_day": PLANS["free"]["videos_per_day"],
-            "downloads_per_day": PLANS["free"]["downloads_per_day"],
-            "last_refill": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "plan_expiry": None
-        }
-        with open(path, "w") as f:
-            json.dump(data, f, indent=4)
-        backup_user_data(user_id, path)  # Step 12 backup
+    """Returns a coroutine that creates the user in the user store if missing."""
+    return _register(user_id, user_obj)
@@ -0,0 +1,136 @@
+# utils/activity.py
+"""
+In-memory heartbeat table for user activity.
+
+touch() is called for every incoming message and only updates a dict;
+flush_heartbeats() writes the changed timestamps to the users.last_active
+column in one batch (run periodically from main and on shutdown) and then
+forgets them, except for users in the session index, so the table only
+holds recently active users.
+
+It also keeps the session-expiry index: a min-heap of users that have
+active messages, ordered by last activity, so the session job only looks
+at sessions that are actually due.
+"""
+import time
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+import config
+from . import user_store
+from .sqlite_pool import get_db
+
+_bot_db = get_db(config.BOT_DB)
+
+_heartbeats: Dict[int, int] = {}  # user_id -> last seen (unix seconds)
+_unflushed: Dict[int, int] = {}   # heartbeats not yet written to the store
+
+
+def touch(user_id: int, now: Optional[int] = None) -> None:
+    """Record activity for a user (no I/O)."""
+    user_id = int(user_id)
+    ts = int(now if now is not None else time.time())
+    _heartbeats[user_id] = ts
+    _unflushed[user_id] = ts
+
+
+def get_last_active(user_id: int) -> Optional[int]:
+    """
+    Last heartbeat held in memory, or None. Only unflushed heartbeats and those
+    of users with a tracked session are kept; others are in users.last_active.
+    """
+    return _heartbeats.get(int(user_id))
+
+
+async def flush_heartbeats() -> int:
+    """Write pending heartbeats to the user store. Returns number of users in the batch."""
+    if not _unflushed:
+        return 0
+
+    batch = dict(_unflushed)
+    _unflushed.clear()
+    try:
+        missing = await _bot_db.submit(user_store.save_last_active, list(batch.items()))
+    except Exception as e:
+        print(f"[Activity] Failed to flush {len(batch)} heartbeats: {e}")
+        for user_id, ts in batch.items():
+            _unflushed.setdefault(user_id, ts)
+        return 0
+
+    # users whose row isn't written yet: hand the heartbeat to the cached record
+    if missing:
+        from .db import apply_heartbeat  # utils.db imports this module
+        for user_id in missing:
+            if apply_heartbeat(user_id, batch[user_id]):
+                _unflushed.setdefault(user_id, batch[user_id])
+
+    # persisted: keep only what the session index and the next flush still need
+    for user_id in batch:
+        if user_id not in _unflushed and user_id not in _sessions:
+            _heartbeats.pop(user_id, None)
+    return len(batch)
+
+
+# ---------------- SESSION EXPIRY INDEX ----------------
+# Heap entries are (last_active, user_id). Heartbeats don't touch the heap;
+# a popped entry whose user was active since is pushed back with the newer
+# timestamp (lazy update). _sessions holds the timestamp of each user's live
+# heap entry, anything else in the heap is stale.
+
+_session_heap: List[Tuple[int, int]] = []
+_sessions: Dict[int, int] = {}
+
+
+def _push_session(user_id: int, last_active: int) -> None:
+    _sessions[user_id] = last_active
+    heapq.heappush(_session_heap, (last_active, user_id))
+
+
+def track_session(user_id: int, last_active: Optional[int] = None) -> None:
+    """Add a user with active messages to the expiry index."""
+    user_id = int(user_id)
+    if user_id in _sessions:
+        return
+    if last_active is None:
+        last_active = get_last_active(user_id) or int(time.time())
+    _push_session(user_id, int(last_active))
+
+
+def untrack_session(user_id: int) -> None:
+    """Remove a user from the expiry index (its heap entry goes stale)."""
+    user_id = int(user_id)
+    _sessions.pop(user_id, None)
+    if user_id not in _unflushed:
+        _heartbeats.pop(user_id, None)
+
+
+def pop_expired_sessions(expiry: int, now: Optional[float] = None) -> List[int]:
+    """Return (and untrack) users whose last activity is at least `expiry` seconds old."""
+    now = now if now is not None else time.time()
+    expired = []
+    while _session_heap and _session_heap[0][0] + expiry <= now:
+        ts, user_id = heapq.heappop(_session_heap)
+        if _sessions.get(user_id) != ts:
+            continue  # stale entry
+        latest = max(ts, get_last_active(user_id) or 0)
+        if latest + expiry > now:
+            _push_session(user_id, latest)
+            continue
+        del _sessions[user_id]
+        if user_id not in _unflushed:
+            _heartbeats.pop(user_id, None)
+        expired.append(user_id)
+    return expired
+
+
+def session_count() -> int:
+    return len(_sessions)
+
+
+def load_session_index() -> int:
+    """Rebuild the expiry index from the user store (call once at startup)."""
+    _session_heap.clear()
+    _sessions.clear()
+    for user_id, last_active in user_store.list_active_sessions():
+        _push_session(user_id, max(last_active or 0, get_last_active(user_id) or 0))
+    return len(_sessions)
@@ -1,14 +1,29 @@
 # utils/backup.py
 import json
+import gzip
 import time
 import asyncio
-from typing import Dict, Any
+import hashlib
+from typing import Dict, Any, Optional
 from telegram import Bot
 import config
 import os
 
+_bot: Optional[Bot] = None
+
+
+def set_bot(bot: Bot) -> None:
+    """Reuse the application's Bot (and its HTTP session) for backups."""
+    global _bot
+    _bot = bot
+
+
 async def _get_bot() -> Bot:
-    return Bot(token=config.BOT_TOKEN)
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=config.BOT_TOKEN)
+        await _bot.initialize()
+    return _bot
 
 async def read_index_from_pinned(bot: Bot) -> Dict[str, Any]:
     """Read the JSON index from the pinned message in the channel."""
@@ -27,18 +42,24 @@ async def read_index_from_pinned(bot: Bot) -> Dict[str, Any]:
     except Exception:
         return {}
 
-async def write_index_to_pinned(bot: Bot, index: Dict[str, Any]) -> None:
+MAX_PINNED_CHARS = 4096  # Telegram message limit
+
+
+async def write_index_to_pinned(bot: Bot, index: Dict[str, Any]) -> bool:
     """Send or edit the pinned message with the index JSON. If not exists, create and pin it."""
     if config.PRIVATE_DB_CHANNEL_ID == 0:
-        return
-    text = json.dumps(index, ensure_ascii=False, indent=2)
+        return False
+    text = json.dumps(index, ensure_ascii=False, separators=(",", ":"))
+    if len(text) > MAX_PINNED_CHARS:
+        print(f"write_index_to_pinned error: root is {len(text)} chars, over {MAX_PINNED_CHARS}")
+        return False
     try:
         chat = await bot.get_chat(config.PRIVATE_DB_CHANNEL_ID)
         pinned = chat.pinned_message
         if pinned:  # allow edit even if not authored by this bot
             try:
                 await bot.edit_message_text(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=pinned.message_id, text=text)
-                return
+                return True
             except Exception:
                 pass
         # else send a new index
@@ -47,64 +68,162 @@ async def write_index_to_pinned(bot: Bot, index: Dict[str, Any]) -> None:
             await bot.pin_chat_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=msg.message_id, disable_notification=True)
         except Exception:
             pass
+        return True
     except Exception as e:
         print("write_index_to_pinned error:", e)
+        return False
 
-async def update_user_backup(user_id: int, local_filepath: str, new_data: Dict[str, Any]) -> None:
-    """
-    Uploads user backup: both JSON file and JSON text.
-    Deletes previous ones if exists. Only uploads if changed.
-    """
-    if config.PRIVATE_DB_CHANNEL_ID == 0:
-        return
 
-    bot = await _get_bot()
-    index = await read_index_from_pinned(bot)
-    str_uid = str(user_id)
-    prev = index.get(str_uid)
+# ---------------- SHARDED INDEX ----------------
+# The pinned message only holds a small root: {"v": 2, "shards": {n: {...}}}.
+# Each shard is a gzip-compressed JSON document with the entries of users
+# where user_id % INDEX_SHARDS == n. An entry is
+#   {"file_message_id", "text_message_id", "file_id", "hash", "uploaded_at"}
+# Shards are downloaded on first access and only dirty shards are re-uploaded.
 
-    # Exclude trivial fields from change detection
-    ignore_keys = ["last_active", "active_messages"]
-    filtered_new_data = {k: v for k, v in new_data.items() if k not in ignore_keys}
+INDEX_SHARDS = 16
+INDEX_VERSION = 2
 
-    # Check if data has changed
-    old_json = None
-    if prev and "last_data" in prev:
-        try:
-            old_data = json.loads(prev["last_data"])
-            filtered_old_data = {k: v for k, v in old_data.items() if k not in ignore_keys}
-            old_json = filtered_old_data
-        except Exception:
-            pass
-    if old_json == filtered_new_data:
-        # No significant change, skip upload
-        return
+# Exclude trivial fields from change detection
+IGNORE_KEYS = ("last_active", "active_messages")
 
-    # Delete previous messages if exist
-    if prev:
-        for key in ("file_message_id", "text_message_id"):
-            if key in prev:
+
+def content_hash(data: Dict[str, Any]) -> str:
+    """Stable hash of the backup-relevant part of a user record."""
+    filtered = {k: v for k, v in data.items() if k not in IGNORE_KEYS}
+    raw = json.dumps(filtered, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def shard_of(user_id) -> int:
+    return int(user_id) % INDEX_SHARDS
+
+
+class BackupIndex:
+    """Lazily loaded, sharded backup index."""
+
+    def __init__(self, root: Optional[Dict[str, Any]] = None):
+        self.root: Dict[str, Any] = {"v": INDEX_VERSION, "shards": {}}
+        self._shards: Dict[int, Dict[str, Any]] = {}
+        self._dirty: set = set()
+        if root and root.get("v") == INDEX_VERSION:
+            self.root = root
+        elif root:
+            self._import_legacy(root)
+
+    def _import_legacy(self, legacy: Dict[str, Any]) -> None:
+        """Convert the old flat pinned index (full last_data per user)."""
+        for str_uid, info in legacy.items():
+            if not str_uid.lstrip("-").isdigit() or not isinstance(info, dict):
+                continue
+            entry = {k: info.get(k) for k in ("file_message_id", "text_message_id", "file_id", "uploaded_at")}
+            try:
+                entry["hash"] = content_hash(json.loads(info.get("last_data") or "{}"))
+            except Exception:
+                entry["hash"] = None
+            n = shard_of(str_uid)
+            self._shards.setdefault(n, {})[str_uid] = entry
+            self._dirty.add(n)
+        for n in range(INDEX_SHARDS):
+            self._shards.setdefault(n, {})
+
+    async def _shard(self, bot: Bot, n: int) -> Dict[str, Any]:
+        shard = self._shards.get(n)
+        if shard is None:
+            shard = {}
+            info = self.root["shards"].get(str(n))
+            if info and info.get("file_id"):
                 try:
-                    await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=int(prev[key]))
+                    tfile = await bot.get_file(info["file_id"])
+                    raw = await tfile.download_as_bytearray()
+                    shard = json.loads(gzip.decompress(bytes(raw)).decode("utf-8"))
+                except Exception as e:
+                    # keep the shard unloaded so a later access retries the download
+                    print(f"[Backup] Failed to load index shard {n}: {e}")
+                    return {}
+            self._shards[n] = shard
+        return shard
+
+    async def get(self, bot: Bot, user_id) -> Optional[Dict[str, Any]]:
+        return (await self._shard(bot, shard_of(user_id))).get(str(user_id))
+
+    async def set(self, bot: Bot, user_id, entry: Dict[str, Any]) -> None:
+        n = shard_of(user_id)
+        shard = await self._shard(bot, n)
+        # never overwrite a shard we failed to download
+        if n not in self._shards:
+            raise RuntimeError(f"index shard {n} is not available")
+        shard[str(user_id)] = entry
+        self._dirty.add(n)
+
+    async def items(self, bot: Bot):
+        """All (user_id, entry) pairs, loading every shard."""
+        result = []
+        for n in range(INDEX_SHARDS):
+            result.extend((await self._shard(bot, n)).items())
+        return result
+
+    async def save(self, bot: Bot) -> int:
+        """Upload dirty shards and update the pinned root once. Returns shards written."""
+        if not self._dirty:
+            return 0
+        written = 0
+        for n in sorted(self._dirty):
+            payload = gzip.compress(json.dumps(self._shards[n], separators=(",", ":")).encode("utf-8"))
+            try:
+                msg = await bot.send_document(
+                    chat_id=config.PRIVATE_DB_CHANNEL_ID,
+                    document=payload,
+                    filename=f"{config.INDEX_FILENAME}_{n}.json.gz",
+                    disable_notification=True
+                )
+            except Exception as e:
+                print(f"[Backup] Failed to upload index shard {n}: {e}")
+                continue
+            old = self.root["shards"].get(str(n))
+            self.root["shards"][str(n)] = {
+                "message_id": msg.message_id,
+                "file_id": msg.document.file_id,
+                "count": len(self._shards[n]),
+            }
+            if old and old.get("message_id"):
+                try:
+                    await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=old["message_id"])
                 except Exception:
                     pass
+            self._dirty.discard(n)
+            written += 1
+        if written:
+            await write_index_to_pinned(bot, self.root)
+        return written
+
+
+async def update_user_backup(bot: Bot, index: BackupIndex, user_id: int, new_data: Dict[str, Any]) -> bool:
+    """
+    Uploads user backup: both JSON file and JSON text.
+    Only uploads if the content hash changed; the previous messages are
+    deleted once both new ones are up and indexed. Updates `index` (the
+    caller saves it); returns True if uploaded, False if unchanged and
+    raises if the upload failed (the previous backup is left in place).
+    """
+    prev = await index.get(bot, user_id)
+    new_hash = content_hash(new_data)
+    if prev and prev.get("hash") == new_hash:
+        # No significant change, skip upload
+        return False
 
     # Upload new JSON file
-    try:
-        with open(local_filepath, "rb") as f:
-            file_msg = await bot.send_document(
-                chat_id=config.PRIVATE_DB_CHANNEL_ID,
-                document=f,
-                filename=f"{user_id}.json",
-                caption=f"Backup file for user {user_id} at {int(time.time())}"
-            )
-    except Exception as e:
-        print("update_user_backup file upload error:", e)
-        return
+    text_str = json.dumps(new_data, ensure_ascii=False, indent=2)
+    file_msg = await bot.send_document(
+        chat_id=config.PRIVATE_DB_CHANNEL_ID,
+        document=text_str.encode("utf-8"),
+        filename=f"{user_id}.json",
+        caption=f"Backup file for user {user_id} at {int(time.time())}"
+    )
+    new_ids = [file_msg.message_id]
 
-    # Upload new JSON text (pretty-printed)
     try:
-        text_str = json.dumps(new_data, ensure_ascii=False, indent=2)
+        # Upload new JSON text (pretty-printed)
         text_msg = await bot.send_message(
             chat_id=config.PRIVATE_DB_CHANNEL_ID,
             text=(
@@ -117,55 +236,477 @@ async def update_user_backup(user_id: int, local_filepath: str, new_data: Dict[s
             ),
             parse_mode="HTML"
         )
-    except Exception as e:
-        print("update_user_backup text upload error:", e)
-        text_msg = None
-
-    # Update index
-    index[str_uid] = {
-        "file_message_id": file_msg.message_id,
-        "text_message_id": text_msg.message_id if text_msg else None,
-        "uploaded_at": int(time.time()),
-        "filename": f"{user_id}.json",
-        "last_data": json.dumps(new_data, ensure_ascii=False)  # keep raw data for change detection
-    }
-    await write_index_to_pinned(bot, index)
-async def restore_all_from_index() -> Dict[str, str]:
+        new_ids.append(text_msg.message_id)
+
+        # Update index
+        await index.set(bot, user_id, {
+            "file_message_id": file_msg.message_id,
+            "text_message_id": text_msg.message_id,
+            "file_id": file_msg.document.file_id,
+            "hash": new_hash,
+            "uploaded_at": int(time.time()),
+        })
+    except Exception:
+        # the index still points at the previous backup: drop the half-done upload
+        for message_id in new_ids:
+            try:
+                await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=message_id)
+            except Exception:
+                pass
+        raise
+
+    # Delete previous messages now that the new ones are indexed
+    if prev:
+        for key in ("file_message_id", "text_message_id"):
+            if prev.get(key):
+                try:
+                    await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=int(prev[key]))
+                except Exception:
+                    pass
+    return True
+
+
+# ---------------- BACKUP QUEUE ----------------
+# save paths call enqueue_user_backup(); a single worker coalesces repeated
+# saves of the same user within BACKUP_DEBOUNCE seconds, uploads the batch
+# with one shared Bot and writes the pinned index once per batch.
+
+BACKUP_DEBOUNCE = getattr(config, "BACKUP_DEBOUNCE", 30)  # seconds
+BACKUP_MODE = getattr(config, "BACKUP_MODE", "per_user")  # "per_user" or "snapshot"
+
+_pending: Dict[int, Dict[str, Any]] = {}  # user_id -> latest data (coalesced)
+_index: Optional[BackupIndex] = None      # in-memory sharded index
+_wakeup: Optional[asyncio.Event] = None
+_worker: Optional[asyncio.Task] = None
+_batch_lock: Optional[asyncio.Lock] = None
+
+
+def enqueue_user_backup(user_id: int, data: Dict[str, Any]) -> None:
+    """Queue a user for backup. Repeated calls before the batch runs are coalesced."""
+    global _wakeup, _worker
+    if config.PRIVATE_DB_CHANNEL_ID == 0:
+        return
+    if BACKUP_MODE == "snapshot":
+        return  # picked up by the next snapshot_job run (users.updated_at)
+    _pending[int(user_id)] = data
+    if _worker is None or _worker.done():
+        _wakeup = asyncio.Event()
+        _worker = asyncio.create_task(_backup_worker())
+    _wakeup.set()
+
+
+async def _load_index(bot: Bot) -> BackupIndex:
+    global _index
+    if _index is None:
+        _index = BackupIndex(await read_index_from_pinned(bot))
+    return _index
+
+
+async def flush_backups() -> int:
+    """Upload every pending user now and write the index once. Returns number uploaded."""
+    global _batch_lock
+    if _batch_lock is None:
+        _batch_lock = asyncio.Lock()
+    async with _batch_lock:
+        if not _pending:
+            return 0
+        bot = await _get_bot()
+        index = await _load_index(bot)
+        batch = dict(_pending)
+        _pending.clear()
+        uploaded = 0
+        failed = 0
+        for user_id, data in batch.items():
+            try:
+                if await update_user_backup(bot, index, user_id, data):
+                    uploaded += 1
+            except Exception as e:
+                print(f"[Backup] Failed to back up user {user_id}: {e}")
+                # retry with the next batch, unless a newer save is already queued
+                _pending.setdefault(user_id, data)
+                failed += 1
+        await index.save(bot)
+        if failed and _wakeup is not None:
+            _wakeup.set()  # the worker retries after its debounce
+        return uploaded
+
+
+async def _backup_worker() -> None:
+    while True:
+        await _wakeup.wait()
+        _wakeup.clear()
+        # debounce: let repeated saves of the same users pile up first
+        await asyncio.sleep(BACKUP_DEBOUNCE)
+        try:
+            uploaded = await flush_backups()
+            if uploaded:
+                print(f"[Backup] Uploaded {uploaded} user backups")
+        except Exception as e:
+            print(f"[Backup] Batch failed: {e}")
+
+
+# ---------------- SNAPSHOTS ----------------
+# Every SNAPSHOT_INTERVAL minutes the users written since the previous
+# snapshot (users.updated_at, so nothing is lost across restarts) are packed
+# into one gzip JSONL document (a delta); every SNAPSHOT_MAX_DELTAS deltas a
+# full base snapshot starts a new chain. The chain manifest is its own gzip
+# JSON document; the pinned root only points at it under "chain":
+#   [{"seq", "kind": "base"|"delta", "message_id", "file_id", "users",
+#     "sha256", "taken_at", "created_at"}]
+# A restore replays the base and then every delta in order.
+
+SNAPSHOT_MAX_DELTAS = getattr(config, "SNAPSHOT_MAX_DELTAS", 12)
+SNAPSHOT_FOLDER = os.path.join(config.DATA_FOLDER, "snapshots")
+
+_chain: Optional[list] = None  # loaded manifest
+_snapshot_lock: Optional[asyncio.Lock] = None
+
+
+async def _load_chain(bot: Bot, index: BackupIndex) -> list:
+    """The snapshot chain manifest. Raises if the manifest document can't be read."""
+    global _chain
+    if _chain is None:
+        if "snapshots" in index.root:
+            _chain = list(index.root["snapshots"])  # old inline manifest, moved out on the next save
+        elif index.root.get("chain", {}).get("file_id"):
+            tfile = await bot.get_file(index.root["chain"]["file_id"])
+            raw = bytes(await tfile.download_as_bytearray())
+            _chain = json.loads(gzip.decompress(raw).decode("utf-8"))
+        else:
+            _chain = []
+    return _chain
+
+
+async def _save_chain(bot: Bot, index: BackupIndex, chain: list) -> bool:
+    """Upload the manifest document and point the pinned root at it."""
+    global _chain
+    payload = gzip.compress(json.dumps(chain, separators=(",", ":")).encode("utf-8"))
+    msg = await bot.send_document(
+        chat_id=config.PRIVATE_DB_CHANNEL_ID,
+        document=payload,
+        filename=f"{config.INDEX_FILENAME}_snapshots.json.gz",
+        disable_notification=True
+    )
+    old = index.root.get("chain")
+    index.root["chain"] = {"message_id": msg.message_id, "file_id": msg.document.file_id, "count": len(chain)}
+    index.root.pop("snapshots", None)
+    if not await write_index_to_pinned(bot, index.root):
+        if old:
+            index.root["chain"] = old
+        return False
+    _chain = chain
+    if old and old.get("message_id"):
+        try:
+            await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=old["message_id"])
+        except Exception:
+            pass
+    return True
+
+
+async def take_snapshot(force_base: bool = False) -> Optional[Dict[str, Any]]:
+    """Upload a base or delta snapshot. Returns its manifest entry, or None if nothing to do."""
+    global _snapshot_lock
+    from utils.db import flush_users, async_db  # utils.db imports this module
+    from utils import user_store
+
+    if config.PRIVATE_DB_CHANNEL_ID == 0:
+        return None
+    if _snapshot_lock is None:
+        _snapshot_lock = asyncio.Lock()
+
+    async with _snapshot_lock:
+        # make sure the store has everything the cache knows
+        await flush_users()
+
+        bot = await _get_bot()
+        index = await _load_index(bot)
+        try:
+            chain = await _load_chain(bot, index)
+        except Exception as e:
+            print(f"[Backup] Snapshot skipped, chain manifest unreadable: {e}")
+            return None
+        deltas = sum(1 for s in chain if s["kind"] == "delta")
+        base = force_base or not chain or deltas >= SNAPSHOT_MAX_DELTAS
+
+        # users.updated_at has second resolution: overlap by re-reading the
+        # boundary second (replaying a user twice is harmless)
+        taken_at = int(time.time())
+        changed = None
+        if not base:
+            last = chain[-1]
+            changed = await async_db(user_store.list_updated_since, last.get("taken_at", last["created_at"]))
+            if not changed:
+                return None
+
+        seq = (chain[-1]["seq"] + 1) if chain else 1
+        kind = "base" if base else "delta"
+        os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+        path = os.path.join(SNAPSHOT_FOLDER, f"snapshot_{seq}_{kind}.jsonl.gz")
+        try:
+            count, digest = await user_store.run_export(user_store.export_jsonl_gz, path, changed)
+            with open(path, "rb") as f:
+                msg = await bot.send_document(
+                    chat_id=config.PRIVATE_DB_CHANNEL_ID,
+                    document=f,
+                    filename=os.path.basename(path),
+                    caption=f"{kind.capitalize()} snapshot #{seq}: {count} users at {int(time.time())}",
+                    disable_notification=True
+                )
+        except Exception as e:
+            print(f"[Backup] Snapshot #{seq} failed: {e}")
+            return None
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        entry = {
+            "seq": seq,
+            "kind": kind,
+            "message_id": msg.message_id,
+            "file_id": msg.document.file_id,
+            "users": count,
+            "sha256": digest[:32],
+            "taken_at": taken_at,
+            "created_at": int(time.time()),
+        }
+        new_chain = [entry] if base else chain + [entry]
+        try:
+            saved = await _save_chain(bot, index, new_chain)
+        except Exception as e:
+            print(f"[Backup] Snapshot #{seq} manifest upload failed: {e}")
+            saved = False
+        if not saved:
+            # the previous manifest stays authoritative; the next run retries
+            try:
+                await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=msg.message_id)
+            except Exception:
+                pass
+            return None
+
+        # the new base supersedes the previous chain
+        for old in (chain if base else []):
+            try:
+                await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=old["message_id"])
+            except Exception:
+                pass
+        print(f"[Backup] {kind} snapshot #{seq} uploaded ({count} users)")
+        return entry
+
+
+async def snapshot_job(context) -> None:
+    """Job queue callback for snapshot mode."""
+    await take_snapshot()
+
+
+async def _download_snapshot(bot: Bot, entry: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    tfile = await bot.get_file(entry["file_id"])
+    raw = bytes(await tfile.download_as_bytearray())
+    if entry.get("sha256") and not hashlib.sha256(raw).hexdigest().startswith(entry["sha256"]):
+        raise ValueError(f"snapshot #{entry['seq']} checksum mismatch")
+    users = {}
+    for line in gzip.decompress(raw).splitlines():
+        if line.strip():
+            data = json.loads(line)
+            users[int(data["user_id"])] = data
+    return users
+
+
+# ---------------- RESTORE ----------------
+# Documents are downloaded by a bounded pool of workers, verified against the
+# content hash in the index and written to the user store in batches (one
+# transaction per batch). Restored ids are recorded in RESTORE_STATE_FILE so
+# an interrupted restore continues where it stopped.
+
+RESTORE_WORKERS = getattr(config, "RESTORE_WORKERS", 8)
+RESTORE_BATCH = 200
+RESTORE_STATE_FILE = os.path.join(config.DATA_FOLDER, "restore_done.log")  # one restored id per line
+PROGRESS_EVERY = 2.0  # seconds
+
+
+def _load_restore_state() -> set:
+    done = set()
+    try:
+        with open(RESTORE_STATE_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip().isdigit():  # a torn last line is ignored
+                    done.add(int(line))
+    except OSError:
+        pass
+    return done
+
+
+def _append_restore_state(user_ids) -> None:
+    """Append one committed batch to the done-log (no rewrite of earlier batches)."""
+    with open(RESTORE_STATE_FILE, "a", encoding="utf-8") as f:
+        f.write("".join(f"{uid}\n" for uid in user_ids))
+
+
+async def _resolve_file_id(bot: Bot, info: Dict[str, Any]) -> Optional[str]:
+    """file_id of a backup document. Entries from the old index only know the message id."""
+    if info.get("file_id"):
+        return info["file_id"]
+    msg_id = info.get("file_message_id")
+    if not msg_id:
+        return None
+    # forward the message inside the channel to read its document, then drop the copy
+    fwd = await bot.forward_message(
+        chat_id=config.PRIVATE_DB_CHANNEL_ID,
+        from_chat_id=config.PRIVATE_DB_CHANNEL_ID,
+        message_id=int(msg_id),
+        disable_notification=True
+    )
+    try:
+        return fwd.document.file_id if fwd.document else None
+    finally:
+        try:
+            await bot.delete_message(chat_id=config.PRIVATE_DB_CHANNEL_ID, message_id=fwd.message_id)
+        except Exception:
+            pass
+
+
+async def _download_user(bot: Bot, info: Dict[str, Any]) -> Dict[str, Any]:
+    file_id = await _resolve_file_id(bot, info)
+    if not file_id:
+        raise ValueError("no_file_id")
+    tfile = await bot.get_file(file_id)
+    raw = await tfile.download_as_bytearray()
+    data = json.loads(bytes(raw).decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("not a user record")
+    if info.get("hash") and content_hash(data) != info["hash"]:
+        raise ValueError("checksum mismatch")
+    return data
+
+
+def format_restore_progress(stats: Dict[str, Any]) -> str:
+    rate = stats["restored"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return (
+        f"🔄 Restore {'complete' if stats.get('finished') else 'in progress'}\n"
+        f"• Restored: {stats['restored']}/{stats['total']}\n"
+        f"• Skipped (already restored): {stats['skipped']}\n"
+        f"• Failed: {stats['failed']}\n"
+        f"• Throughput: {rate:.1f} users/s"
+    )
+
+
+async def restore_all_from_index(on_progress=None, fresh: bool = False) -> Dict[str, str]:
     """
-    Downloads all files referenced in pinned index into local DB folder.
-    Returns dict {user_id: 'ok'/'error:...'}.
+    Replays the snapshot chain, then downloads the per-user backups
+    referenced in the index into the user store.
+    Resumes an interrupted per-user restore unless fresh=True.
+    Returns dict {user_id: 'ok'/'ok (local)'/'skipped'/'error:...'}.
     """
-    results = {}
+    from utils.db import replace_users  # utils.db imports this module
+    import backup_system  # local tier, imports this module
+
+    results: Dict[str, str] = {}
     if config.PRIVATE_DB_CHANNEL_ID == 0:
         return results
 
     bot = await _get_bot()
-    index = await read_index_from_pinned(bot)
-    os.makedirs(config.DATA_FOLDER, exist_ok=True)
+    index = await _load_index(bot)
+    started = time.monotonic()
 
-    for str_uid, info in index.items():
-        try:
-            file_msg_id = info.get("file_message_id")
-            if not file_msg_id:
-                results[str_uid] = "no_file_message"
-                continue
-            # simplified manual restore
-            results[str_uid] = "manual restore needed"
-        except Exception as e:
-            results[str_uid] = f"error: {e}"
+    # 1️⃣ Snapshot chain: base + deltas, later snapshots win
+    chain = await _load_chain(bot, index)
+    chain_users: Dict[int, Dict[str, Any]] = {}
+    for entry in chain:
+        chain_users.update(await _download_snapshot(bot, entry))
+    uids = list(chain_users)
+    for i in range(0, len(uids), RESTORE_BATCH):
+        await replace_users({uid: chain_users[uid] for uid in uids[i:i + RESTORE_BATCH]})
+    for uid in uids:
+        results[str(uid)] = "ok"
+    chain_time = chain[-1]["created_at"] if chain else 0
 
-    # Second block for actual file download if file_id exists
-    for str_uid, info in index.items():
-        try:
-            file_id = info.get("file_id")
-            if not file_id:
-                results[str_uid] = "no_file_id"
+    # 2️⃣ Per-user backups newer than the last snapshot
+    entries = [
+        (str_uid, info) for str_uid, info in await index.items(bot)
+        if (info.get("uploaded_at") or 0) > chain_time
+    ]
+    if fresh and os.path.exists(RESTORE_STATE_FILE):
+        os.remove(RESTORE_STATE_FILE)
+    done = _load_restore_state()
+
+    stats = {"total": len(entries) + len(uids), "restored": len(uids), "skipped": 0, "failed": 0, "elapsed": 0.0}
+    queue: asyncio.Queue = asyncio.Queue()
+    for str_uid, info in entries:
+        if int(str_uid) in done:
+            results[str_uid] = "skipped"
+            stats["skipped"] += 1
+        else:
+            queue.put_nowait((str_uid, info))
+
+    batch: Dict[int, Dict[str, Any]] = {}
+    sources: Dict[int, str] = {}  # result of each downloaded user, once committed
+    write_lock = asyncio.Lock()
+
+    async def _commit():
+        async with write_lock:
+            if not batch:
+                return
+            users = dict(batch)
+            try:
+                await replace_users(users)
+            except Exception as e:
+                # users stay in the batch for the next commit; until then all of them failed
+                print(f"[Backup] Restore commit of {len(users)} users failed: {e}")
+                for uid in users:
+                    if not results.get(str(uid), "").startswith("error"):
+                        stats["failed"] += 1
+                    results[str(uid)] = f"error: {e}"
+                return
+            for uid in users:
+                del batch[uid]
+                if results.get(str(uid), "").startswith("error"):
+                    stats["failed"] -= 1
+                results[str(uid)] = sources.pop(uid)
+            stats["restored"] += len(users)
+            done.update(users)
+            _append_restore_state(users)
+
+    async def _worker():
+        while True:
+            try:
+                str_uid, info = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                local = await asyncio.to_thread(backup_system.read_user_backup, int(str_uid))
+                if local is not None and info.get("hash") and content_hash(local) == info["hash"]:
+                    data = local  # same version as the channel copy, skip the download
+                else:
+                    try:
+                        data = await _download_user(bot, info)
+                    except Exception:
+                        if local is None:
+                            raise
+                        data = local  # channel copy unreadable: latest local version
+                data["user_id"] = int(str_uid)
+                sources[int(str_uid)] = "ok" if data is not local else "ok (local)"
+                batch[int(str_uid)] = data
+            except Exception as e:
+                results[str_uid] = f"error: {e}"
+                stats["failed"] += 1
                 continue
-            tfile = await bot.get_file(file_id)
-            local_path = f"{config.DATA_FOLDER}/{str_uid}.json"
-            await tfile.download_to_drive(custom_path=local_path)
-            results[str_uid] = "ok"
-        except Exception as e:
-            results[str_uid] = f"error: {e}"
+            if len(batch) >= RESTORE_BATCH:
+                await _commit()
+
+    workers = [asyncio.create_task(_worker()) for _ in range(RESTORE_WORKERS)]
+    while not all(w.done() for w in workers):
+        await asyncio.wait(workers, timeout=PROGRESS_EVERY)
+        stats["elapsed"] = time.monotonic() - started
+        if on_progress:
+            await on_progress(stats)
+    for w in workers:
+        w.result()  # surface unexpected worker errors
+    await _commit()
 
+    stats["elapsed"] = time.monotonic() - started
+    stats["finished"] = True
+    if stats["failed"] == 0 and os.path.exists(RESTORE_STATE_FILE):
+        os.remove(RESTORE_STATE_FILE)
+    print("[Backup] " + format_restore_progress(stats).replace("\n", " "))
+    if on_progress:
+        await on_progress(stats)
     return results
@@ -0,0 +1,268 @@
+# utils/broadcast.py
+"""
+Rate-limited, resumable broadcast engine.
+
+A producer pages user ids (ascending) into a bounded queue, a pool of send
+workers drains it. Every send takes a token from a global token bucket
+(Telegram allows ~30 msg/s per bot) and respects a per-chat minimum
+interval. RetryAfter pauses the whole bucket. Progress (a cursor below which
+every user was handled, plus the counters) is saved to disk so an
+interrupted broadcast can be resumed with /broadcast resume.
+"""
+import os
+import json
+import time
+import asyncio
+from datetime import timedelta
+from typing import Any, Dict, Optional, Set
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+import config
+from utils.db import count_users_after, list_user_ids_after
+
+STATE_FILE = os.path.join(config.DATA_FOLDER, "broadcast_state.json")
+
+GLOBAL_RATE = getattr(config, "BROADCAST_RATE", 25)        # messages per second
+WORKERS = getattr(config, "BROADCAST_WORKERS", 8)
+PER_CHAT_INTERVAL = 1.0                                      # seconds between messages to one chat
+MAX_ATTEMPTS = 3
+PROGRESS_EVERY = 3.0                                         # seconds between status edits / state saves
+PAGE_SIZE = 1000                                             # user ids read per query
+
+
+class TokenBucket:
+    """Async token bucket. pause() blocks all acquirers until the given time."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ------------------ STATE ------------------
+def load_state() -> Optional[Dict[str, Any]]:
+    if not os.path.exists(STATE_FILE):
+        return None
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _save_state(state: Dict[str, Any]) -> None:
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, STATE_FILE)
+
+
+def _retry_seconds(e: RetryAfter) -> float:
+    value = e.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+# ------------------ ENGINE ------------------
+class Broadcast:
+    def __init__(self, bot: Bot, state: Dict[str, Any]):
+        self.bot = bot
+        self.state = state
+        self.bucket = TokenBucket(GLOBAL_RATE)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WORKERS * 4)
+        self._outstanding: Set[int] = set()
+        self._last_sent: Dict[int, float] = {}
+        self._last_enqueued = state.get("cursor", 0)
+        self.cancelled = False
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return self.state["counts"]
+
+    def _cursor(self) -> int:
+        """Highest user id such that every id up to it has been handled."""
+        if self._outstanding:
+            return min(self._outstanding) - 1
+        return self._last_enqueued
+
+    async def _send(self, chat_id: int) -> str:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            wait = self._last_sent.get(chat_id, 0) + PER_CHAT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.bucket.acquire()
+            self._last_sent[chat_id] = time.monotonic()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=self.state["text"])
+                return "delivered"
+            except RetryAfter as e:
+                self.bucket.pause(_retry_seconds(e))
+            except Forbidden:
+                return "blocked"
+            except BadRequest:
+                return "failed"
+            except (TimedOut, NetworkError):
+                await asyncio.sleep(attempt)
+            except Exception as e:
+                print(f"[Broadcast] send to {chat_id} failed: {e}")
+                return "failed"
+        return "failed"
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self.queue.get()
+            try:
+                if chat_id is None:
+                    return
+                result = await self._send(chat_id)
+                self.counts[result] += 1
+                self._outstanding.discard(chat_id)
+            finally:
+                self.queue.task_done()
+
+    async def _producer(self) -> None:
+        cursor = self.state.get("cursor", 0)
+        self.state["total"] = self.state.get("done", 0) + await count_users_after(cursor)
+        while not self.cancelled:
+            page = await list_user_ids_after(cursor, PAGE_SIZE)
+            if not page:
+                break
+            for uid in page:
+                if self.cancelled:
+                    break
+                self._outstanding.add(uid)
+                self._last_enqueued = uid
+                await self.queue.put(uid)
+            cursor = page[-1]
+        for _ in range(WORKERS):
+            await self.queue.put(None)
+
+    def _prune_last_sent(self) -> None:
+        """Forget chats whose per-chat interval has passed (most chats get one message)."""
+        cutoff = time.monotonic() - PER_CHAT_INTERVAL
+        for chat_id in [c for c, ts in self._last_sent.items() if ts <= cutoff]:
+            del self._last_sent[chat_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        self.state["cursor"] = self._cursor()
+        self.state["done"] = sum(self.counts.values())
+        return self.state
+
+    async def run(self, on_progress=None) -> Dict[str, Any]:
+        workers = [asyncio.create_task(self._worker()) for _ in range(WORKERS)]
+        producer = asyncio.create_task(self._producer())
+        started = time.monotonic()
+        try:
+            while not all(w.done() for w in workers):
+                await asyncio.wait(workers + [producer], timeout=PROGRESS_EVERY,
+                                   return_when=asyncio.FIRST_EXCEPTION)
+                if producer.done() and producer.exception():
+                    # workers would wait forever for their sentinels
+                    raise producer.exception()
+                _save_state(self.snapshot())
+                self._prune_last_sent()
+                if on_progress:
+                    await on_progress(self.state, time.monotonic() - started)
+        except Exception:
+            self.state["status"] = "failed"
+            _save_state(self.snapshot())
+            raise
+        finally:
+            producer.cancel()
+            for w in workers:
+                w.cancel()
+        self.state["status"] = "cancelled" if self.cancelled else "finished"
+        _save_state(self.snapshot())
+        return self.state
+
+
+_current: Optional[Broadcast] = None
+
+
+def is_running() -> bool:
+    return _current is not None
+
+
+def cancel() -> bool:
+    if _current is None:
+        return False
+    _current.cancelled = True
+    return True
+
+
+def new_state(text: str, admin_chat_id: int) -> Dict[str, Any]:
+    return {
+        "text": text,
+        "admin_chat_id": admin_chat_id,
+        "started_at": int(time.time()),
+        "status": "running",
+        "cursor": 0,
+        "done": 0,
+        "total": 0,
+        "counts": {"delivered": 0, "blocked": 0, "failed": 0},
+    }
+
+
+async def run_broadcast(bot: Bot, state: Dict[str, Any], on_progress=None) -> Dict[str, Any]:
+    """Run (or resume) a broadcast described by `state`. Only one runs at a time."""
+    global _current
+    if _current is not None:
+        raise RuntimeError("A broadcast is already running")
+    state["status"] = "running"
+    _current = Broadcast(bot, state)
+    try:
+        return await _current.run(on_progress)
+    finally:
+        _current = None
+
+
+async def notify_interrupted(bot: Bot) -> bool:
+    """After a restart, tell the admin who started an unfinished broadcast how to resume it."""
+    state = load_state()
+    if not state or state.get("status") != "running" or not state.get("admin_chat_id"):
+        return False
+    try:
+        await bot.send_message(
+            chat_id=state["admin_chat_id"],
+            text=format_progress({**state, "status": "interrupted"}) + "\nUse /broadcast resume to continue."
+        )
+    except Exception as e:
+        print(f"[Broadcast] Could not notify admin about the interrupted broadcast: {e}")
+        return False
+    return True
+
+
+def format_progress(state: Dict[str, Any], elapsed: Optional[float] = None) -> str:
+    c = state["counts"]
+    text = (
+        f"📣 Broadcast {state.get('status', 'running')}\n"
+        f"• Progress: {state.get('done', 0)}/{state.get('total', 0)}\n"
+        f"• Delivered: {c['delivered']}\n"
+        f"• Blocked: {c['blocked']}\n"
+        f"• Failed: {c['failed']}"
+    )
+    if elapsed:
+        text += f"\n• Rate: {state.get('done', 0) / elapsed:.1f} msg/s"
+    return text
@@ -1,92 +1,168 @@
 # utils/checks.py
+"""
+Access pipeline for gated requests.
 
+A request loads the user once (under the user's lock), runs the checks below
+as pure functions over that profile, and commits everything they want to
+change - the hourly free-plan refill, the usage increment of the request
+itself - as one write at the end. Check order:
+
+    force join -> sponsor -> plan expiry -> free-plan refill -> quota
+
+Paid plans are downgraded by the expiry scheduler (utils/plan_expiry.py);
+here an expired plan is a dict lookup and is treated as free.
+
+The pure functions take the profile plus a `patch` dict and never do I/O;
+`patch` maps top-level user fields to the sub-fields to update (or to a new
+value for scalar fields). Daily counters reset implicitly (utils/quota.py),
+so a new day costs no write.
+"""
 import datetime
+from typing import Dict, Optional, Tuple
+
+import config
 from handlers.force_join import is_member, prompt_join
 from utils.db import get_user, save_user
-from plan_system import PLANS
+from utils.locks import user_lock
+from utils import quota, plan_expiry
+from utils.plans import Plan, get_plan
 
+FREE_REFILL = 3  # credits per hour on the free plan, up to its cap
 
-# --- update function signature ---
-async def check_plan(user: dict, mode: str = "video"):
-    """Check user plan limits and expiry."""
-    plan_data = user.get("plan", {})
-
-    # 🔧 Handle plan_data correctly (string, dict, or invalid)
-    if isinstance(plan_data, str):
-        plan_name = plan_data
-        user["plan"] = {"name": plan_name}   # keep DB consistent
-    elif isinstance(plan_data, dict):
-        plan_name = plan_data.get("name", "free")
-    else:
-        plan_name = "free"
-
-    # ✅ Always force plan_name to string
-    plan_name = str(plan_name)
-    plan = PLANS.get(plan_name.lower(), PLANS["free"])
-    
-    # Ensure start_date exists
-    plan_start = user.get("plan", {}).get("start_date")
-    if not plan_start:
-        user.setdefault("plan", {})["start_date"] = datetime.datetime.utcnow().isoformat()
-        await save_user(user.get("user_id"), user)
-        plan_start = user["plan"]["start_date"]
-
-    # Check expiry
-    expiry_days = plan.get("expiry_days")
-    if expiry_days:
-        plan_start_date = datetime.datetime.fromisoformat(plan_start)
-        if datetime.datetime.utcnow() > plan_start_date + datetime.timedelta(days=expiry_days):
-            return False, f"⚠️ Your {plan_name} plan has expired. Upgrade to continue using the bot."
-
-    # Reset daily counters if needed
-    today = datetime.date.today()
-    last_reset = user.get("usage", {}).get("last_watch_reset")
-    if last_reset != str(today):
-        user.setdefault("usage", {})["videos_watched_today"] = 0
-        user["usage"]["downloads_per_day"] = 0
-        user["usage"]["last_watch_reset"] = str(today)
-        await save_user(user.get("user_id"), user)
-
-    # ✅ Only check what the mode requires
+# daily usage counter incremented by a successful request, per mode
+USAGE_COUNTERS = {
+    "video": "videos",
+    "download": "downloads",
+}
+
+
+# ------------------ PURE CHECKS ------------------
+
+def check_sponsor(profile: dict) -> Optional[str]:
+    if not profile.get("sponsor_verified", False):
+        return "sponsor"
+    return None
+
+
+def check_refill(profile: dict, plan: Plan, now_ts: int, patch: dict) -> int:
+    """Credits after the hourly free-plan refill; queues the refill in `patch`."""
+    credits = profile.get("credits", 0)
+    if plan.key != "free" or plan.credits is None:
+        return credits
+    last_at = profile.get("last_refill_at", 0)
+    credits, new_last_at = quota.refill(credits, plan.credits, FREE_REFILL, last_at, now_ts)
+    if new_last_at != last_at:
+        patch["credits"] = credits
+        patch["last_refill_at"] = new_last_at
+    return credits
+
+
+def check_quota(plan: Plan, usage: dict, day: int, credits: int, mode: str) -> Optional[str]:
     if mode == "video":
-        videos_per_day = plan.get("videos_per_day", -1)
-        videos_watched = user.get("usage", {}).get("videos_watched_today", 0)
-        if videos_per_day != -1 and videos_watched >= videos_per_day:
-            return False, f"⚠️ Your {plan_name} plan allows only {videos_per_day} videos per day. Wait until tomorrow or upgrade your plan."
+        limit = plan.videos_per_day
+        if limit is not None and quota.used(usage, "videos", day) >= limit:
+            return f"⚠️ Your {plan.title} plan allows only {limit} videos per day. Wait until tomorrow or upgrade your plan."
 
     if mode == "download":
-        downloads_limit = plan.get("downloads_per_day", -1)
-        downloads_done = user.get("usage", {}).get("downloads_per_day", 0)
-        if downloads_limit != -1 and downloads_done >= downloads_limit:
-            return False, f"⚠️ Your {plan_name} plan allows only {downloads_limit} downloads per day. Wait until tomorrow or upgrade your plan."
+        limit = plan.downloads_per_day
+        if limit is not None and quota.used(usage, "downloads", day) >= limit:
+            return f"⚠️ Your {plan.title} plan allows only {limit} downloads per day. Wait until tomorrow or upgrade your plan."
+
+    if plan.credits is not None and credits >= plan.credits:
+        return f"⚠️ Your {plan.title} plan allows max {plan.credits} credits. Upgrade your plan to earn more."
+    return None
+
+
+def evaluate_access(profile: dict, mode: str = "video", consume: Optional[str] = None,
+                    sponsor: bool = True, now: Optional[datetime.datetime] = None
+                    ) -> Tuple[bool, Optional[str], Dict[str, dict]]:
+    """
+    Run all checks over `profile` without touching it.
+    Returns (ok, message, patch); message is "sponsor" for the sponsor gate.
+    On success the `consume` usage counter is incremented in the patch.
+    """
+    now = now or datetime.datetime.utcnow()
+    now_ts = int(now.replace(tzinfo=datetime.timezone.utc).timestamp())
+    patch: Dict[str, dict] = {}
+
+    if sponsor and check_sponsor(profile):
+        return False, "sponsor", patch
+
+    # canonical plan dict (utils/plans.normalize_plan runs when a user is loaded)
+    if plan_expiry.is_active(profile.get("user_id") or 0, now_ts):
+        plan = get_plan(profile["plan"]["name"])
+    else:
+        plan = get_plan("free")  # expired; the expiry job downgrades the record
+
+    credits = check_refill(profile, plan, now_ts, patch)
+    usage = profile.get("usage") or {}
+    day = quota.today(now_ts)
+    msg = check_quota(plan, usage, day, credits, mode)
+    if msg:
+        return False, msg, patch
 
-    # Check credits
-    credits_limit = plan.get("credits", -1)
-    if credits_limit != -1 and user.get("credits", 0) >= credits_limit:
-        return False, f"⚠️ Your {plan_name} plan allows max {credits_limit} credits. Upgrade your plan to earn more."
+    if consume:
+        patch["usage"] = {consume: quota.bumped(usage, consume, day)}
+    return True, None, patch
 
-    return True, None
 
-async def ensure_access(update, context, mode="video"):
-    """Ensure user has completed force join, sponsor verification, and plan limits."""
-    user = update.effective_user
-    user_id = user.id
+def apply_patch(profile: dict, patch: Dict[str, dict]) -> None:
+    for field, values in patch.items():
+        if not isinstance(values, dict):
+            profile[field] = values
+            continue
+        if not isinstance(profile.get(field), dict):
+            profile[field] = {}
+        profile[field].update(values)
 
-    # 1️⃣ Force Join
+
+# ------------------ COMMIT ------------------
+
+async def check_access(user_id: int, mode: str = "video", consume: Optional[str] = None,
+                       sponsor: bool = True) -> Tuple[bool, Optional[str]]:
+    """One load, pure checks, at most one write. Returns (ok, message)."""
+    async with user_lock(user_id):
+        profile = await get_user(user_id)
+        ok, msg, patch = evaluate_access(profile, mode, consume, sponsor)
+        if patch:
+            apply_patch(profile, patch)
+            await save_user(user_id, profile)
+    return ok, msg
+
+
+async def check_plan(user: dict, mode: str = "video"):
+    """Plan expiry and limits for `user`; kept for callers that already hold a profile."""
+    return await check_access(user.get("user_id"), mode, sponsor=False)
+
+
+async def ask_sponsor_verification(update, context):
+    bot = config.SPONSOR_BOT_USERNAME or "our sponsor bot"
+    await update.effective_message.reply_text(
+        f"🔐 One more step: open {bot}, send /getcode and then send the code here with /verify <code>."
+    )
+
+
+async def ensure_access(update, context, mode="video", consume: Optional[str] = None):
+    """
+    Ensure user has completed force join, sponsor verification, and plan limits.
+    With `consume` (a usage counter, see USAGE_COUNTERS) the request is also
+    counted, in the same write as the checks.
+    """
+    user_id = update.effective_user.id
+
+    # 1️⃣ Force Join (cached, see handlers/force_join.py)
     if not await is_member(context, user_id):
         await prompt_join(update, context)
         return False
 
-    # 2️⃣ Sponsor Verification
-    profile = await get_user(user_id)
-    if not profile.get("sponsor_verified", False):
+    # 2️⃣ Sponsor Verification + 3️⃣ Plan validation
+    ok, msg = await check_access(user_id, mode, consume)
+    if ok:
+        return True
+    if msg == "sponsor":
         await ask_sponsor_verification(update, context)
-        return False
-
-    # 3️⃣ Plan validation
-    ok, msg = await check_plan(profile, mode=mode)  # ✅ pass mode
-    if not ok:
-        await update.message.reply_text(msg)
-        return False
-
-    return True
+    elif update.callback_query:
+        await update.callback_query.answer(msg, show_alert=True)
+    else:
+        await update.effective_message.reply_text(msg)
+    return False
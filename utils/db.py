@@ -2,14 +2,24 @@
 import os
 import time
 import json
+import re
 import aiofiles
-import asyncio
 import tempfile
-import functools
+import copy
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional, List
 import config
-from . import backup  # backup.update_user_backup
-import sqlite3
+from . import backup  # backup.enqueue_user_backup
+from . import user_store
+from . import activity
+from . import quota
+from . import plan_expiry
+from .plans import normalize_plan
+from .sqlite_pool import get_db
+from .locks import user_lock
+from .warm_start import WarmSnapshot, load_snapshot, write_snapshot
+import backup_system  # local backup tier
 
 # Ensure main data folder exists
 os.makedirs(config.DATA_FOLDER, exist_ok=True)
@@ -19,10 +29,8 @@ DEFAULT_USER: Dict[str, Any] = {
     "user_id": None,
     "username": None,
     "credits": 0,
-    "plan": {"name": "Free", "expires_at": None},
-    "videos_per_day": 0,
-    "downloads_per_day": 0,
-    "usage": {"videos_watched_today": 0, "last_watch_reset": None},
+    "plan": {"name": "free", "expires_at": None},  # canonical, see utils/plans.py
+    "usage": {},  # counter -> [epoch_day, count], see utils/quota.py
     "referrals": {"invited_by": None, "total": 0, "successful": 0, "pending": []},
     "ref_link": None,
     "badges": [],
@@ -40,50 +48,63 @@ DEFAULT_USER: Dict[str, Any] = {
     }
 }
 
-def _path_for(user_id: int) -> str:
-    """Return local JSON path for a user"""
-    return os.path.join(config.DATA_FOLDER, f"{user_id}.json")
-
-
-async def get_user(user_id: int, username: Optional[str] = None) -> Dict[str, Any]:
-    """Load user data asynchronously. Create new user if not exists."""
+def _normalize_user_id(user_id) -> int:
     # normalize to int to avoid fragmented files like "123" vs 123
     try:
-        user_id = int(user_id)
+        return int(user_id)
     except Exception:
         raise ValueError("user_id must be an integer-compatible value")
 
-    path = _path_for(user_id)
 
-    if not os.path.exists(path):
-        data = dict(DEFAULT_USER)
-        data["user_id"] = user_id
-        data["username"] = username
-        await save_user(user_id, data)
-        return data
+def _new_user(user_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    """Fresh user record built from DEFAULT_USER (deep copy, nested lists are not shared)."""
+    data = copy.deepcopy(DEFAULT_USER)
+    data["user_id"] = user_id
+    data["username"] = username
+    _backfill_user(data)
+    return data
 
-    async with aiofiles.open(path, "r", encoding="utf-8") as f:
-        try:
-            raw = await f.read()
-            data = json.loads(raw) if raw else dict(DEFAULT_USER)
-        except Exception:
-            data = dict(DEFAULT_USER)
-            data["user_id"] = user_id
-            data["username"] = username
+
+def _backfill_user(data: Dict[str, Any], username: Optional[str] = None) -> bool:
+    """Ensure new fields exist for old users. Returns True if anything changed."""
+    changed = False
 
     # Ensure new fields exist for old users
     if "videos" not in data:
         data["videos"] = {"fetched": [], "watched": [], "tags": {}}
+        changed = True
 
     # Backfill commonly-missing fields to avoid KeyError
     if "tasks_completed" not in data:
         data["tasks_completed"] = []
+        changed = True
     if "tasks_opened" not in data:
         data["tasks_opened"] = {}
+        changed = True
     if "credits" not in data:
         data["credits"] = 0
+        changed = True
     if "usage" not in data:
-        data["usage"] = {"videos_watched_today": 0, "last_watch_reset": None}
+        data["usage"] = {}
+        changed = True
+    elif "last_watch_reset" in data["usage"]:
+        # old format: counters + "YYYY-MM-DD" of the last reset -> [epoch_day, count]
+        old = data["usage"]
+        day = quota.day_from_iso(old.get("last_watch_reset"))
+        data["usage"] = {}
+        if day is not None:
+            data["usage"]["videos"] = [day, old.get("videos_watched_today", 0)]
+            data["usage"]["downloads"] = [day, old.get("downloads_per_day", 0)]
+        changed = True
+    if normalize_plan(data):
+        changed = True
+    if "last_refill" in data:
+        try:
+            data["last_refill_at"] = int(time.mktime(time.strptime(data["last_refill"], "%Y-%m-%d %H:%M:%S")))
+        except (TypeError, ValueError):
+            data["last_refill_at"] = 0
+        del data["last_refill"]
+        changed = True
     referrals_val = data.get("referrals", {})
     if isinstance(referrals_val, list):
         # older format used a list for pending referrals — normalize to dict
@@ -94,93 +115,327 @@ async def get_user(user_id: int, username: Optional[str] = None) -> Dict[str, An
             "total": 0,
             "successful": 0
         }
+        changed = True
     elif not referrals_val:
         data["referrals"] = {"invited_by": None, "total": 0, "successful": 0, "pending": []}
+        changed = True
 
-    if username:
+    if username and data.get("username") != username:
         data["username"] = username
+        changed = True
+    return changed
 
-    # Persist backfilled structure but avoid redundant backup on read
-    await save_user(user_id, data, backup_sync=False)
-    return data
 
+# ---------------- USER CACHE ----------------
+# Bounded LRU of loaded user dicts in front of utils/user_store. get_user hands
+# out the cached dict and save_user only marks it dirty; flush_users() writes
+# dirty entries to the store (called periodically from main and on shutdown).
 
+USER_CACHE_SIZE = getattr(config, "USER_CACHE_SIZE", 5000)
 
-async def save_user(user_id: int, data: Dict[str, Any], backup_sync: bool = True) -> None:
+_user_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_dirty_users: Dict[int, bool] = {}  # user_id -> backup to Telegram requested
+_flushing: Dict[int, int] = {}  # user_id -> flushes in flight (taken out of _dirty_users, not committed yet)
+
+
+def _cache_put(user_id: int, data: Dict[str, Any]) -> None:
+    _user_cache[user_id] = data
+    _user_cache.move_to_end(user_id)
+    _evict_clean_users()
+
+
+def _evict_clean_users() -> None:
+    """Drop least recently used entries that have nothing left to flush."""
+    if len(_user_cache) <= USER_CACHE_SIZE:
+        return
+    for uid in list(_user_cache.keys()):
+        if len(_user_cache) <= USER_CACHE_SIZE:
+            break
+        if uid not in _dirty_users and uid not in _flushing:
+            del _user_cache[uid]
+            _completed_sets.pop(uid, None)
+
+
+def _mark_dirty(user_id: int, backup_sync: bool = True) -> None:
+    _dirty_users[user_id] = _dirty_users.get(user_id, False) or backup_sync
+
+
+def apply_heartbeat(user_id: int, ts: int) -> bool:
     """
-    Save user locally and optionally sync to backup channel.
-    Atomic write to prevent file corruption.
+    A heartbeat for a user that has no row in the store yet. A dirty cached
+    user takes it into its dict (written by the next flush_users). Returns True
+    if the caller should retry it later because the row is being written now.
     """
-    # normalize id
+    data = _user_cache.get(user_id)
+    if data is not None and user_id in _dirty_users:
+        data["last_active"] = max(int(data.get("last_active") or 0), ts)
+        return False
+    return user_id in _flushing
+
+
+# ---------------- WARM START ----------------
+# Optional memory-mapped snapshot of all users (WARM_START=1). Cache misses are
+# served from it unless the user was written to the store after the snapshot
+# was taken; write_warm_snapshot() refreshes the file for the next start.
+
+WARM_SNAPSHOT_FILE = os.path.join(config.DATA_FOLDER, "users.snap")
+
+_warm: Optional[WarmSnapshot] = None
+
+
+def load_warm_start() -> int:
+    """Map the warm-start snapshot (call once at startup, after init_db). Returns users mapped."""
+    global _warm
+    _warm = load_snapshot(WARM_SNAPSHOT_FILE, user_store.list_updated_since)
+    return _warm.count if _warm else 0
+
+
+def _write_warm_snapshot_sync() -> int:
+    taken_at = int(time.time())
+    return write_snapshot(WARM_SNAPSHOT_FILE, user_store.iter_user_blobs(), taken_at)
+
+
+async def write_warm_snapshot() -> int:
+    """Flush dirty users and rewrite the snapshot on the export connection. Returns users written."""
+    await flush_users()
+    started = time.perf_counter()
+    count = await user_store.run_export(_write_warm_snapshot_sync)
+    print(f"[WarmStart] Wrote {count} users in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return count
+
+
+def warm_start_stats() -> Dict[str, int]:
+    if _warm is None:
+        return {}
+    size = _warm.footprint()
+    return {"users": _warm.count, "stale": len(_warm.stale), "hits": _warm.hits, "misses": _warm.misses,
+            "mapped_kb": size["mapped"] // 1024, "index_kb": size["index"] // 1024, "stale_kb": size["stale"] // 1024}
+
+
+async def load_stored_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Read a user from the store, bypassing the cache. None if not stored."""
+    return await async_db(user_store.load_user, user_id)
+
+
+async def set_stored_field(user_id: int, field: str, value: Any, username: Optional[str] = None) -> None:
+    """
+    Write one field straight to the user store, bypassing the cache. For
+    fields shared across processes (user_store.EXTERNAL_FIELDS): a cached
+    whole-record flush would otherwise overwrite the other process's copy.
+    """
+    user_id = _normalize_user_id(user_id)
+    if await async_db(user_store.set_field, user_id, field, value):
+        return
+    await async_db(user_store.insert_if_missing, user_store.to_row(user_id, _new_user(user_id, username)))
+    await async_db(user_store.set_field, user_id, field, value)
+
+
+def _schedule_backup(user_id: int, data: Dict[str, Any]) -> None:
+    """Queue a flushed user for the backup channel (coalesced by utils/backup)."""
+    if getattr(config, "PRIVATE_DB_CHANNEL_ID", 0) == 0:
+        return
     try:
-        user_id = int(user_id)
-    except Exception:
-        raise ValueError("user_id must be an integer-compatible value")
+        # ✅ pass `data` to let backup.py check for changes
+        backup.enqueue_user_backup(user_id, data)
+    except Exception as e:
+        print(f"[DB Backup] Failed to schedule backup for user {user_id}: {e}")
+
 
-    path = _path_for(user_id)
+async def get_user(user_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    """Load user data asynchronously. Create new user if not exists.
+
+    Served from the in-process cache when possible; the returned dict is the
+    cached object, so call save_user after mutating it.
+    """
+    user_id = _normalize_user_id(user_id)
+
+    data = _user_cache.get(user_id)
+    if data is None:
+        loaded = _warm.get(user_id) if _warm else None
+        if loaded is None:
+            loaded = await load_stored_user(user_id)
+        # another coroutine may have loaded the same user while we were reading
+        data = _user_cache.get(user_id)
+        if data is None:
+            if loaded is None:
+                data = _new_user(user_id, username)
+                _mark_dirty(user_id)
+            else:
+                data = loaded
+                if _backfill_user(data, username):
+                    # Persist backfilled structure but avoid redundant backup on read
+                    _mark_dirty(user_id, backup_sync=False)
+            _cache_put(user_id, data)
+            return data
+
+    _user_cache.move_to_end(user_id)
+    if username and data.get("username") != username:
+        data["username"] = username
+        _mark_dirty(user_id, backup_sync=False)
+    return data
+
+
+async def save_user(user_id: int, data: Dict[str, Any], backup_sync: bool = True) -> None:
+    """
+    Save user to the cache and mark it dirty.
+    The write to the user store (and optional backup sync) happens in flush_users().
+    """
+    user_id = _normalize_user_id(user_id)
     data["user_id"] = user_id
+    _mark_dirty(user_id, backup_sync)
+    _cache_put(user_id, data)
+
+
+@asynccontextmanager
+async def user_txn(user_id: int, username: Optional[str] = None, backup_sync: bool = True):
+    """
+    Serialized read-modify-write of one user:
+
+        async with user_txn(user_id) as user:
+            user["credits"] += 5
 
-    # Atomic write to temp file first
-    tmp_fd, tmp_path = tempfile.mkstemp()
+    Holds the user's lock for the whole block and marks the user dirty when
+    the block completes. Other users are not blocked.
+    """
+    user_id = _normalize_user_id(user_id)
+    async with user_lock(user_id):
+        user = await get_user(user_id, username)
+        yield user
+        await save_user(user_id, user, backup_sync)
+
+
+async def flush_users() -> int:
+    """Write all dirty cached users to the store in one transaction. Returns number of users flushed."""
+    if not _dirty_users:
+        return 0
+
+    batch = dict(_dirty_users)
+    _dirty_users.clear()
+    # dicts of the batch, held here because the cache may evict them once committed
+    users = {user_id: _user_cache[user_id] for user_id in batch if user_id in _user_cache}
+    rows = [user_store.to_row(user_id, data) for user_id, data in users.items()]
+
+    # Until the write commits the store and the warm snapshot are both older
+    # than the cache: the batch must not be evicted (a reload would read the
+    # old copy) and must not be served from the snapshot.
+    for user_id in batch:
+        _flushing[user_id] = _flushing.get(user_id, 0) + 1
+    if _warm is not None:
+        _warm.stale.update(batch)
     try:
-        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
-            await f.write(json.dumps(data, ensure_ascii=False, indent=2))
-        os.replace(tmp_path, path)  # replace original file atomically
+        await async_db(user_store.save_rows, rows)
+    except Exception as e:
+        print(f"[DB] Failed to flush {len(rows)} users: {e}")
+        # re-queued before the finally below releases them, so they can't be evicted in between
+        for user_id, backup_sync in batch.items():
+            _mark_dirty(user_id, backup_sync)
+        return 0
     finally:
-        try:
-            os.close(tmp_fd)
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
+        for user_id in batch:
+            if _flushing[user_id] == 1:
+                del _flushing[user_id]
+            else:
+                _flushing[user_id] -= 1
+
+    # Local tier: only users whose content hash changed are appended to the pack
+    try:
+        await backup_system.backup_users_async(list(users.items()))
+    except Exception as e:
+        print(f"[DB Backup] Local backup failed: {e}")
+
+    for user_id, backup_sync in batch.items():
+        if backup_sync and user_id in users:
+            _schedule_backup(user_id, users[user_id])
+
+    _evict_clean_users()
+    return len(rows)
+
+
+async def replace_users(users: Dict[int, Dict[str, Any]]) -> None:
+    """Overwrite users in the store (one transaction) and drop their cached copies. Used by restore."""
+    rows = []
+    for user_id, data in users.items():
+        user_id = _normalize_user_id(user_id)
+        data["user_id"] = user_id
+        _backfill_user(data)
+        rows.append(user_store.to_row(user_id, data))
+    await async_db(user_store.save_rows, rows)
+    for user_id, data in users.items():
+        plan_expiry.schedule_user(user_id, data)
+    for user_id in users:
+        _completed_sets.pop(int(user_id), None)
+        if _warm is not None:
+            _warm.stale.add(int(user_id))
+        _user_cache.pop(int(user_id), None)
+        _dirty_users.pop(int(user_id), None)
+
+
+async def user_exists(user_id: int) -> bool:
+    user_id = _normalize_user_id(user_id)
+    if user_id in _user_cache:
+        return True
+    return await async_db(user_store.user_exists, user_id)
+
+
+async def count_users() -> int:
+    await flush_users()
+    return await async_db(user_store.count_users)
+
+
+async def list_user_ids() -> List[int]:
+    """All known user ids (dirty cached users are flushed first)."""
+    await flush_users()
+    return await async_db(user_store.list_user_ids)
+
+
+async def list_user_ids_after(after: int, limit: int = 1000) -> List[int]:
+    """One page of user ids above `after`, ascending."""
+    return await async_db(user_store.list_user_ids_after, after, limit)
+
+
+async def count_users_after(after: int) -> int:
+    await flush_users()
+    return await async_db(user_store.count_users_after, after)
+
 
-    # -------------------- Backup to Telegram channel --------------------
-    if backup_sync and getattr(config, "PRIVATE_DB_CHANNEL_ID", 0) != 0:
-        try:
-            async def _backup():
-                # ✅ pass `data` to let backup.py check for changes
-                await backup.update_user_backup(user_id, path, data)
-            asyncio.create_task(_backup())
-        except Exception as e:
-            print(f"[DB Backup] Failed to schedule backup for user {user_id}: {e}")
 async def set_invited_by(user_id: int, inviter_id: int) -> None:
     """Set who invited a user"""
-    user = await get_user(user_id)
-    if user["referrals"].get("invited_by") is None and inviter_id != user_id:
-        user["referrals"]["invited_by"] = inviter_id
-        await save_user(user_id, user)
+    async with user_lock(user_id):
+        user = await get_user(user_id)
+        if user["referrals"].get("invited_by") is None and inviter_id != user_id:
+            user["referrals"]["invited_by"] = inviter_id
+            await save_user(user_id, user)
 
 
 async def add_pending_referral(inviter_id: int, referred_user_id: int) -> None:
     """Add a pending referral to inviter"""
-    inviter = await get_user(inviter_id)
-    pending_set = set(inviter["referrals"].get("pending", []))
-    if referred_user_id != inviter_id and referred_user_id not in pending_set:
-        pending_set.add(referred_user_id)
-        inviter["referrals"]["pending"] = list(pending_set)
-        await save_user(inviter_id, inviter)
+    async with user_lock(inviter_id):
+        inviter = await get_user(inviter_id)
+        pending_set = set(inviter["referrals"].get("pending", []))
+        if referred_user_id != inviter_id and referred_user_id not in pending_set:
+            pending_set.add(referred_user_id)
+            inviter["referrals"]["pending"] = list(pending_set)
+            await save_user(inviter_id, inviter)
 
 
 async def update_last_active(user_id: int) -> None:
-    """Update last active timestamp"""
-    user = await get_user(user_id)
-    user["last_active"] = int(time.time())
-    await save_user(user_id, user)
+    """Update last active timestamp (in-memory heartbeat, flushed in batches)"""
+    activity.touch(user_id)
 
 
 async def add_active_message(user_id: int, message_id: int) -> None:
     """Track currently active messages"""
-    user = await get_user(user_id)
-    if message_id not in user["active_messages"]:
-        user["active_messages"].append(message_id)
-    await save_user(user_id, user)
+    async with user_txn(user_id) as user:
+        if message_id not in user["active_messages"]:
+            user["active_messages"].append(message_id)
+    activity.track_session(user_id)
 
 
 async def clear_active_messages(user_id: int) -> None:
     """Clear all active messages"""
-    user = await get_user(user_id)
-    user["active_messages"] = []
-    await save_user(user_id, user)
+    async with user_txn(user_id) as user:
+        user["active_messages"] = []
+    activity.untrack_session(user_id)
 
 
 
@@ -188,20 +443,18 @@ async def clear_active_messages(user_id: int) -> None:
 
 async def add_fetched_video(user_id: int, video_id: int, tags: Optional[List[str]] = None):
     """Add a fetched video with optional tags"""
-    user = await get_user(user_id)
-    if video_id not in user["videos"]["fetched"]:
-        user["videos"]["fetched"].append(video_id)
-    if tags:
-        user["videos"]["tags"][str(video_id)] = tags
-    await save_user(user_id, user)
+    async with user_txn(user_id) as user:
+        if video_id not in user["videos"]["fetched"]:
+            user["videos"]["fetched"].append(video_id)
+        if tags:
+            user["videos"]["tags"][str(video_id)] = tags
 
 
 async def mark_video_watched(user_id: int, video_id: str):
     """Mark video as watched"""
-    user = await get_user(user_id)
-    if video_id not in user["videos"]["watched"]:
-        user["videos"]["watched"].append(video_id)
-    await save_user(user_id, user)
+    async with user_txn(user_id) as user:
+        if video_id not in user["videos"]["watched"]:
+            user["videos"]["watched"].append(video_id)
 
 
 async def get_user_videos(user_id: int):
@@ -230,8 +483,30 @@ def _normalize_task(task: Dict[str, Any], index: int) -> Dict[str, Any]:
     }
 
 
-async def get_all_tasks() -> List[Dict[str, Any]]:
-    """Return all global tasks (safe, always valid)."""
+# In-memory catalog of tasks.json, reloaded when the file's mtime changes.
+# Tasks are addressed by their stable "id"; list positions are only used for
+# display and for legacy numeric callbacks.
+_task_catalog: Dict[str, Any] = {"mtime": None, "tasks": [], "by_id": {}, "version": 0}
+
+
+def _set_task_catalog(tasks: List[Dict[str, Any]], mtime) -> None:
+    _task_catalog["tasks"] = tasks
+    _task_catalog["by_id"] = {t["id"]: t for t in tasks}
+    _task_catalog["mtime"] = mtime
+    _task_catalog["version"] += 1
+
+
+def _tasks_mtime():
+    try:
+        return os.stat(TASKS_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+async def _load_task_catalog() -> Dict[str, Any]:
+    mtime = _tasks_mtime()
+    if mtime is not None and mtime == _task_catalog["mtime"]:
+        return _task_catalog
     try:
         async with aiofiles.open(TASKS_FILE, "r", encoding="utf-8") as f:
             raw = await f.read()
@@ -239,9 +514,54 @@ async def get_all_tasks() -> List[Dict[str, Any]]:
     except Exception:
         tasks = []
 
-    # Normalize tasks
+    missing_ids = any("id" not in t for t in tasks)
     tasks = [_normalize_task(t, i) for i, t in enumerate(tasks)]
-    return tasks
+    if missing_ids:
+        # pin the position-based ids once so later deletes don't shift them
+        await save_all_tasks(tasks)
+    else:
+        _set_task_catalog(tasks, mtime)
+    return _task_catalog
+
+
+def _highest_task_number(tasks: List[Dict[str, Any]]) -> int:
+    highest = -1
+    for t in tasks:
+        suffix = t["id"][len("task_"):] if t["id"].startswith("task_") else ""
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+async def _next_task_id(tasks: List[Dict[str, Any]]) -> str:
+    """Fresh task_<n> id. The high-water mark lives in bot.db, so ids of deleted tasks are never reused."""
+    return f"task_{await async_db(user_store.next_sequence, 'task_id_seq', _highest_task_number(tasks) + 1)}"
+
+
+async def get_all_tasks() -> List[Dict[str, Any]]:
+    """Return all global tasks (safe, always valid)."""
+    catalog = await _load_task_catalog()
+    return list(catalog["tasks"])
+
+
+async def get_task(task_id: str) -> Optional[Dict[str, Any]]:
+    """Task by stable id, or None."""
+    catalog = await _load_task_catalog()
+    return catalog["by_id"].get(str(task_id))
+
+
+async def resolve_task(ref: str) -> Optional[Dict[str, Any]]:
+    """Task from callback data: a task id, or a 1-based list position (old buttons)."""
+    catalog = await _load_task_catalog()
+    task = catalog["by_id"].get(ref)
+    if task is None and ref.isdigit() and 0 < int(ref) <= len(catalog["tasks"]):
+        task = catalog["tasks"][int(ref) - 1]
+    return task
+
+
+def task_catalog_version() -> int:
+    """Bumped whenever the task list changes (for render caches)."""
+    return _task_catalog["version"]
 
 
 async def save_all_tasks(tasks: List[Dict[str, Any]]):
@@ -249,7 +569,7 @@ async def save_all_tasks(tasks: List[Dict[str, Any]]):
     # Normalize before saving
     tasks = [_normalize_task(t, i) for i, t in enumerate(tasks)]
 
-    tmp_fd, tmp_path = tempfile.mkstemp()
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(TASKS_FILE))
     try:
         async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
             await f.write(json.dumps(tasks, ensure_ascii=False, indent=2))
@@ -261,11 +581,16 @@ async def save_all_tasks(tasks: List[Dict[str, Any]]):
                 os.remove(tmp_path)
         except Exception:
             pass
+    _set_task_catalog(tasks, _tasks_mtime())
+    await async_db(user_store.raise_sequence, "task_id_seq", _highest_task_number(tasks))
 
 
 async def add_task(task: Dict[str, Any]):
-    """Add a new global task"""
+    """Add a new global task (gets a fresh stable id unless it has one)"""
     tasks = await get_all_tasks()
+    task = dict(task)
+    if "id" not in task or any(t["id"] == str(task["id"]) for t in tasks):
+        task["id"] = await _next_task_id(tasks)
     tasks.append(task)
     await save_all_tasks(tasks)
 
@@ -278,18 +603,39 @@ async def delete_task(index: int):
         await save_all_tasks(tasks)
 
 
+# Completed-task sets per user, rebuilt only when the user's list changes
+_completed_sets: Dict[int, tuple] = {}  # user_id -> (list id, list len, set)
+
+
+def completed_tasks(user: Dict[str, Any]) -> set:
+    """Set view of user["tasks_completed"] for O(1) membership tests while rendering."""
+    done = user.get("tasks_completed") or []
+    user_id = user.get("user_id")
+    cached = _completed_sets.get(user_id)
+    if cached and cached[0] == id(done) and cached[1] == len(done):
+        return cached[2]
+    result = set(map(str, done))
+    if user_id is not None:
+        _completed_sets[user_id] = (id(done), len(done), result)
+    return result
+
+
 # 🆕 Track which tasks user opened (to enforce "open before done")
 async def mark_task_opened(user_id: int, task_id: str):
     """Mark that a user has opened a task link."""
-    user = await get_user(user_id)
-    if "tasks_opened" not in user or not isinstance(user["tasks_opened"], dict):
-        user["tasks_opened"] = {}
-    user["tasks_opened"][task_id] = int(time.time())  # store open timestamp
-    await save_user(user_id, user)
+    async with user_txn(user_id) as user:
+        if "tasks_opened" not in user or not isinstance(user["tasks_opened"], dict):
+            user["tasks_opened"] = {}
+        user["tasks_opened"][task_id] = int(time.time())  # store open timestamp
 
 
 async def mark_task_completed(user_id: int, task_id: str, reward: int = 0):
     """Mark task as completed and credit user if valid."""
+    async with user_lock(user_id):
+        return await _mark_task_completed(user_id, task_id, reward)
+
+
+async def _mark_task_completed(user_id: int, task_id: str, reward: int = 0):
     user = await get_user(user_id)
 
     # Ensure opened before completion
@@ -318,149 +664,164 @@ async def mark_task_completed(user_id: int, task_id: str, reward: int = 0):
 # db.py
 
 
-DB_NAME = "bot.db"
+DB_NAME = config.BOT_DB
+
+_bot_db = get_db(DB_NAME)
 
 # ------------------ DB INIT ------------------
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    # Users table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            credits INTEGER DEFAULT 0,
-            plan_name TEXT DEFAULT 'Free',
-            plan_expires_at INTEGER
-        )
-    """)
+    # Users table (+ one-shot import of the old db/<id>.json files)
+    user_store.init_user_store()
+    user_store.migrate_json_users(config.DATA_FOLDER)
 
-    # Video categories table
-    cur.execute("""
+    _bot_db.executescript("""
+        -- Video categories table
         CREATE TABLE IF NOT EXISTS video_categories (
             category TEXT PRIMARY KEY,
             videos TEXT
-        )
-    """)
-
-    # Redeem codes table
-    cur.execute("""
+        );
+
+        -- Category -> video number ranges (parsed from video_categories.videos)
+        CREATE TABLE IF NOT EXISTS category_ranges (
+            category TEXT NOT NULL,
+            first_vid INTEGER NOT NULL,
+            last_vid INTEGER NOT NULL,
+            PRIMARY KEY (category, first_vid)
+        );
+        CREATE INDEX IF NOT EXISTS idx_category_ranges_first ON category_ranges(first_vid, last_vid);
+
+        -- Redeem codes table
         CREATE TABLE IF NOT EXISTS redeem_codes (
             code TEXT PRIMARY KEY,
             credit_amount INTEGER,
             duration_hours INTEGER,
             used_by TEXT
-        )
+        );
     """)
-
-    conn.commit()
-    conn.close()
+    _bot_db.call(_backfill_category_ranges)
 
 # ------------------ ASYNC WRAPPER ------------------
 async def async_db(func, *args, **kwargs):
-    """Run blocking DB function in a separate thread"""
-    return await asyncio.to_thread(functools.partial(func, *args, **kwargs))
+    """Run blocking bot.db function on the bot.db executor thread"""
+    return await _bot_db.submit(func, *args, **kwargs)
 
 # ------------------ USER FUNCTIONS ------------------
-async def json_get_user(user_id: int) -> dict:
-    """Return user data as dictionary. Async safe."""
-    def _get_user_sync(user_id):
-        conn = sqlite3.connect(DB_NAME)
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, username, credits, plan_name, plan_expires_at FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return None
-        return {
-            "user_id": row[0],
-            "username": row[1],
-            "credits": row[2],
-            "plan": {"name": row[3], "expires_at": row[4]},
-            "referrals": {"pending": [], "completed": [], "invited_by": None, "total": 0, "successful": 0},
-            "badges": [],
-            "redeemed_codes": [],
-            "usage": {"videos_watched_today": 0, "last_watch_reset": None},
-            "sponsor_verified": False,
-            "last_active": 0,
-            "active_messages": [],
-            "tasks_completed": [],
-            "ref_link": None,
-            "videos": {"fetched": [], "watched": [], "tags": {}}
-        }
-    return await async_db(_get_user_sync, user_id)
+async def json_get_user(user_id: int) -> Optional[dict]:
+    """Return user data as dictionary, or None if the user does not exist. Async safe."""
+    if not await user_exists(user_id):
+        return None
+    return await get_user(user_id)
 
 async def json_save_user(user_id: int, username: str, credits=0, plan_name='Free', plan_expires_at=None):
-    def _save_user_sync(user_id, username, credits, plan_name, plan_expires_at):
-        conn = sqlite3.connect(DB_NAME)
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT OR REPLACE INTO users (user_id, username, credits, plan_name, plan_expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, username, credits, plan_name, plan_expires_at))
-        conn.commit()
-        conn.close()
-    await async_db(_save_user_sync, user_id, username, credits, plan_name, plan_expires_at)
+    """Update the summary fields of a user in the user store."""
+    user = await get_user(user_id)
+    user["username"] = username
+    user["credits"] = credits
+    user["plan"] = {"name": plan_name, "expires_at": plan_expires_at}
+    await save_user(user_id, user)
 
 # ------------------ VIDEO CATEGORY FUNCTIONS ------------------
-def get_all_categories():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT category, videos FROM video_categories")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def add_or_update_category(category, videos):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO video_categories (category, videos) VALUES (?, ?)", (category, str(videos)))
-    conn.commit()
-    conn.close()
-
-def delete_category(category):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM video_categories WHERE category=?", (category,))
-    conn.commit()
-    conn.close()
+def parse_video_ranges(videos) -> List[tuple]:
+    """
+    Parse "1-50,60-70" / "5" / [1, "3-9"] into merged, sorted (first, last) pairs.
+    Raises ValueError on anything else.
+    """
+    parts = videos if isinstance(videos, (list, tuple)) else re.split(r"[,\s]+", str(videos))
+    ranges = []
+    for part in parts:
+        part = str(part).strip()
+        if not part:
+            continue
+        m = re.fullmatch(r"(\d+)\s*-\s*(\d+)|(\d+)", part)
+        if not m:
+            raise ValueError(f"Invalid video range: {part!r}")
+        first, last = (int(m.group(1)), int(m.group(2))) if m.group(3) is None else (int(m.group(3)),) * 2
+        ranges.append((min(first, last), max(first, last)))
+    if not ranges:
+        raise ValueError("Empty video range")
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def _set_category_ranges(conn, category, ranges):
+    conn.execute("DELETE FROM category_ranges WHERE category=?", (category,))
+    conn.executemany(
+        "INSERT INTO category_ranges (category, first_vid, last_vid) VALUES (?, ?, ?)",
+        [(category, first, last) for first, last in ranges]
+    )
+
+def _backfill_category_ranges(conn):
+    """One-shot: parse categories stored before category_ranges existed."""
+    if conn.execute("SELECT 1 FROM category_ranges LIMIT 1").fetchone():
+        return
+    with conn:
+        for category, videos in conn.execute("SELECT category, videos FROM video_categories").fetchall():
+            try:
+                _set_category_ranges(conn, category, parse_video_ranges(videos))
+            except ValueError as e:
+                print(f"[DB] Category {category!r} has no usable range: {e}")
+
+async def get_all_categories():
+    return await _bot_db.afetchall("SELECT category, videos FROM video_categories")
+
+async def add_or_update_category(category, videos):
+    """Set a category's videos (e.g. "1-50,60-70"). Raises ValueError for an invalid range."""
+    ranges = parse_video_ranges(videos)
+    text = ",".join(f"{a}-{b}" if a != b else str(a) for a, b in ranges)
+
+    def _save(conn):
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO video_categories (category, videos) VALUES (?, ?)", (category, text))
+            _set_category_ranges(conn, category, ranges)
+    await _bot_db.run(_save)
+
+async def delete_category(category):
+    def _delete(conn):
+        with conn:
+            conn.execute("DELETE FROM video_categories WHERE category=?", (category,))
+            conn.execute("DELETE FROM category_ranges WHERE category=?", (category,))
+    await _bot_db.run(_delete)
+
+async def get_category_ranges(category) -> List[tuple]:
+    """[(first_vid, last_vid)] of a category, in order (primary-key scan)."""
+    return await _bot_db.afetchall(
+        "SELECT first_vid, last_vid FROM category_ranges WHERE category=? ORDER BY first_vid", (category,)
+    )
 
 # ------------------ REDEEM CODE FUNCTIONS ------------------
-def add_redeem_code(code, credit_amount, duration_hours):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("""
+async def add_redeem_code(code, credit_amount, duration_hours):
+    await _bot_db.aexecute("""
         INSERT OR REPLACE INTO redeem_codes (code, credit_amount, duration_hours, used_by)
         VALUES (?, ?, ?, '')
     """, (code.upper(), credit_amount, duration_hours))
-    conn.commit()
-    conn.close()
-
-def get_redeem_code(code):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT code, credit_amount, duration_hours, used_by FROM redeem_codes WHERE code=?", (code.upper(),))
-    row = cur.fetchone()
-    conn.close()
-    return row
-
-def mark_code_used(code, user_id):
-    row = get_redeem_code(code)
-    if not row:
-        return False
-    used_by = row[3].split(",") if row[3] else []
-    if str(user_id) in used_by:
-        return False
-    used_by.append(str(user_id))
-    used_by_str = ",".join(used_by)
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("UPDATE redeem_codes SET used_by=? WHERE code=?", (used_by_str, code.upper()))
-    conn.commit()
-    conn.close()
+
+async def get_redeem_code(code):
+    return await _bot_db.afetchone(
+        "SELECT code, credit_amount, duration_hours, used_by FROM redeem_codes WHERE code=?",
+        (code.upper(),)
+    )
+
+def _mark_code_used_sync(conn, code, user_id):
+    # read + update in one transaction so two users can't race on used_by
+    with conn:
+        row = conn.execute("SELECT used_by FROM redeem_codes WHERE code=?", (code,)).fetchone()
+        if not row:
+            return False
+        used_by = row[0].split(",") if row[0] else []
+        if str(user_id) in used_by:
+            return False
+        used_by.append(str(user_id))
+        conn.execute("UPDATE redeem_codes SET used_by=? WHERE code=?", (",".join(used_by), code))
     return True
 
+async def mark_code_used(code, user_id):
+    return await _bot_db.run(_mark_code_used_sync, code.upper(), user_id)
+
 # ------------------ BACKWARD COMPATIBILITY ------------------
 async def get_user_data(user_id: int):
     """Return user data in legacy dict format."""
@@ -487,10 +848,9 @@ async def get_user_data(user_id: int):
         "referrals": referrals,
         "badges": user.get("badges", []),
         "redeemed_codes": user.get("redeemed_codes", []),
-        "usage_today": user.get("usage", {}).get("videos_watched_today", 0),
-        "last_reset": user.get("usage", {}).get("last_watch_reset"),
+        "usage_today": quota.used(user.get("usage", {}), "videos", quota.today()),
         "sponsor_verified": user.get("sponsor_verified", False),
-        "last_active": user.get("last_active", 0),
+        "last_active": activity.get_last_active(user_id) or user.get("last_active", 0),
         "active_messages": user.get("active_messages", []),
         "ref_link": user.get("ref_link"),
         "tasks_completed": user.get("tasks_completed", []),
@@ -498,6 +858,11 @@ async def get_user_data(user_id: int):
 
 async def save_user_data(user_id: int, data: dict):
     """Save user data for legacy handlers."""
+    async with user_lock(user_id):
+        await _save_user_data(user_id, data)
+
+
+async def _save_user_data(user_id: int, data: dict):
     user = await get_user(user_id)
     if not user:
         return
@@ -514,12 +879,13 @@ async def save_user_data(user_id: int, data: dict):
     user["referrals"] = data.get("referrals", user.get("referrals", {}))
     user["badges"] = data.get("badges", user.get("badges", []))
     user["redeemed_codes"] = data.get("redeemed_codes", user.get("redeemed_codes", []))
-    user["usage"]["videos_watched_today"] = data.get("usage_today", user.get("usage", {}).get("videos_watched_today", 0))
-    user["usage"]["last_watch_reset"] = data.get("last_reset", user.get("usage", {}).get("last_watch_reset"))
+    if "usage_today" in data:
+        user["usage"]["videos"] = [quota.today(), data["usage_today"]]
     user["sponsor_verified"] = data.get("sponsor_verified", user.get("sponsor_verified", False))
     user["last_active"] = data.get("last_active", user.get("last_active", 0))
     user["active_messages"] = data.get("active_messages", user.get("active_messages", []))
     user["tasks_completed"] = data.get("tasks_completed", user.get("tasks_completed", []))
+    normalize_plan(user)
 
     # ✅ Fix: pass full dict to save_user
     await save_user(user_id, user)
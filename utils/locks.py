@@ -0,0 +1,56 @@
+# utils/locks.py
+"""
+Striped per-user asyncio locks.
+
+A fixed array of asyncio.Lock objects; every user id maps to one stripe, so
+updates of the same user are serialized while different users (almost always
+on different stripes) keep running in parallel. Nothing is allocated per user.
+
+Locks are re-entrant for the task that holds them, so helpers that take the
+lock can be called from code already holding it. Don't hold one user's lock
+while taking another user's: two stripes taken in opposite order can deadlock.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+LOCK_STRIPES = 1024
+
+
+class StripedLock:
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self._owners: List[Optional[asyncio.Task]] = [None] * stripes
+        self.contended = 0  # acquisitions that had to wait
+
+    def stripe(self, key: int) -> int:
+        return int(key) % len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: int):
+        idx = self.stripe(key)
+        task = asyncio.current_task()
+        if self._owners[idx] is task:
+            yield  # re-entrant
+            return
+        lock = self._locks[idx]
+        if lock.locked():
+            self.contended += 1
+        async with lock:
+            self._owners[idx] = task
+            try:
+                yield
+            finally:
+                self._owners[idx] = None
+
+
+_user_locks = StripedLock()
+
+
+def user_lock(user_id: int):
+    """`async with user_lock(user_id):` serializes all updates of one user."""
+    return _user_locks.hold(user_id)
+
+
+def contended_count() -> int:
+    return _user_locks.contended
@@ -0,0 +1,84 @@
+# utils/plan_expiry.py
+"""
+Plan-expiry schedule.
+
+Every expiring plan is kept in a min-heap of (expires_at, user_id) plus a
+dict user_id -> expires_at that is the source of truth; heap entries that no
+longer match the dict (plan extended, changed or already expired) are skipped
+when popped. The schedule is persistent through the users.plan_expires_at
+column: load() rebuilds it at startup from idx_users_plan_expires_at.
+
+Writers that set or extend a plan call schedule(); plan_system.expire_due_plans
+pops due entries and downgrades each user once. Request paths only need
+is_active(), a dict lookup.
+"""
+import time
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from . import user_store
+
+_heap: List[Tuple[int, int]] = []
+_expires: Dict[int, int] = {}
+
+
+def load() -> int:
+    """Rebuild the schedule from the user store. Returns number of expiring plans."""
+    global _heap
+    rows = user_store.list_plan_expiries()  # already in heap order
+    _heap = [(int(ts), int(uid)) for ts, uid in rows]
+    _expires.clear()
+    _expires.update((uid, ts) for ts, uid in _heap)
+    return len(_expires)
+
+
+def schedule(user_id: int, expires_at: Optional[int]) -> None:
+    """(Re)schedule a user's plan expiry; None clears it."""
+    user_id = int(user_id)
+    if expires_at is None:
+        _expires.pop(user_id, None)
+        return
+    expires_at = int(expires_at)
+    if _expires.get(user_id) == expires_at:
+        return
+    _expires[user_id] = expires_at
+    heapq.heappush(_heap, (expires_at, user_id))
+
+
+def schedule_user(user_id: int, data: dict) -> None:
+    """schedule() from a user dict, either plan format."""
+    schedule(user_id, user_store.plan_expiry_of(data))
+
+
+def expires_at(user_id: int) -> Optional[int]:
+    return _expires.get(int(user_id))
+
+
+def is_active(user_id: int, now: Optional[float] = None) -> bool:
+    """False once the user's plan expiry has passed (before or after the downgrade job runs)."""
+    ts = _expires.get(int(user_id))
+    return ts is None or ts > (now if now is not None else time.time())
+
+
+def pop_due(now: Optional[float] = None) -> List[Tuple[int, int]]:
+    """Remove and return [(user_id, expires_at)] whose plan expired by `now`."""
+    now = now if now is not None else time.time()
+    due = []
+    while _heap and _heap[0][0] <= now:
+        ts, user_id = heapq.heappop(_heap)
+        if _expires.get(user_id) == ts:  # otherwise stale: rescheduled or cleared
+            del _expires[user_id]
+            due.append((user_id, ts))
+    # drop the dead weight left by reschedules
+    if len(_heap) > 2 * len(_expires) + 1024:
+        _heap[:] = [(ts, uid) for uid, ts in _expires.items()]
+        heapq.heapify(_heap)
+    return due
+
+
+def stats() -> Dict[str, Optional[int]]:
+    return {
+        "scheduled": len(_expires),
+        "heap": len(_heap),
+        "next": _heap[0][0] if _heap else None,
+    }
@@ -0,0 +1,155 @@
+# utils/plans.py
+"""
+Compiled plan registry.
+
+Plans are read from data/plans.json (falling back to DEFAULT_PLANS) and
+compiled into immutable Plan objects with their limits precomputed: None
+means unlimited, so callers never test -1 sentinels. The file is re-read
+when its mtime changes (checked at most every RELOAD_CHECK seconds), so
+pricing tiers can change without a restart.
+
+User records carry a canonical plan: {"name": <plan key>, "expires_at":
+<unix seconds or None>, ...}; normalize_plan() converts the older formats
+(bare string, "Free"/"Premium" display names, top-level plan_expiry).
+"""
+import os
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+PLANS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "plans.json")
+RELOAD_CHECK = 2.0  # seconds between mtime checks
+
+# Built-in table, used when data/plans.json is missing or invalid (-1 = unlimited)
+DEFAULT_PLANS = {
+    "free": {"credits": 3, "videos_per_day": 10, "downloads_per_day": 0, "expiry_days": None},
+    "daily": {"credits": 35, "videos_per_day": -1, "downloads_per_day": -1, "expiry_days": 1},
+    "monthly": {"credits": 860, "videos_per_day": -1, "downloads_per_day": -1, "expiry_days": 28},
+    "premium": {"credits": -1, "videos_per_day": -1, "downloads_per_day": -1, "expiry_days": 40},
+    "elite": {"credits": -1, "videos_per_day": -1, "downloads_per_day": 10, "expiry_days": 45},
+    "superior": {"credits": -1, "videos_per_day": -1, "downloads_per_day": 25, "expiry_days": 60},
+}
+
+
+def _limit(value) -> Optional[int]:
+    if value is None:
+        return None
+    value = int(value)
+    return None if value < 0 else value
+
+
+class Plan:
+    """One compiled plan. Limits are ints, or None for unlimited."""
+    __slots__ = ("key", "title", "credits", "videos_per_day", "downloads_per_day",
+                 "expiry_days", "expiry_seconds")
+
+    def __init__(self, key: str, spec: Dict[str, Any]):
+        set_ = object.__setattr__
+        set_(self, "key", key)
+        set_(self, "title", str(spec.get("title") or key.capitalize()))
+        set_(self, "credits", _limit(spec.get("credits", -1)))
+        set_(self, "videos_per_day", _limit(spec.get("videos_per_day", -1)))
+        set_(self, "downloads_per_day", _limit(spec.get("downloads_per_day", -1)))
+        set_(self, "expiry_days", spec.get("expiry_days") or None)
+        set_(self, "expiry_seconds", int(self.expiry_days * 86400) if self.expiry_days else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Plan is immutable; edit data/plans.json instead")
+
+    def __repr__(self):
+        return f"Plan({self.key!r})"
+
+
+# ------------------ REGISTRY ------------------
+_registry: Dict[str, Any] = {"plans": {}, "mtime": None, "checked": 0.0}
+
+
+def _compile(specs: Dict[str, Dict[str, Any]]) -> Dict[str, Plan]:
+    plans = {str(k).lower(): Plan(str(k).lower(), v) for k, v in specs.items()}
+    if "free" not in plans:
+        plans["free"] = Plan("free", DEFAULT_PLANS["free"])
+    return plans
+
+
+def _plans_mtime():
+    try:
+        return os.stat(PLANS_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def reload_plans(force: bool = False) -> Dict[str, Plan]:
+    """Recompile the registry if data/plans.json changed. Returns the plans."""
+    mtime = _plans_mtime()
+    if not force and _registry["plans"] and mtime == _registry["mtime"]:
+        return _registry["plans"]
+    specs = DEFAULT_PLANS
+    if mtime is not None:
+        try:
+            with open(PLANS_FILE, "r", encoding="utf-8") as f:
+                specs = json.load(f)
+        except Exception as e:
+            print(f"[Plans] ⚠️ Could not read {PLANS_FILE}: {e}")
+            if _registry["plans"]:
+                return _registry["plans"]  # keep the last good table
+    try:
+        _registry["plans"] = _compile(specs)
+    except Exception as e:
+        print(f"[Plans] ⚠️ Invalid plan table: {e}")
+        if not _registry["plans"]:
+            _registry["plans"] = _compile(DEFAULT_PLANS)
+    _registry["mtime"] = mtime
+    return _registry["plans"]
+
+
+def all_plans() -> Dict[str, Plan]:
+    now = time.monotonic()
+    if now - _registry["checked"] >= RELOAD_CHECK or not _registry["plans"]:
+        _registry["checked"] = now
+        reload_plans()
+    return _registry["plans"]
+
+
+def get_plan(key: Optional[str]) -> Plan:
+    """Plan by key (case-insensitive); unknown keys get the free plan."""
+    plans = all_plans()
+    return plans.get(str(key or "free").lower()) or plans["free"]
+
+
+def is_plan(key: str) -> bool:
+    return str(key).lower() in all_plans()
+
+
+# ------------------ USER RECORDS ------------------
+
+def normalize_plan(data: Dict[str, Any]) -> bool:
+    """Give `data` a canonical plan dict. Returns True if anything changed."""
+    plan = data.get("plan")
+    if isinstance(plan, dict):
+        name = plan.get("name") or "free"
+        expires_at = plan.get("expires_at")
+    else:
+        name = plan if isinstance(plan, str) and plan else "free"
+        expires_at = data.get("plan_expiry")
+
+    if isinstance(expires_at, str):
+        try:
+            expires_at = int(expires_at) if expires_at.isdigit() else \
+                int(datetime.strptime(expires_at, "%Y-%m-%d %H:%M:%S").timestamp())
+        except ValueError:
+            expires_at = None
+    elif expires_at is not None:
+        try:
+            expires_at = int(expires_at)
+        except (TypeError, ValueError):
+            expires_at = None
+
+    canonical = dict(plan) if isinstance(plan, dict) else {}
+    canonical["name"] = str(name).lower()
+    canonical["expires_at"] = expires_at
+    changed = canonical != plan or "plan_expiry" in data
+    if changed:
+        data["plan"] = canonical
+        data.pop("plan_expiry", None)
+    return changed
@@ -0,0 +1,54 @@
+# utils/quota.py
+"""
+Daily counters and hourly refills without date strings.
+
+A daily counter is stored on the user record as a [epoch_day, count] pair
+(epoch_day = UTC days since 1970). A pair from an earlier day simply reads as
+0, so a new day never needs a reset write; the next increment starts the pair
+over. Refills are computed from an integer timestamp of the last refill.
+"""
+import time
+import datetime
+from typing import Optional, Tuple
+
+DAY = 86400
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def today(now: Optional[float] = None) -> int:
+    return int(now if now is not None else time.time()) // DAY
+
+
+def used(usage: dict, counter: str, day: int) -> int:
+    """Today's count of `counter` in a user's usage dict."""
+    pair = usage.get(counter)
+    if pair and pair[0] == day:
+        return pair[1]
+    return 0
+
+
+def bumped(usage: dict, counter: str, day: int, n: int = 1) -> list:
+    """The stored pair after counting `n` more uses today (usage is not modified)."""
+    return [day, used(usage, counter, day) + n]
+
+
+def refill(credits: int, cap: int, amount: int, last_at: int, now: int, period: int = 3600) -> Tuple[int, int]:
+    """
+    Credits after adding `amount` per whole `period` since `last_at`, capped.
+    Returns (credits, new last_at); last_at advances by whole periods so
+    partial periods are not lost.
+    """
+    periods = (now - last_at) // period
+    if periods <= 0:
+        return credits, last_at
+    if credits < cap:
+        credits = min(credits + amount * periods, cap)
+    return credits, last_at + periods * period
+
+
+def day_from_iso(value: Optional[str]) -> Optional[int]:
+    """Epoch day of a legacy "YYYY-MM-DD" reset date."""
+    try:
+        return datetime.date.fromisoformat(value).toordinal() - _EPOCH_ORDINAL
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,97 @@
+# utils/render.py
+"""
+Render cache for inline keyboards.
+
+Keyboards that depend on a user only through "which items are done" are
+built from a per-version template of prebuilt button rows plus a bitmask of
+the user's completed items, and memoized by (version, bitmask). PTB 20
+keyboard objects are immutable, so cached markups are shared safely.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+MAX_CACHED_MARKUPS = 512
+
+
+class MarkupCache:
+    """Small LRU of rendered markups; clear() when the source data changes."""
+
+    def __init__(self, size: int = MAX_CACHED_MARKUPS):
+        self.size = size
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._items[key] = build()
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+# ---------------- TASKS ----------------
+_task_template: Dict[str, Any] = {"version": None, "rows": []}  # rows[i] = (open row, completed row)
+_task_markups = MarkupCache()
+
+
+def _build_task_template(version: int, tasks: List[Dict[str, Any]]) -> None:
+    rows = []
+    for task in tasks:
+        open_row = (
+            InlineKeyboardButton(f"🔗 {task['title']}", callback_data=f"open_{task['id']}"),
+            InlineKeyboardButton(f"✅ Done (+{task['reward']} credits)", callback_data=f"task_done_{task['id']}"),
+        )
+        done_row = (InlineKeyboardButton(f"✅ {task['title']} (Completed)", callback_data="done"),)
+        rows.append((open_row, done_row))
+    _task_template["version"] = version
+    _task_template["rows"] = rows
+    _task_markups.clear()
+
+
+def task_keyboard(version: int, tasks: List[Dict[str, Any]], completed: set) -> InlineKeyboardMarkup:
+    """Task list keyboard for a user; `completed` is a set of task ids."""
+    if _task_template["version"] != version:
+        _build_task_template(version, tasks)
+    mask = 0
+    for bit, task in enumerate(tasks):
+        if task["id"] in completed:
+            mask |= 1 << bit
+
+    def build():
+        rows = _task_template["rows"]
+        return InlineKeyboardMarkup([
+            rows[i][1] if mask >> i & 1 else rows[i][0] for i in range(len(rows))
+        ])
+    return _task_markups.get((version, mask), build)
+
+
+# ---------------- GIVEAWAYS ----------------
+_giveaway_version = 0
+_giveaway_renders = MarkupCache()
+
+
+def giveaways_changed() -> None:
+    """Call after editing the giveaway list."""
+    global _giveaway_version
+    _giveaway_version += 1
+    _giveaway_renders.clear()
+
+
+def giveaway_view(joined_mask: int, ended_mask: int,
+                  render: Callable[[int, int], Tuple[str, Any]]) -> Tuple[str, Any]:
+    """(text, markup) memoized by (version, joined bitmap, ended bitmap)."""
+    return _giveaway_renders.get(
+        (_giveaway_version, joined_mask, ended_mask),
+        lambda: render(joined_mask, ended_mask),
+    )
@@ -0,0 +1,153 @@
+# utils/sqlite_pool.py
+"""
+Shared SQLite connections.
+
+One persistent connection per database file (bot.db, videos.db), opened in
+WAL mode with tuned pragmas and a statement cache. Blocking work runs on a
+dedicated single-thread executor per database so handlers never stall the
+event loop; sync callers (startup code, sync helpers) use the same
+connection under a lock. Long read-only scans (exports) get a second
+connection with its own thread from get_reader(), so they run beside the
+main connection under WAL instead of queueing every read and write.
+"""
+import os
+import asyncio
+import sqlite3
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache
+    "PRAGMA mmap_size=134217728",    # 128 MB
+    "PRAGMA busy_timeout=5000",
+)
+
+STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+
+
+class SQLiteDB:
+    """A single persistent connection plus the executor thread that owns it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f"sqlite-{os.path.basename(path)}"
+        )
+
+    # ------------------ CONNECTION ------------------
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.shutdown(wait=True)
+
+    # ------------------ SYNC API ------------------
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(conn, *args) holding the connection lock."""
+        with self._lock:
+            return fn(self.conn, *args, **kwargs)
+
+    def fetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, tuple(params)).fetchone()
+
+    def fetchall(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, tuple(params)).fetchall()
+
+    def execute(self, sql: str, params: Iterable = ()) -> int:
+        """Execute a write statement in its own transaction. Returns rowcount."""
+        with self._lock:
+            conn = self.conn
+            with conn:
+                return conn.execute(sql, tuple(params)).rowcount
+
+    def executemany(self, sql: str, rows: Iterable[Iterable]) -> int:
+        """Execute a write statement for many rows in a single transaction."""
+        with self._lock:
+            conn = self.conn
+            with conn:
+                return conn.executemany(sql, rows).rowcount
+
+    def executescript(self, script: str) -> None:
+        with self._lock:
+            conn = self.conn
+            conn.executescript(script)
+            conn.commit()
+
+    # ------------------ ASYNC API ------------------
+    async def submit(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable on this database's executor thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Async variant of call()."""
+        return await self.submit(self.call, fn, *args, **kwargs)
+
+    async def afetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        return await self.submit(self.fetchone, sql, params)
+
+    async def afetchall(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        return await self.submit(self.fetchall, sql, params)
+
+    async def aexecute(self, sql: str, params: Iterable = ()) -> int:
+        return await self.submit(self.execute, sql, params)
+
+    async def aexecutemany(self, sql: str, rows: Iterable[Iterable]) -> int:
+        return await self.submit(self.executemany, sql, list(rows))
+
+
+_databases: Dict[str, SQLiteDB] = {}
+_registry_lock = threading.Lock()
+
+
+def get_db(path: str) -> SQLiteDB:
+    """Return the shared SQLiteDB for a database file."""
+    key = os.path.abspath(path)
+    with _registry_lock:
+        db = _databases.get(key)
+        if db is None:
+            db = _databases[key] = SQLiteDB(path)
+        return db
+
+
+def get_reader(path: str) -> SQLiteDB:
+    """Return the shared read-only scan connection for a database file."""
+    key = os.path.abspath(path) + "#reader"
+    with _registry_lock:
+        db = _databases.get(key)
+        if db is None:
+            db = _databases[key] = SQLiteDB(path)
+        return db
+
+
+def close_all() -> None:
+    """Close every shared connection (call on shutdown)."""
+    with _registry_lock:
+        dbs = list(_databases.values())
+        _databases.clear()
+    for db in dbs:
+        db.close()
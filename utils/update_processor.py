@@ -0,0 +1,114 @@
+# utils/update_processor.py
+"""
+Concurrent update processing with per-user ordering.
+
+Passed to Application.builder().concurrent_updates(...). At most
+`max_concurrent_updates` handlers run at once; updates from the same user
+(or chat, for channel posts) still run one at a time and in arrival order, so
+a slow handler only delays that user instead of everybody.
+
+Queue depth and wait time (arrival -> handler start) are tracked for the
+metrics log line and /stats.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+WAIT_SAMPLES = 2000  # recent wait times kept for percentiles
+MAX_PENDING = 4096   # updates admitted at once (running + waiting for their user)
+
+
+def _ordering_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    The base class's semaphore (process_update is final) only caps admitted
+    updates at MAX_PENDING. do_process_update first waits for the previous
+    update of the same key and only then takes one of `max_concurrent_updates`
+    run slots, so a burst from one user waits without holding slots every
+    other chat needs.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: int = MAX_PENDING):
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._tails: Dict[int, asyncio.Event] = {}  # key -> set when its last update is done
+        self._waits: deque = deque(maxlen=WAIT_SAMPLES)
+        self.queued = 0       # arrived, not started yet
+        self.running = 0
+        self.max_queued = 0
+        self.processed = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        arrived = time.monotonic()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        started = False
+
+        key = _ordering_key(update)
+        prev = done = None
+        if key is not None:
+            prev = self._tails.get(key)
+            done = self._tails[key] = asyncio.Event()
+        try:
+            if prev is not None:
+                await prev.wait()
+            async with self._slots:
+                started = True
+                self.queued -= 1
+                self.running += 1
+                self._waits.append(time.monotonic() - arrived)
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+        finally:
+            if not started:  # cancelled while queued
+                self.queued -= 1
+                coroutine.close()
+            if done is not None:
+                done.set()
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self._waits)
+        def pct(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] * 1000 if waits else 0.0
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "processed": self.processed,
+            "wait_p50_ms": pct(0.50),
+            "wait_p99_ms": pct(0.99),
+        }
+
+
+def format_stats(stats: Dict[str, float]) -> str:
+    return (
+        f"⚙️ Updates: {stats['running']}/{stats['limit']} running, {stats['queued']} queued "
+        f"(max {stats['max_queued']}), {stats['processed']} done, "
+        f"wait p50 {stats['wait_p50_ms']:.0f} ms / p99 {stats['wait_p99_ms']:.0f} ms"
+    )
@@ -0,0 +1,423 @@
+# utils/user_store.py
+"""
+SQLite-backed user store (the `users` table in bot.db).
+
+Queryable fields live in their own columns, the full record is kept as a
+JSON blob in `data`. All functions here are blocking; utils/db.py runs them
+on the bot.db executor thread and keeps its write-back cache in front of them.
+Full exports (export_jsonl_gz, iter_user_blobs) read through a separate
+connection and are run with run_export().
+"""
+import os
+import json
+import gzip
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+import config
+from .sqlite_pool import get_db, get_reader
+
+DB_NAME = config.BOT_DB
+_db = get_db(DB_NAME)
+_reader = get_reader(DB_NAME)  # full-table exports, off the main connection's thread
+
+# Columns extracted from the user dict on every save
+USER_COLUMNS = {
+    "username": "TEXT",
+    "credits": "INTEGER DEFAULT 0",
+    "plan_name": "TEXT DEFAULT 'Free'",
+    "plan_expires_at": "INTEGER",
+    "last_active": "INTEGER DEFAULT 0",
+    "sponsor_verified": "INTEGER DEFAULT 0",
+    "invited_by": "INTEGER",
+    "data": "TEXT",
+    "updated_at": "INTEGER",
+}
+
+# ------------------ SCHEMA ------------------
+def init_user_store() -> None:
+    """Create the users table, or add the new columns to an old one."""
+    def _init(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                credits INTEGER DEFAULT 0,
+                plan_name TEXT DEFAULT 'Free',
+                plan_expires_at INTEGER
+            )
+        """)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        for name, decl in USER_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {name} {decl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_plan_expires_at ON users(plan_expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_invited_by ON users(invited_by)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        conn.commit()
+    _db.call(_init)
+
+
+# ------------------ ROW CONVERSION ------------------
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _plan_columns(data: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """Return (plan_name, plan_expires_at) for both plan formats in use."""
+    plan = data.get("plan")
+    if isinstance(plan, dict):
+        name = plan.get("name") or "Free"
+        expires_at = plan.get("expires_at")
+    else:
+        name = plan or "Free"
+        expires_at = data.get("plan_expiry")
+
+    if isinstance(expires_at, str) and not expires_at.isdigit():
+        try:
+            expires_at = int(datetime.strptime(expires_at, "%Y-%m-%d %H:%M:%S").timestamp())
+        except ValueError:
+            expires_at = None
+    return str(name), _to_int(expires_at)
+
+
+def plan_expiry_of(data: Dict[str, Any]) -> Optional[int]:
+    """Plan expiry (unix seconds) of a user dict, None if the plan does not expire."""
+    return _plan_columns(data)[1]
+
+
+def to_row(user_id: int, data: Dict[str, Any]) -> tuple:
+    """Serialize a user dict into a row for save_rows().
+
+    Call this on the event loop thread so the dict is not mutated while it is
+    being serialized.
+    """
+    plan_name, plan_expires_at = _plan_columns(data)
+    referrals = data.get("referrals")
+    invited_by = referrals.get("invited_by") if isinstance(referrals, dict) else None
+    return (
+        user_id,
+        data.get("username"),
+        _to_int(data.get("credits")) or 0,
+        plan_name,
+        plan_expires_at,
+        _to_int(data.get("last_active")) or 0,
+        1 if data.get("sponsor_verified") else 0,
+        _to_int(invited_by),
+        json.dumps(data, ensure_ascii=False),
+    )
+
+
+def _from_row(row) -> Dict[str, Any]:
+    user_id, username, credits, plan_name, plan_expires_at, last_active, blob = row
+    if blob:
+        try:
+            data = json.loads(blob)
+            # heartbeats update the column only (see save_last_active)
+            data["last_active"] = max(_to_int(data.get("last_active")) or 0, last_active or 0)
+            return data
+        except Exception:
+            pass
+    # rows written by the old json_save_user have no blob
+    return {
+        "user_id": user_id,
+        "username": username,
+        "credits": credits or 0,
+        "plan": {"name": plan_name or "Free", "expires_at": plan_expires_at},
+        "last_active": last_active or 0,
+    }
+
+
+# ------------------ READ / WRITE ------------------
+def load_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Return the stored user dict, or None if the user does not exist."""
+    row = _db.fetchone(
+        "SELECT user_id, username, credits, plan_name, plan_expires_at, last_active, data FROM users WHERE user_id=?",
+        (user_id,)
+    )
+    return _from_row(row) if row else None
+
+
+# Fields owned by another process (the sponsor bot writes sponsor_code).
+# They are only written with set_field(); whole-record upserts from a
+# process's user cache keep the stored value instead of their cached copy.
+EXTERNAL_FIELDS = ("sponsor_code",)
+
+
+def _keep_external(expr: str) -> str:
+    for field in EXTERNAL_FIELDS:
+        path = f"'$.{field}'"
+        expr = (f"CASE WHEN json_type(users.data, {path}) IS NULL THEN json_remove({expr}, {path}) "
+                f"ELSE json_set({expr}, {path}, json_extract(users.data, {path})) END")
+    return expr
+
+
+def save_rows(rows: List[tuple]) -> None:
+    """Upsert rows produced by to_row() in a single transaction."""
+    if not rows:
+        return
+    _db.executemany(f"""
+        INSERT INTO users (user_id, username, credits, plan_name, plan_expires_at,
+                           last_active, sponsor_verified, invited_by, data, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(user_id) DO UPDATE SET
+            username=excluded.username,
+            credits=excluded.credits,
+            plan_name=excluded.plan_name,
+            plan_expires_at=excluded.plan_expires_at,
+            last_active=MAX(COALESCE(users.last_active, 0), excluded.last_active),
+            sponsor_verified=excluded.sponsor_verified,
+            invited_by=excluded.invited_by,
+            data={_keep_external("excluded.data")},
+            updated_at=excluded.updated_at
+    """, rows)
+
+
+def set_field(user_id: int, field: str, value: Any) -> bool:
+    """Set one top-level field in the stored JSON blob. False if the user has no stored record."""
+    return _db.execute(
+        "UPDATE users SET data=json_set(data, ?, json(?)), "
+        "updated_at=CAST(strftime('%s', 'now') AS INTEGER) WHERE user_id=? AND data IS NOT NULL",
+        (f"$.{field}", json.dumps(value), user_id)
+    ) > 0
+
+
+def insert_if_missing(row: tuple) -> None:
+    """Insert a to_row() row unless the user already exists."""
+    _db.execute("""
+        INSERT INTO users (user_id, username, credits, plan_name, plan_expires_at,
+                           last_active, sponsor_verified, invited_by, data, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(user_id) DO NOTHING
+    """, row)
+
+
+def save_last_active(heartbeats: List[Tuple[int, int]]) -> List[int]:
+    """
+    Batch-update last_active for [(user_id, ts), ...] without touching the JSON
+    blob. updated_at is left alone: it marks blob writes (snapshot deltas, warm
+    start staleness), and a heartbeat doesn't change the blob.
+    Returns the user ids that have no row yet (nothing was updated for them).
+    """
+    if not heartbeats:
+        return []
+
+    def _save(conn):
+        missing = []
+        with conn:
+            for user_id, ts in heartbeats:
+                cur = conn.execute(
+                    "UPDATE users SET last_active=MAX(COALESCE(last_active, 0), ?) WHERE user_id=?", (ts, user_id)
+                )
+                if cur.rowcount == 0:
+                    missing.append(user_id)
+        return missing
+    return _db.call(_save)
+
+
+def get_last_active(user_id: int) -> Optional[int]:
+    row = _db.fetchone("SELECT last_active FROM users WHERE user_id=?", (user_id,))
+    return row[0] if row else None
+
+
+def user_exists(user_id: int) -> bool:
+    return _db.fetchone("SELECT 1 FROM users WHERE user_id=?", (user_id,)) is not None
+
+
+def count_users() -> int:
+    return _db.fetchone("SELECT COUNT(*) FROM users")[0]
+
+
+def list_active_sessions() -> List[Tuple[int, int]]:
+    """[(user_id, last_active)] for users that still have active_messages."""
+    return _db.fetchall("""
+        SELECT user_id, COALESCE(last_active, 0) FROM users
+        WHERE data IS NOT NULL AND json_array_length(data, '$.active_messages') > 0
+    """)
+
+
+def list_user_ids() -> List[int]:
+    return [r[0] for r in _db.fetchall("SELECT user_id FROM users ORDER BY user_id")]
+
+
+def list_user_ids_after(after: int, limit: int) -> List[int]:
+    """Up to `limit` user ids above `after`, ascending (keyset page over the primary key)."""
+    return [r[0] for r in _db.fetchall(
+        "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, limit)
+    )]
+
+
+def count_users_after(after: int) -> int:
+    return _db.fetchone("SELECT COUNT(*) FROM users WHERE user_id > ?", (after,))[0]
+
+
+def list_updated_since(ts: int) -> List[int]:
+    """Users whose blob was written at or after `ts` (unix seconds), via idx_users_updated_at."""
+    return [r[0] for r in _db.fetchall("SELECT user_id FROM users WHERE updated_at >= ?", (ts,))]
+
+
+def list_plan_expiries() -> List[Tuple[int, int]]:
+    """[(plan_expires_at, user_id)] for every expiring plan, oldest first (idx_users_plan_expires_at)."""
+    return _db.fetchall(
+        "SELECT plan_expires_at, user_id FROM users WHERE plan_expires_at IS NOT NULL ORDER BY plan_expires_at"
+    )
+
+
+def iter_user_blobs(chunk: int = 1000) -> Iterable[Tuple[int, int, str]]:
+    """Stream (user_id, last_active, data) for every user with a JSON blob, in user_id order."""
+    last_id = None
+    while True:
+        if last_id is None:
+            rows = _reader.fetchall("SELECT user_id, COALESCE(last_active, 0), data FROM users WHERE data IS NOT NULL ORDER BY user_id LIMIT ?", (chunk,))
+        else:
+            rows = _reader.fetchall("SELECT user_id, COALESCE(last_active, 0), data FROM users WHERE data IS NOT NULL AND user_id > ? ORDER BY user_id LIMIT ?", (last_id, chunk))
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+
+# ------------------ EXPORT ------------------
+def export_jsonl_gz(path: str, user_ids: Optional[Iterable[int]] = None, chunk: int = 500) -> Tuple[int, str]:
+    """
+    Write users (all, or just user_ids) as gzip JSON lines, streaming from the
+    table. Returns (users written, sha256 of the file).
+    """
+    written = 0
+    with gzip.open(path, "wb") as out:
+        if user_ids is None:
+            last_id = None
+            while True:
+                if last_id is None:
+                    rows = _reader.fetchall("SELECT user_id, data FROM users WHERE data IS NOT NULL ORDER BY user_id LIMIT ?", (chunk,))
+                else:
+                    rows = _reader.fetchall("SELECT user_id, data FROM users WHERE data IS NOT NULL AND user_id > ? ORDER BY user_id LIMIT ?", (last_id, chunk))
+                if not rows:
+                    break
+                for _, blob in rows:
+                    out.write(blob.encode("utf-8") + b"\n")
+                written += len(rows)
+                last_id = rows[-1][0]
+        else:
+            ids = sorted(set(user_ids))
+            for i in range(0, len(ids), chunk):
+                part = ids[i:i + chunk]
+                marks = ",".join("?" * len(part))
+                rows = _reader.fetchall(f"SELECT user_id, data FROM users WHERE data IS NOT NULL AND user_id IN ({marks})", part)
+                for _, blob in rows:
+                    out.write(blob.encode("utf-8") + b"\n")
+                written += len(rows)
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return written, digest.hexdigest()
+
+
+async def run_export(fn, *args, **kwargs):
+    """Run a full export (export_jsonl_gz, or a consumer of iter_user_blobs) on the reader's thread."""
+    return await _reader.submit(fn, *args, **kwargs)
+
+
+# ------------------ MIGRATION ------------------
+def _get_meta(key: str) -> Optional[str]:
+    row = _db.fetchone("SELECT value FROM meta WHERE key=?", (key,))
+    return row[0] if row else None
+
+
+def _set_meta(key: str, value: str) -> None:
+    _db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def next_sequence(key: str, floor: int = 0) -> int:
+    """Atomically bump a counter kept in the meta table. Returns max(previous + 1, floor)."""
+    def _next(conn):
+        with conn:
+            row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+            value = max(int(row[0]) + 1 if row else 0, floor)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+        return value
+    return _db.call(_next)
+
+
+def raise_sequence(key: str, value: int) -> None:
+    """Make sure the meta counter is at least `value`."""
+    _db.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+        (key, str(value))
+    )
+
+
+def _iter_json_users(folder: str) -> Iterable[Tuple[int, Dict[str, Any]]]:
+    for filename in os.listdir(folder):
+        if not filename.endswith(".json"):
+            continue
+        user_str = filename[:-len(".json")]
+        # Skip files that are not user ids (like 'tasks.json')
+        if not user_str.lstrip("-").isdigit():
+            continue
+        try:
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[UserStore] Skipping unreadable {filename}: {e}")
+            continue
+        if isinstance(data, dict):
+            yield int(user_str), data
+
+
+def migrate_json_users(folder: str = config.DATA_FOLDER, batch_size: int = 500) -> int:
+    """
+    One-shot import of the old per-user db/<id>.json files.
+    Only fills rows that have no JSON blob yet (e.g. written by the old
+    json_save_user). Returns number imported.
+    """
+    if _get_meta("json_users_migrated") or not os.path.isdir(folder):
+        return 0
+
+    imported = 0
+    batch: List[tuple] = []
+
+    def _flush():
+        nonlocal imported
+        imported += _db.executemany("""
+            INSERT INTO users (user_id, username, credits, plan_name, plan_expires_at,
+                               last_active, sponsor_verified, invited_by, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username=excluded.username,
+                credits=excluded.credits,
+                plan_name=excluded.plan_name,
+                plan_expires_at=excluded.plan_expires_at,
+                last_active=excluded.last_active,
+                sponsor_verified=excluded.sponsor_verified,
+                invited_by=excluded.invited_by,
+                data=excluded.data
+            WHERE users.data IS NULL
+        """, batch)
+        batch.clear()
+
+    for user_id, data in _iter_json_users(folder):
+        data["user_id"] = user_id
+        batch.append(to_row(user_id, data))
+        if len(batch) >= batch_size:
+            _flush()
+    if batch:
+        _flush()
+
+    _set_meta("json_users_migrated", str(int(datetime.now().timestamp())))
+    print(f"[UserStore] Migrated {imported} users from {folder}")
+    return imported
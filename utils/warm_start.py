@@ -0,0 +1,130 @@
+# utils/warm_start.py
+"""
+Compact binary snapshot of all users for warm starts.
+
+File layout (little endian):
+    header  magic(8) taken_at(q) count(I) index_offset(Q)
+    data    JSON blobs, back to back
+    index   count x (user_id q, offset Q, length I, last_active q), sorted by user_id
+
+The file is memory-mapped read-only and looked up by binary search over the
+index, so loading is O(1) in the number of users and only touched pages are
+read. Users written to the store at or after `taken_at` are listed in
+`stale` and must be read from the store instead.
+"""
+import os
+import json
+import mmap
+import time
+import sys
+import struct
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+MAGIC = b"USRSNAP1"
+HEADER = struct.Struct("<8sqIQ")
+ENTRY = struct.Struct("<qQIq")
+
+
+def write_snapshot(path: str, rows: Iterable[Tuple[int, int, str]], taken_at: int) -> int:
+    """Write (user_id, last_active, blob) rows, given in user_id order. Returns number of users."""
+    tmp_path = path + ".tmp"
+    index = bytearray()
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        offset = HEADER.size
+        for user_id, last_active, blob in rows:
+            payload = blob.encode("utf-8")
+            f.write(payload)
+            index += ENTRY.pack(user_id, offset, len(payload), last_active or 0)
+            offset += len(payload)
+            count += 1
+        f.write(index)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, taken_at, count, offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class WarmSnapshot:
+    """Read-only view over a snapshot file."""
+
+    def __init__(self, path: str, stale: Optional[Set[int]] = None):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.taken_at, self.count, self._index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a user snapshot")
+        self.stale: Set[int] = stale if stale is not None else set()
+        self.hits = 0
+        self.misses = 0
+
+    def footprint(self) -> Dict[str, int]:
+        """Bytes held by this snapshot: the mapping (of which the index) and the stale set."""
+        return {
+            "mapped": len(self._map),
+            "index": self.count * ENTRY.size,
+            "stale": sys.getsizeof(self.stale),
+        }
+
+    def _find(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        lo, hi = 0, self.count
+        base = self._index_offset
+        while lo < hi:
+            mid = (lo + hi) // 2
+            uid, offset, length, last_active = ENTRY.unpack_from(self._map, base + mid * ENTRY.size)
+            if uid == user_id:
+                return offset, length, last_active
+            if uid < user_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """User dict from the snapshot, or None if absent or written since the snapshot."""
+        if user_id in self.stale:
+            self.misses += 1
+            return None
+        found = self._find(user_id)
+        if found is None:
+            self.misses += 1
+            return None
+        offset, length, last_active = found
+        data = json.loads(self._map[offset:offset + length])
+        data["last_active"] = max(int(data.get("last_active") or 0), last_active)
+        self.hits += 1
+        return data
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+def load_snapshot(path: str, stale_since) -> Optional[WarmSnapshot]:
+    """
+    Map a snapshot and collect users changed since it was taken.
+    `stale_since(ts)` returns the ids written at or after ts.
+    Prints load time and memory footprint.
+    """
+    if not os.path.exists(path):
+        return None
+    started = time.perf_counter()
+    try:
+        snap = WarmSnapshot(path)
+        snap.stale = set(stale_since(snap.taken_at))
+    except Exception as e:
+        print(f"[WarmStart] Ignoring snapshot {path}: {e}")
+        return None
+    elapsed = (time.perf_counter() - started) * 1000
+    size = snap.footprint()
+    print(
+        f"[WarmStart] Mapped {snap.count} users from {os.path.basename(path)} in {elapsed:.1f} ms "
+        f"(mapped {size['mapped'] / 1024:.0f} KB, index {size['index'] / 1024:.0f} KB, "
+        f"{len(snap.stale)} stale in {size['stale'] / 1024:.0f} KB)"
+    )
+    return snap